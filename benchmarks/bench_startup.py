@@ -0,0 +1,69 @@
+"""
+Measures cold start of each package: the time to import it and the time for
+startup() to open the database and start the Resonate node. Each run is a
+fresh interpreter, so nothing is cached in-process between runs.
+
+The Resonate server does not need to be running; the poller connects in the
+background. Service databases are created next to the package sources as in
+development.
+
+    python benchmarks/bench_startup.py --runs 10
+"""
+
+import subprocess
+import statistics
+import argparse
+import json
+import sys
+import os
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+PACKAGES = ["gateway", "customers", "orders", "products"]
+
+PROBE = """
+import json, threading, time
+started = time.perf_counter()
+import {package} as module
+imported = time.perf_counter()
+threads = threading.active_count()
+module.startup()
+ready = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "startup_ms": (ready - imported) * 1000,
+    "import_threads": threads,
+}}))
+"""
+
+
+def probe(package):
+    env = {**os.environ, "PYTHONPATH": os.path.join(ROOT, package, "src")}
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(package=package)],
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{package} failed to start:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--packages", nargs="+", default=PACKAGES)
+    args = parser.parse_args()
+
+    print(f"{'package':<10} {'import ms':>10} {'startup ms':>11} {'threads at import':>18}")
+    for package in args.packages:
+        runs = [probe(package) for _ in range(args.runs)]
+        import_ms = statistics.median(run["import_ms"] for run in runs)
+        startup_ms = statistics.median(run["startup_ms"] for run in runs)
+        threads = max(run["import_threads"] for run in runs)
+        print(f"{package:<10} {import_ms:>10.1f} {startup_ms:>11.1f} {threads:>18}")
+
+
+if __name__ == "__main__":
+    main()
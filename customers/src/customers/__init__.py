@@ -1,22 +1,58 @@
-from resonate.task_sources.poller import Poller
 from resonate.stores.remote import RemoteStore
 from resonate.resonate import Resonate
 from .log_config import setup_logger
+from .codec import install_payload_encoder, install_wire_encoder
+from .profiling import Profiler, start_profiling
+from .backup import backup_settings, restore_command, start_backups
+from .node import (
+    node_gauges,
+    node_settings,
+    resize_worker_pool,
+    start_admin_server,
+    start_pollers,
+)
+from .replica import ReplicaDatabase
 from threading import Event
 import sqlite3
 import os
 
 logger = setup_logger(__name__)
 
-store = RemoteStore(url="http://localhost:8001")
-resonate = Resonate(
-    store=store,
-    task_source=Poller(url="http://localhost:8002", group="customers-service-nodes"),
+# Primary nodes own the database and serve reads and writes. Replica nodes poll
+# a separate read group and serve lookups from a periodically refreshed copy.
+CUSTOMERS_ROLE = os.getenv("CUSTOMERS_ROLE", "primary")
+CUSTOMERS_DB_PATH = os.path.join(os.path.dirname(__file__), "customers.db")
+CUSTOMERS_REPLICA_SOURCE = os.getenv("CUSTOMERS_REPLICA_SOURCE", CUSTOMERS_DB_PATH)
+CUSTOMERS_REPLICA_REFRESH_SECONDS = float(
+    os.getenv("CUSTOMERS_REPLICA_REFRESH_SECONDS", "5")
 )
 
+node = node_settings("CUSTOMERS")
+
+# Primary nodes also poll an interactive group, which the gateway sends the
+# reads behind its views to, and run its tasks ahead of the others.
+if CUSTOMERS_ROLE == "replica":
+    poll_group = "customers-service-read-nodes"
+    interactive_group = None
+else:
+    poll_group = "customers-service-nodes"
+    interactive_group = "customers-service-interactive-nodes" if node["interactive"] else None
+backup_config = backup_settings("CUSTOMERS")
+store = None
+poller = None
+resonate = None
+# Only primary nodes back up the database.
+backups = None
+registered_functions = []
+profiler = Profiler("customers")
+
+
+def register(func):
+    registered_functions.append(func)
+    return func
 
-def start_customer_db():
-    db_path = os.path.join(os.path.dirname(__file__), "customers.db")
+
+def start_customer_db(db_path=CUSTOMERS_DB_PATH):
     db = sqlite3.connect(db_path, check_same_thread=False)
     stmt = db.cursor()
     stmt.execute(
@@ -34,7 +70,7 @@ def start_customer_db():
     return db
 
 
-@resonate.register
+@register
 def get_customer(ctx, customer_email):
     try:
         logger.info(f"getting customer with email {customer_email}")
@@ -54,7 +90,7 @@ def get_customer(ctx, customer_email):
         raise Exception(f"Error retrieving customer: {str(e)}")
 
 
-@resonate.register
+@register
 def create_customer(ctx, data):
    
     try:
@@ -88,7 +124,7 @@ def create_customer(ctx, data):
         raise Exception(f"Error inserting into customers: {str(e)}")
 
 
-@resonate.register
+@register
 def get_customers(ctx):
     db = ctx.get_dependency("customer-db")
     try:
@@ -109,15 +145,92 @@ def get_customers(ctx):
         raise Exception(f"Error retrieving customer: {str(e)}")
 
 
-resonate.set_dependency("customer-db", start_customer_db())
+# Emails bound per IN query, well below SQLite's host parameter limit.
+EMAILS_PER_QUERY = 500
+
+
+@register
+def get_customers_by_emails(ctx, emails):
+    db = ctx.get_dependency("customer-db")
+    try:
+        stmt = db.cursor()
+        emails = sorted(set(emails))
+        customers = []
+        for start in range(0, len(emails), EMAILS_PER_QUERY):
+            batch = emails[start : start + EMAILS_PER_QUERY]
+            placeholders = ", ".join("?" * len(batch))
+            stmt.execute(
+                f"SELECT * FROM customers WHERE customer_email IN ({placeholders})",
+                batch,
+            )
+            columns = [column[0] for column in stmt.description]
+            customers.extend(dict(zip(columns, row)) for row in stmt.fetchall())
+        return {
+            "success": True,
+            "message": f"{len(customers)} of {len(emails)} customers retrieved",
+            "customers": customers,
+        }
+    except Exception as e:
+        logger.error(f"error retrieving customers by email: {e}")
+        raise Exception(f"Error retrieving customers: {str(e)}")
+
+
+def startup():
+    """
+    Opens the database and connects the node to the Resonate server. Importing
+    the module has no side effects; main() calls this before serving.
+    :return: The Resonate instance.
+    """
+    global store, poller, resonate, backups
+    if CUSTOMERS_ROLE == "replica":
+        db = ReplicaDatabase(CUSTOMERS_REPLICA_SOURCE, CUSTOMERS_REPLICA_REFRESH_SECONDS)
+    else:
+        db = start_customer_db()
+        backups = start_backups(db, "customers", backup_config)
+    store = RemoteStore(url="http://localhost:8001")
+    install_wire_encoder(store)
+    poller = start_pollers(
+        "http://localhost:8002", poll_group, interactive_group, node, store
+    )
+    resonate = Resonate(store=store, task_source=poller)
+    install_payload_encoder(resonate)
+    resize_worker_pool(resonate, node["workers"])
+    if interactive_group is not None:
+        poller.prioritize(resonate, node["interactive_workers"])
+    for func in registered_functions:
+        profiler.register(resonate, func)
+    resonate.set_dependency("customer-db", db)
+    start_profiling(profiler)
+    return resonate
 
 
 # Define a main function to start the Application Node
 def main():
-    logger.info("customers service app node running")
+    startup()
+    logger.info(f"customers service app node running as {CUSTOMERS_ROLE}")
+    if node["admin_port"]:
+        start_admin_server(
+            node["admin_port"],
+            {
+                "/gauges": lambda: node_gauges(resonate, poller),
+                **profiler.admin_routes(),
+                **(backups.admin_routes() if backups else {}),
+            },
+            {
+                **profiler.admin_actions(),
+                **(backups.admin_actions() if backups else {}),
+            },
+        )
     Event().wait()
 
 
+def restore():
+    """
+    Restores the customers database from a backup; the node must be stopped.
+    """
+    restore_command("customers", CUSTOMERS_DB_PATH, backup_config)
+
+
 # Run the main function when the script is executed
 if __name__ == "__main__":
     main()
@@ -0,0 +1,368 @@
+from resonate.task_sources.poller import Poller
+from resonate.stores.record import TaskRecord
+from resonate.cmd_queue import Claim
+from resonate.targets import poll
+from resonate import utils
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .log_config import setup_logger
+from collections import deque
+from threading import Condition, Thread, current_thread
+import requests
+import json
+import time
+import os
+
+logger = setup_logger(__name__)
+
+
+def node_settings(prefix):
+    """
+    Reads the task execution settings of a service node from the environment.
+    :param prefix: Environment variable prefix of the service, e.g. "CUSTOMERS".
+    :return: Dictionary of settings.
+    """
+    return {
+        # threads executing registered functions
+        "workers": int(os.getenv(f"{prefix}_WORKERS", "4")),
+        # claimed tasks that have not completed yet
+        "max_inflight": int(os.getenv(f"{prefix}_MAX_INFLIGHT", "16")),
+        # free slots required before a saturated node polls again
+        "poll_batch": int(os.getenv(f"{prefix}_POLL_BATCH", "4")),
+        # primary nodes also poll the service's interactive group
+        "interactive": os.getenv(f"{prefix}_INTERACTIVE", "1") == "1",
+        # threads that only run tasks of the interactive group, on top of
+        # workers, which run them before any other
+        "interactive_workers": int(os.getenv(f"{prefix}_INTERACTIVE_WORKERS", "2")),
+        # claimed interactive tasks that have not completed yet
+        "interactive_max_inflight": int(
+            os.getenv(f"{prefix}_INTERACTIVE_MAX_INFLIGHT", "16")
+        ),
+        "admin_port": os.getenv(f"{prefix}_ADMIN_PORT"),
+    }
+
+
+class BoundedPoller(Poller):
+    """
+    Poller that stops claiming tasks while the node is saturated.
+
+    The poll stream is closed once max_inflight tasks are claimed and not yet
+    completed, so the server hands new tasks to other nodes in the group. The
+    node reconnects when at least poll_batch slots are free again.
+    """
+
+    def __init__(self, url, group, max_inflight, poll_batch):
+        super().__init__(url=url, group=group)
+        self.max_inflight = max_inflight
+        self.poll_batch = max(1, min(poll_batch, max_inflight))
+        self.inflight = 0
+        self.polling = False
+        self._claimed = set()
+        self._capacity = Condition()
+
+    def track(self, store):
+        """
+        Releases a slot whenever the scheduler completes a task this poller
+        claimed. Must be called before the store is handed to Resonate.
+        """
+        complete = store.tasks.complete
+
+        def tracked_complete(*, task_id, counter):
+            try:
+                complete(task_id=task_id, counter=counter)
+            finally:
+                self._release(task_id)
+
+        store.tasks.complete = tracked_complete
+
+    def _acquire(self, task_id):
+        with self._capacity:
+            self._claimed.add(task_id)
+            self.inflight = len(self._claimed)
+            return self.inflight >= self.max_inflight
+
+    def _release(self, task_id):
+        with self._capacity:
+            if task_id not in self._claimed:
+                return
+            self._claimed.discard(task_id)
+            self.inflight = len(self._claimed)
+            self._capacity.notify_all()
+
+    def _wait_for_capacity(self):
+        with self._capacity:
+            self._capacity.wait_for(
+                lambda: self.max_inflight - self.inflight >= self.poll_batch
+            )
+
+    @utils.exit_on_exception
+    def _run(self, cmd_queue, pid):
+        url = f"{self._url}/{self._group}/{pid}"
+
+        while True:
+            self._wait_for_capacity()
+            saturated = False
+            try:
+                with requests.get(url, stream=True) as res:
+                    if not res.ok:
+                        break
+                    self.polling = True
+
+                    for line in res.iter_lines(chunk_size=None, decode_unicode=True):
+                        if not line:
+                            continue
+
+                        stripped = line.strip()
+                        if not stripped.startswith("data:"):
+                            continue
+
+                        info = self._encoder.decode(stripped[5:])
+                        if "task" not in info:
+                            continue
+
+                        task = TaskRecord.decode(info["task"], encoder=self._encoder)
+                        saturated = self._acquire(task.task_id)
+                        cmd_queue.put(Claim(task))
+
+                        if saturated:
+                            logger.info(
+                                f"{self.inflight} tasks in flight, pausing polling on {self._group}"
+                            )
+                            break
+
+            except requests.exceptions.ConnectionError:
+                logger.warning("Connection to poller failed, reconnecting")
+            finally:
+                self.polling = False
+
+            if not saturated:
+                time.sleep(1)
+
+    def gauges(self):
+        return {
+            "inflight_tasks": self.inflight,
+            "max_inflight": self.max_inflight,
+            "polling": self.polling,
+        }
+
+
+class PollGroups:
+    """
+    Polls a service's default group and its interactive group on separate
+    streams, each bounded by its own in-flight limit, so that a backlog of
+    order steps in the default group never stops the node from claiming
+    interactive reads. Callbacks for the node arrive on the default group.
+    Resonate only starts a task source, so like Poller it cannot be stopped.
+    """
+
+    def __init__(self, url, group, interactive_group, settings):
+        """
+        :param settings: The node's settings, from node_settings().
+        """
+        self.default = BoundedPoller(
+            url, group, settings["max_inflight"], settings["poll_batch"]
+        )
+        self.interactive = BoundedPoller(
+            url,
+            interactive_group,
+            settings["interactive_max_inflight"],
+            settings["poll_batch"],
+        )
+        self.interactive_group = interactive_group
+        self.priority = None
+
+    def track(self, store):
+        self.default.track(store)
+        self.interactive.track(store)
+
+    def start(self, cmd_queue, pid):
+        self.default.start(cmd_queue, pid)
+        self.interactive.start(cmd_queue, pid)
+
+    def default_recv(self, pid):
+        return self.default.default_recv(pid)
+
+    def prioritize(self, resonate, reserved_workers):
+        """
+        Runs the tasks of the interactive group ahead of all others, with
+        reserved_workers more threads that run nothing else.
+        """
+        self.priority = TaskPriority(resonate, poll(self.interactive_group))
+        self.priority.start_reserved_workers(reserved_workers)
+
+    def gauges(self):
+        result = self.default.gauges()
+        for key, value in self.interactive.gauges().items():
+            result[f"interactive_{key}"] = value
+        if self.priority is not None:
+            result.update(self.priority.gauges())
+        return result
+
+
+class TaskPriority:
+    """
+    Reorders the queue of executions waiting for a worker so that executions
+    of tasks sent to the interactive group, and of the functions they call
+    locally, are taken first. Threads started by start_reserved_workers only
+    take those. resonate-sdk 0.4.8 has a single FIFO queue and no hook for
+    this, so the queue's storage methods are replaced on the instance; the
+    threads already waiting on it pick up the new methods when woken.
+    """
+
+    def __init__(self, resonate, interactive_target):
+        """
+        :param interactive_target: The interactive group as tasks are tagged,
+            e.g. "poll://orders-service-interactive-nodes".
+        """
+        scheduler = resonate._scheduler
+        self._scheduler = scheduler
+        self._processor = scheduler._processor
+        self._target = interactive_target
+        self._interactive = deque()
+        self._other = deque()
+        self._reserved = set()
+        self.interactive_started = 0
+        queue = self._processor._sq
+        with queue.mutex:
+            self._other.extend(queue.queue)
+            queue.queue.clear()
+            queue._put = self._put
+            queue._get = self._get
+            queue._qsize = self._qsize
+            queue.put = self._notifying_put(queue)
+
+    def _notifying_put(self, queue):
+        # Every waiter is woken, since a reserved worker cannot take every item.
+        def put(item, block=True, timeout=None):
+            with queue.not_empty:
+                queue._put(item)
+                queue.unfinished_tasks += 1
+                queue.not_empty.notify_all()
+
+        return put
+
+    def _is_interactive(self, sqe):
+        # Called on the scheduler thread, which owns the records.
+        record = self._scheduler._records.get(sqe.id)
+        if record is None:
+            return False
+        promise = record.root().durable_promise
+        return promise is not None and (promise.tags or {}).get(
+            "resonate:invoke"
+        ) == self._target
+
+    def _put(self, sqe):
+        if self._is_interactive(sqe):
+            self._interactive.append(sqe)
+            self.interactive_started += 1
+        else:
+            self._other.append(sqe)
+
+    def _get(self):
+        if self._interactive:
+            return self._interactive.popleft()
+        return self._other.popleft()
+
+    def _qsize(self):
+        if current_thread() in self._reserved:
+            return len(self._interactive)
+        return len(self._interactive) + len(self._other)
+
+    def start_reserved_workers(self, count):
+        cmd_queue = self._scheduler._cmd_queue
+        for _ in range(count):
+            thread = Thread(target=self._processor._run, args=(cmd_queue,), daemon=True)
+            self._reserved.add(thread)
+            self._processor._threads.add(thread)
+            thread.start()
+
+    def gauges(self):
+        return {
+            "interactive_workers": len(self._reserved),
+            "interactive_queue_depth": len(self._interactive),
+            "interactive_executions": self.interactive_started,
+        }
+
+
+def start_pollers(url, group, interactive_group, settings, store):
+    """
+    :param interactive_group: The service's interactive group, or None for
+        nodes that only poll group, such as read replicas.
+    :return: The node's task source, tracking completions on store.
+    """
+    if interactive_group is None:
+        poller = BoundedPoller(
+            url, group, settings["max_inflight"], settings["poll_batch"]
+        )
+    else:
+        poller = PollGroups(url, group, interactive_group, settings)
+    poller.track(store)
+    return poller
+
+
+def resize_worker_pool(resonate, workers):
+    """
+    Grows the pool of threads executing registered functions. resonate-sdk
+    0.4.8 starts a fixed pool of four threads and has no public setting, so the
+    extra threads are started on the scheduler's processor directly.
+    """
+    scheduler = resonate._scheduler
+    processor = scheduler._processor
+    extra = workers - processor._workers
+    if extra < 0:
+        logger.warning(
+            f"worker pool cannot shrink below {processor._workers}, ignoring {workers}"
+        )
+        return
+    if extra > 0:
+        processor._workers = extra
+        processor.start(scheduler._cmd_queue, scheduler._pid)
+        processor._workers = workers
+
+
+def node_gauges(resonate, poller):
+    processor = resonate._scheduler._processor
+    return {
+        **poller.gauges(),
+        "workers": processor._workers,
+        # executions waiting for a free worker
+        "queue_depth": processor._sq.qsize(),
+    }
+
+
+def start_admin_server(port, routes, actions=None):
+    """
+    Serves JSON from a background thread.
+    :param port: Port to listen on.
+    :param routes: Dictionary mapping paths served on GET to functions
+        returning JSON data.
+    :param actions: The same for paths that change state, served on POST only
+        so that a browser or link prefetcher cannot trigger them.
+    """
+    actions = actions or {}
+
+    class AdminHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.serve(routes, actions)
+
+        def do_POST(self):
+            self.serve(actions, routes)
+
+        def serve(self, handlers, others):
+            route = handlers.get(self.path)
+            if route is None:
+                self.send_error(405 if self.path in others else 404)
+                return
+            body = json.dumps(route()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", int(port)), AdminHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"admin server listening on port {port}")
+    return server
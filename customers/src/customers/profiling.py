@@ -0,0 +1,301 @@
+from .log_config import setup_logger
+from collections import Counter
+from functools import wraps
+from inspect import isgeneratorfunction
+from threading import Lock, Thread, get_ident
+import tracemalloc
+import json
+import time
+import sys
+import os
+
+logger = setup_logger(__name__)
+
+# Profiling starts with the process when PROFILE=1, and can be switched on and
+# off at runtime through the admin endpoints.
+PROFILE = os.getenv("PROFILE", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "10"))
+PROFILE_TRACEMALLOC = os.getenv("PROFILE_TRACEMALLOC", "0") == "1"
+TRACEMALLOC_FRAMES = 16
+TOP_ALLOCATIONS = 50
+
+
+class Profiler:
+    """
+    Wall time, CPU time and sampled stacks of wrapped functions.
+
+    While enabled, every call of a wrapped function is timed, and a sampler
+    thread records the stack of each thread that is inside one. stop() writes
+    per-function aggregates, the sampled stacks in the folded format read by
+    flamegraph.pl and speedscope and, with tracemalloc, the top allocation
+    sites. Functions registered with Resonate through register() run unwrapped
+    while profiling is disabled; start() and stop() swap the wrappers in and
+    out, so a suspended workflow holds no extra frame. Other wrapped calls
+    cost one attribute check while disabled.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.enabled = False
+        self.started_at = None
+        self._lock = Lock()
+        self._functions = {}
+        self._stacks = Counter()
+        self._active = {}
+        self._wrappers = set()
+        self._profiled = {}
+        self._registered = []
+        self._baseline = None
+        self._generation = 0
+
+    def wrap(self, func, name=None):
+        """
+        :param func: Function or generator function to profile.
+        :param name: Name in the output, the function name by default.
+        :return: A wrapper of the same kind, so Resonate still recognizes
+        workflows.
+        """
+        name = name or func.__name__
+
+        if isgeneratorfunction(func):
+
+            @wraps(func)
+            def profiled_generator(*args, **kwargs):
+                # Only the time spent running a step counts, not the time
+                # the workflow waits on the promises it yields.
+                gen = func(*args, **kwargs)
+                send, value, first = gen.send, None, True
+                while True:
+                    try:
+                        with self._measure(name, first):
+                            yielded = send(value)
+                    except StopIteration as e:
+                        return e.value
+                    first = False
+                    try:
+                        value = yield yielded
+                        send = gen.send
+                    except GeneratorExit:
+                        gen.close()
+                        raise
+                    except BaseException as e:
+                        send, value = gen.throw, e
+
+            self._wrappers.add(profiled_generator.__code__)
+            self._profiled[func] = profiled_generator
+            return profiled_generator
+
+        @wraps(func)
+        def profiled(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            with self._measure(name, True):
+                return func(*args, **kwargs)
+
+        self._wrappers.add(profiled.__code__)
+        self._profiled[func] = profiled
+        return profiled
+
+    def register(self, resonate, func):
+        """
+        Registers func with Resonate under its own name. Resonate finds the
+        profiled wrapper under the same name, and runs it instead of func
+        while profiling is enabled.
+        :param resonate: Resonate instance of this process.
+        :param func: Function or generator function to register.
+        """
+        profiled = self._profiled.get(func) or self.wrap(func)
+        resonate.register(func)
+        # Both are indexed, so either can be passed to resonate.run().
+        registry = resonate._registry
+        registry._index[profiled] = func.__name__
+        self._registered.append((registry, func))
+        self._swap()
+
+    def active(self, func):
+        """
+        :return: The function Resonate runs for func right now, the profiled
+        wrapper while profiling is enabled.
+        """
+        return self._profiled.get(func, func) if self.enabled else func
+
+    def _swap(self):
+        for registry, func in self._registered:
+            _, options = registry._store[func.__name__]
+            registry._store[func.__name__] = (self.active(func), options)
+
+    def _measure(self, name, counted):
+        return Measurement(self, name, counted)
+
+    def _stats(self, name):
+        stats = self._functions.get(name)
+        if stats is None:
+            stats = self._functions[name] = {
+                "calls": 0,
+                "errors": 0,
+                "wall_seconds": 0.0,
+                "cpu_seconds": 0.0,
+                "max_seconds": 0.0,
+                "samples": 0,
+            }
+        return stats
+
+    def _record(self, name, counted, wall, cpu, failed):
+        with self._lock:
+            stats = self._stats(name)
+            stats["calls"] += counted
+            stats["errors"] += failed
+            stats["wall_seconds"] += wall
+            stats["cpu_seconds"] += cpu
+            stats["max_seconds"] = max(stats["max_seconds"], wall)
+
+    def _sample(self, interval, generation):
+        while self.enabled and self._generation == generation:
+            frames = sys._current_frames()
+            for thread_id, name in list(self._active.items()):
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None and frame.f_code not in self._wrappers:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+                    )
+                    frame = frame.f_back
+                if frame is None:
+                    continue
+                stack.append(name)
+                with self._lock:
+                    self._stacks[";".join(reversed(stack))] += 1
+                    self._stats(name)["samples"] += 1
+            del frames
+            time.sleep(interval)
+
+    def start(self):
+        """
+        Clears previous results and starts profiling.
+        """
+        with self._lock:
+            if self.enabled:
+                return self.state()
+            self._functions = {}
+            self._stacks = Counter()
+            self.started_at = time.time()
+            if PROFILE_TRACEMALLOC:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(TRACEMALLOC_FRAMES)
+                self._baseline = tracemalloc.take_snapshot()
+            self._generation += 1
+            self.enabled = True
+            self._swap()
+        Thread(
+            target=self._sample,
+            args=(PROFILE_SAMPLE_INTERVAL_MS / 1000, self._generation),
+            daemon=True,
+        ).start()
+        logger.info(f"profiling {self.service} started")
+        return self.state()
+
+    def stop(self):
+        """
+        Stops profiling and writes the results.
+        :return: State including the paths written.
+        """
+        if not self.enabled:
+            return self.state()
+        self.enabled = False
+        self._swap()
+        paths = self.dump()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            self._baseline = None
+        logger.info(f"profiling {self.service} stopped, wrote {', '.join(paths)}")
+        return {**self.state(), "written": paths}
+
+    def dump(self, directory=PROFILE_DIR):
+        """
+        Writes the results gathered so far.
+        :return: Paths of the files written.
+        """
+        os.makedirs(directory, exist_ok=True)
+        prefix = os.path.join(
+            directory, f"{self.service}-{os.getpid()}-{int(self.started_at or time.time())}"
+        )
+        with self._lock:
+            functions = dict(self._functions)
+            stacks = list(self._stacks.items())
+        paths = [f"{prefix}.functions.json", f"{prefix}.folded"]
+        with open(paths[0], "w") as f:
+            json.dump(functions, f, indent=2, sort_keys=True)
+        with open(paths[1], "w") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in stacks)
+        if tracemalloc.is_tracing():
+            paths.append(f"{prefix}.tracemalloc.txt")
+            self._write_allocations(paths[-1])
+        return paths
+
+    def _write_allocations(self, path):
+        snapshot = tracemalloc.take_snapshot()
+        with open(path, "w") as f:
+            f.write(f"top {TOP_ALLOCATIONS} allocation sites\n")
+            for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+                f.write(f"{stat}\n")
+            if self._baseline is not None:
+                f.write(f"\ntop {TOP_ALLOCATIONS} growth since profiling started\n")
+                for stat in snapshot.compare_to(self._baseline, "lineno")[:TOP_ALLOCATIONS]:
+                    f.write(f"{stat}\n")
+
+    def state(self):
+        with self._lock:
+            functions = {name: dict(stats) for name, stats in self._functions.items()}
+        return {
+            "enabled": self.enabled,
+            "started_at": self.started_at,
+            "tracemalloc": tracemalloc.is_tracing(),
+            "functions": functions,
+        }
+
+    def admin_routes(self):
+        """
+        :return: Routes for start_admin_server.
+        """
+        return {"/profile": self.state}
+
+    def admin_actions(self):
+        """
+        :return: Actions for start_admin_server.
+        """
+        return {"/profile/start": self.start, "/profile/stop": self.stop}
+
+
+class Measurement:
+    def __init__(self, profiler, name, counted):
+        self.profiler = profiler
+        self.name = name
+        self.counted = counted
+
+    def __enter__(self):
+        self.thread_id = get_ident()
+        self.outer = self.profiler._active.get(self.thread_id)
+        self.profiler._active[self.thread_id] = self.name
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.wall
+        cpu = time.thread_time() - self.cpu
+        if self.outer is None:
+            self.profiler._active.pop(self.thread_id, None)
+        else:
+            self.profiler._active[self.thread_id] = self.outer
+        failed = exc_type is not None and exc_type is not StopIteration
+        self.profiler._record(self.name, self.counted, wall, cpu, failed)
+        return False
+
+
+def start_profiling(profiler):
+    """
+    Starts profiling when PROFILE=1.
+    """
+    if PROFILE:
+        profiler.start()
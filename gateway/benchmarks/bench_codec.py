@@ -0,0 +1,153 @@
+"""
+Compares payload codecs on the view payloads the gateway reads from the
+promise store: encode and decode CPU time, and bytes on the wire after the
+store's base64 layer.
+
+Products come from the committed products database; customers, carts and
+orders are generated with the columns of the customers and orders tables.
+
+    python benchmarks/bench_codec.py --customers 500 --orders 200
+"""
+
+from gateway.codec import PayloadEncoder, WireEncoder
+import argparse
+import sqlite3
+import random
+import time
+import os
+
+PRODUCTS_DB = os.path.join(
+    os.path.dirname(__file__), "..", "..", "products", "src", "products", "products.db"
+)
+
+
+def load_products():
+    db = sqlite3.connect(f"file:{PRODUCTS_DB}?mode=ro", uri=True)
+    db.row_factory = sqlite3.Row
+    products = [dict(row) for row in db.execute("SELECT * FROM products")]
+    db.close()
+    return products
+
+
+def make_customer(n):
+    return {
+        "id": n,
+        "customer_email": f"customer-{n}@example.com",
+        "customer_name": f"Customer {n}",
+        "customer_delivery_address": f"{n} Example Street, Springfield",
+    }
+
+
+def make_items(products, key, value, count):
+    return [
+        {
+            "item_id": n,
+            key: value,
+            "product_name": product["product_name"],
+            "product_display": product["product_display"],
+            "product_price": product["product_price"],
+            "product_image": product["product_image"],
+        }
+        for n, product in enumerate(random.choices(products, k=count))
+    ]
+
+
+def make_order(products, order_id, customer):
+    items = make_items(products, "order_id", order_id, random.randint(1, 6))
+    items_total = sum(item["product_price"] for item in items)
+    order = {
+        "order_id": order_id,
+        "order_status": "restaurant_confirmed",
+        "order_total": items_total + 5,
+        "order_delivery_fee": 5,
+        "order_items_total": items_total,
+        "customer_email": customer["customer_email"],
+        "customer_name": customer["customer_name"],
+        "customer_delivery_address": customer["customer_delivery_address"],
+        "order_date": "2024-11-20 18:32:11",
+        "items": items,
+    }
+    for column in (
+        "payment_confirmation_promise_id",
+        "restaurant_confirmation_promise_id",
+        "ready_for_pickup_promise_id",
+        "driver_confirmation_promise_id",
+        "out_for_delivery_promise_id",
+        "delivery_confirmation_promise_id",
+    ):
+        order[column] = f"order-{order_id}.{random.randint(1, 20)}"
+    return order
+
+
+def make_payloads(customer_count, order_count):
+    random.seed(1)
+    products = load_products()
+    customers = [make_customer(n) for n in range(customer_count)]
+    orders = [
+        make_order(products, n, random.choice(customers)) for n in range(order_count)
+    ]
+    customer = customers[0]
+    cart = {
+        "cart_id": 1,
+        "customer_email": customer["customer_email"],
+        "cart_total": 0,
+        "items": make_items(products, "cart_id", 1, 4),
+    }
+    return {
+        "cart": {"success": True, "message": "cart retrieved", "cart": cart},
+        "customer_view": {
+            "success": True,
+            "message": "customer view retrieved successfully",
+            "customer_view": {
+                "customer": customer,
+                "cart": cart,
+                "orders": orders[:20],
+                "products": products,
+            },
+        },
+        "restaurant_view": {
+            "success": True,
+            "message": "restaurant view retrieved successfully",
+            "restaurant_view": {
+                "in_progress_orders": orders,
+                "customers": customers,
+                "products": products,
+            },
+        },
+    }
+
+
+def measure(encoder, wire, payload, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        data = wire.encode(encoder.encode(payload))
+    encode_us = (time.perf_counter() - started) / rounds * 1e6
+    started = time.perf_counter()
+    for _ in range(rounds):
+        encoder.decode(wire.decode(data))
+    decode_us = (time.perf_counter() - started) / rounds * 1e6
+    return len(data), encode_us, decode_us
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--customers", type=int, default=500)
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    codecs = {
+        "json": PayloadEncoder("json"),
+        "msgpack": PayloadEncoder("msgpack", compress_bytes=None),
+        "msgpack+zstd": PayloadEncoder("msgpack"),
+    }
+    wire = WireEncoder()
+    print(f"{'payload':<16} {'codec':<13} {'wire bytes':>11} {'encode us':>10} {'decode us':>10}")
+    for name, payload in make_payloads(args.customers, args.orders).items():
+        for codec, encoder in codecs.items():
+            size, encode_us, decode_us = measure(encoder, wire, payload, args.rounds)
+            print(f"{name:<16} {codec:<13} {size:>11} {encode_us:>10.1f} {decode_us:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Compares Flask's standard library JSON provider with the orjson provider on
+the gateway's response and request shapes: jsonify of carts and views, and
+parsing of request bodies.
+
+    python benchmarks/bench_json.py --customers 500 --orders 200
+"""
+
+from bench_codec import make_payloads
+from flask.json.provider import DefaultJSONProvider
+from gateway.json_provider import OrjsonProvider
+from flask import Flask
+import argparse
+import time
+
+
+def request_bodies(payloads):
+    cart = payloads["cart"]["cart"]
+    return {
+        "cart_add": {
+            "order_id": cart["cart_id"],
+            "customer_email": cart["customer_email"],
+            "product": cart["items"][0],
+        },
+        "order_start": {"order_id": 1, "customer_email": cart["customer_email"]},
+    }
+
+
+def measure(fn, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--customers", type=int, default=500)
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    payloads = make_payloads(args.customers, args.orders)
+    app = Flask(__name__)
+    providers = {"stdlib": DefaultJSONProvider(app), "orjson": OrjsonProvider(app)}
+
+    print(f"{'shape':<16} {'operation':<9} {'stdlib us':>10} {'orjson us':>10} {'speedup':>8}")
+    with app.app_context():
+        rows = []
+        for name, payload in payloads.items():
+            timings = [
+                measure(lambda: provider.response(payload).get_data(), args.rounds)
+                for provider in providers.values()
+            ]
+            rows.append((name, "response", *timings))
+        for name, body in request_bodies(payloads).items():
+            text = providers["stdlib"].dumps(body)
+            timings = [
+                measure(lambda: provider.loads(text), args.rounds * 50)
+                for provider in providers.values()
+            ]
+            rows.append((name, "parse", *timings))
+        for name, operation, stdlib_us, orjson_us in rows:
+            print(
+                f"{name:<16} {operation:<9} {stdlib_us:>10.1f} {orjson_us:>10.1f} {stdlib_us / orjson_us:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
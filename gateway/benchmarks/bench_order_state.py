@@ -0,0 +1,228 @@
+"""
+Measures the memory held by suspended order workflows and how long a gateway
+takes to bring them back after a restart.
+
+Starts --orders concurrent order_workflow generators against an in-memory
+stand-in for the Resonate store and service nodes, leaving every order waiting
+on payment. It then reports the state retained per waiting order and the
+process RSS. A restart is simulated by dropping every generator and replaying
+each order from the top against the recorded promise results, as Resonate does
+when a gateway comes back. Exits non-zero if the retained state per order is
+above --max-bytes-per-order. The workflow is the one the gateway runs, with
+--profile the profiled wrapper it runs while profiling is enabled.
+
+    python benchmarks/bench_order_state.py --orders 100000
+"""
+
+from gateway import order_workflow, profiler
+from inspect import isgenerator
+import argparse
+import resource
+import logging
+import time
+import sys
+import gc
+
+# Locals of the profiling wrapper shared by every order: the profiler and the
+# function it wraps.
+SHARED_LOCALS = ("self", "func")
+
+
+class Call:
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+
+    def options(self, **kwargs):
+        return self
+
+
+class Promise:
+    def __init__(self, id):
+        self.id = id
+
+
+class StandInStore:
+    """
+    Durable results keyed by promise id. Promise ids are derived from the
+    workflow id and the position of the call, so a replay finds the results of
+    the calls made before the restart. Promises created with rfi stay pending
+    until they appear in resolved.
+    """
+
+    def __init__(self, items_per_order=5):
+        self.results = {}
+        self.resolved = {}
+        self.items_per_order = items_per_order
+
+    def call(self, func, args):
+        if func == "get_order_by_id":
+            order_id = args[0]
+            return {
+                "success": True,
+                "message": "order retrieved successfully",
+                "order": {
+                    "order_id": order_id,
+                    "customer_email": f"customer-{order_id}@example.com",
+                    "order_status": "new",
+                    "order_total": 42.5,
+                    "items": [
+                        {
+                            "order_id": order_id,
+                            "product_name": f"product-{n}",
+                            "product_price": 8.5,
+                            "quantity": 1,
+                        }
+                        for n in range(self.items_per_order)
+                    ],
+                },
+            }
+        if func == "get_customer":
+            return {
+                "success": True,
+                "message": "customer retrieved successfully",
+                "customer": {
+                    "customer_email": args[0],
+                    "customer_name": "Customer Name",
+                    "customer_delivery_address": "123 Example Street, Springfield",
+                },
+            }
+        return {"success": True, "message": "order updated successfully"}
+
+
+class Ctx:
+    def __init__(self, workflow_id):
+        self.workflow_id = workflow_id
+        self.calls = 0
+
+    def rfc(self, func, *args):
+        return Call(func, args)
+
+    def rfi(self, promise):
+        return Call(None, (promise,))
+
+    def next_id(self):
+        self.calls += 1
+        return f"{self.workflow_id}.{self.calls}"
+
+
+def run_until_suspended(gen, ctx, store):
+    """
+    Advances a workflow until it waits on a pending promise.
+    """
+    value = None
+    while True:
+        command = gen.send(value)
+        if isinstance(command, Promise):
+            if command.id not in store.resolved:
+                return
+            value = store.resolved[command.id]
+            continue
+        id = ctx.next_id()
+        if id not in store.results:
+            if command.func is None:
+                store.results[id] = Promise(id)
+            else:
+                store.results[id] = store.call(command.func, command.args)
+        value = store.results[id]
+
+
+def start_orders(count, store):
+    workflow = profiler.active(order_workflow)
+    workflows = []
+    for order_id in range(count):
+        ctx = Ctx(f"order-{order_id}")
+        gen = workflow(
+            ctx,
+            {"order_id": order_id, "customer_email": f"customer-{order_id}@example.com"},
+        )
+        run_until_suspended(gen, ctx, store)
+        workflows.append(gen)
+    return workflows
+
+
+def retained_size(obj, seen):
+    # The context stand-in is not counted, whether a local or in the wrapper's
+    # args.
+    if id(obj) in seen or isinstance(obj, (type, type(sys), Ctx)):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(retained_size(k, seen) + retained_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(retained_size(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += retained_size(vars(obj), seen)
+    return size
+
+
+def workflow_state_size(gen):
+    """
+    Bytes held by a suspended workflow: its frames, the frames of the
+    generators it drives, their locals and everything reachable from them.
+    Shared constants are not counted.
+    """
+    seen = set()
+    size = 0
+    pending = [gen]
+    while pending:
+        gen = pending.pop()
+        if gen is None or id(gen) in seen:
+            continue
+        seen.add(id(gen))
+        frame = gen.gi_frame
+        size += sys.getsizeof(gen) + sys.getsizeof(frame)
+        for name, value in frame.f_locals.items():
+            if isgenerator(value):
+                pending.append(value)
+            elif name not in SHARED_LOCALS:
+                size += retained_size(value, seen)
+        pending.append(gen.gi_yieldfrom)
+    return size
+
+
+def rss_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=100_000)
+    parser.add_argument("--max-bytes-per-order", type=int, default=4096)
+    parser.add_argument("--profile", action="store_true")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    if args.profile:
+        profiler.enabled = True
+
+    store = StandInStore()
+    rss_before = rss_mib()
+    started = time.perf_counter()
+    workflows = start_orders(args.orders, store)
+    start_seconds = time.perf_counter() - started
+    rss_waiting = rss_mib()
+
+    sample = workflows[: min(1000, len(workflows))]
+    bytes_per_order = sum(workflow_state_size(gen) for gen in sample) / len(sample)
+
+    del workflows
+    gc.collect()
+    started = time.perf_counter()
+    workflows = start_orders(args.orders, store)
+    recovery_seconds = time.perf_counter() - started
+
+    print(f"orders waiting:             {len(workflows)}")
+    print(f"start time:                 {start_seconds:.2f}s")
+    print(f"recovery time after restart: {recovery_seconds:.2f}s")
+    print(f"state per waiting order:    {bytes_per_order:.0f} bytes")
+    print(f"peak RSS:                   {rss_waiting:.1f} MiB (from {rss_before:.1f} MiB)")
+
+    if bytes_per_order > args.max_bytes_per_order:
+        print(f"state per order is above {args.max_bytes_per_order} bytes")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
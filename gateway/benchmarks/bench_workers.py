@@ -0,0 +1,98 @@
+"""
+Measures gateway requests per second as the number of server workers grows.
+
+Requires the Resonate server and the customers, orders and products service
+nodes to be running. Each worker count starts a fresh `gateway-server` process
+tree, warms it up and then drives it with concurrent HTTP clients.
+
+    python benchmarks/bench_workers.py --workers 1 2 4 8 --path /views/restaurant
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import urllib.request
+import subprocess
+import argparse
+import json
+import time
+import sys
+import os
+
+
+def wait_until_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1)
+            return
+        except urllib.error.HTTPError:
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"gateway did not become ready at {url}")
+
+
+def drive(url, method, body, clients, duration):
+    deadline = time.monotonic() + duration
+
+    def client():
+        completed = errors = 0
+        while time.monotonic() < deadline:
+            req = urllib.request.Request(url, data=body, method=method)
+            req.add_header("Content-Type", "application/json")
+            try:
+                with urllib.request.urlopen(req, timeout=30) as res:
+                    res.read()
+                completed += 1
+            except OSError:
+                errors += 1
+        return completed, errors
+
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(lambda _: client(), range(clients)))
+    return sum(r[0] for r in results), sum(r[1] for r in results)
+
+
+def run(workers, args):
+    env = dict(os.environ)
+    env["GATEWAY_WORKERS"] = str(workers)
+    env["GATEWAY_BIND"] = f"127.0.0.1:{args.port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gateway.server"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        url = f"http://127.0.0.1:{args.port}{args.path}"
+        body = json.dumps(json.loads(args.body)).encode() if args.body else None
+        wait_until_ready(url)
+        drive(url, args.method, body, args.clients, args.warmup)
+        completed, errors = drive(url, args.method, body, args.clients, args.duration)
+        return completed / args.duration, errors
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--path", default="/views/restaurant")
+    parser.add_argument("--method", default="GET")
+    parser.add_argument("--body", default=None, help="JSON request body")
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=5.0)
+    parser.add_argument("--port", type=int, default=5050)
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'req/s':>10} {'errors':>8} {'scaling':>8}")
+    baseline = None
+    for workers in args.workers:
+        rps, errors = run(workers, args)
+        baseline = baseline or rps
+        print(f"{workers:>8} {rps:>10.1f} {errors:>8} {rps / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
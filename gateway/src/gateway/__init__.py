@@ -2,24 +2,109 @@ from resonate.task_sources.poller import Poller
 from resonate.stores.remote import RemoteStore
 from resonate import Resonate, DurablePromise
 from resonate.utils import string_to_uuid
+from resonate.errors import ResonateError
 from resonate.targets import poll
 from .log_config import setup_logger
-from flask import Flask, request, jsonify
+from .admin import admin_only
+from .admission import AdmissionController
+from .breaker import CircuitBreakers, CircuitOpenError
+from .codec import install_payload_encoder, install_wire_encoder
+from .json_provider import install_json_provider
+from .idempotency import ResponseCache, idempotent, promise_suffix
+from .profiling import Profiler, start_profiling
+from .recovery import RecoveryScheduler, start_recovery_at_startup
+from .validation import RequestSchema, validate_json
+from .reports import REPORT_KINDS, REPORT_PERIODS, merge_reports
+from .rpc import RpcClient
+from .routing import (
+    breaker_group,
+    customers_group,
+    customers_read_group,
+    orders_group,
+    orders_groups,
+    orders_read_group,
+    orders_read_groups,
+    products_group,
+    products_read_group,
+)
+from flask import Blueprint, Flask, request, jsonify, g
 from flask_cors import CORS
+import math
 import time
 import json
 import sys
+import os
 import re
 
 logger = setup_logger(__name__)
 
-app = Flask(__name__)
-CORS(app, resources={r"*": {"origins": "http://localhost:5173"}})
-
-store: RemoteStore = RemoteStore(url="http://localhost:8001")
-resonate = Resonate(
-    store=store, task_source=Poller(url="http://localhost:8002", group="gateway")
-)
+# Routes are collected on a blueprint; the app is built by startup().
+api = Blueprint("gateway", __name__)
+app: Flask | None = None
+
+store: RemoteStore | None = None
+resonate: Resonate | None = None
+rpc: RpcClient | None = None
+
+# Workflows are collected at import time and registered when the worker starts,
+# so that each gateway process (including every forked server worker) gets its
+# own Resonate scheduler, store session and poller threads.
+registered_workflows = []
+profiler = Profiler("gateway")
+# Per poll group health, shared by reads and mutations of this process.
+breakers = CircuitBreakers(key=breaker_group)
+# Completed mutations by Idempotency-Key, replayed to retries.
+responses = ResponseCache()
+
+
+def register(func):
+    profiler.wrap(func)
+    registered_workflows.append(func)
+    return func
+
+
+def run_workflow(promise_id, func, *args):
+    """
+    Starts func under promise_id, profiled while profiling is enabled.
+    :return: The Resonate handle.
+    """
+    return resonate.run(promise_id, profiler.active(func), *args)
+
+
+def init_resonate():
+    global store, resonate, rpc
+    store = RemoteStore(url="http://localhost:8001")
+    install_wire_encoder(store)
+    rpc = RpcClient(store, breakers)
+    resonate = Resonate(
+        store=store, task_source=Poller(url="http://localhost:8002", group="gateway")
+    )
+    install_payload_encoder(resonate)
+    for func in registered_workflows:
+        profiler.register(resonate, func)
+    logger.info(f"gateway resonate node initialized in process {os.getpid()}")
+    return resonate
+
+
+def startup():
+    """
+    Connects this process to the Resonate server and builds the Flask app.
+    Importing the module has no side effects; main() and each server worker
+    call this before serving.
+    :return: The Flask app.
+    """
+    global app
+    init_resonate()
+    app = Flask(__name__)
+    CORS(app, resources={r"*": {"origins": "http://localhost:5173"}})
+    install_json_provider(app)
+    app.register_blueprint(api)
+    for endpoint, view in app.view_functions.items():
+        if endpoint != "gateway.profile_handler":
+            app.view_functions[endpoint] = profiler.wrap(view, f"route {endpoint}")
+    start_profiling(profiler)
+    start_recovery_at_startup(recovery)
+    return app
 
 
 ########################
@@ -27,14 +112,14 @@ resonate = Resonate(
 ########################
 
 
-@resonate.register
+@register
 def create_customer_workflow(ctx, data):
     try:
         logger.info(
             f"create customer workflow started for customer: {data['customer_email']}"
         )
         create_customer_result = yield ctx.rfc("create_customer", data).options(
-            send_to=poll("customers-service-nodes")
+            send_to=customers_group()
         )
         return create_customer_result
     except Exception as e:
@@ -43,254 +128,402 @@ def create_customer_workflow(ctx, data):
         raise Exception(error_message)
 
 
-@resonate.register
+# Columns of the promises an order waits on, in the order they are created.
+ORDER_PROMISE_COLUMNS = [
+    "payment_confirmation_promise_id",
+    "restaurant_confirmation_promise_id",
+    "ready_for_pickup_promise_id",
+    "driver_confirmation_promise_id",
+    "out_for_delivery_promise_id",
+    "delivery_confirmation_promise_id",
+]
+
+# Status an order moves to once each of its promises is resolved.
+ORDER_STEPS = [
+    ("payment_confirmation_promise_id", "payment_complete"),
+    ("restaurant_confirmation_promise_id", "restaurant_confirmed"),
+    ("driver_confirmation_promise_id", "driver_confirmed"),
+    ("ready_for_pickup_promise_id", "ready_for_pickup"),
+    ("out_for_delivery_promise_id", "out_for_delivery"),
+    ("delivery_confirmation_promise_id", "delivered"),
+]
+
+
+def order_promise_id(customer_email, order_id):
+    return f"start-order-workflow-{customer_email}-order-{order_id}"
+
+
+def remaining_order_steps(order_status):
+    """
+    :return: The ORDER_STEPS an order in order_status has not taken yet.
+    """
+    statuses = [status for _, status in ORDER_STEPS]
+    if order_status == "payment_required":
+        return ORDER_STEPS
+    return ORDER_STEPS[statuses.index(order_status) + 1 :]
+
+
+def start_order(ctx, order_id, order_shard_group):
+    """
+    Copies the customer's delivery details onto the order and creates the
+    promises it waits on. Runs as a sub-generator of order_workflow so the
+    order and customer records are released before the first wait.
+    :return: Dictionary mapping promise columns to promises.
+    """
+    result = yield ctx.rfc("get_order_by_id", order_id).options(
+        send_to=order_shard_group
+    )
+    logger.info(result["message"])
+    customer_email = result["order"]["customer_email"]
+
+    result = yield ctx.rfc("get_customer", customer_email).options(
+        send_to=customers_group()
+    )
+    logger.info(result["message"])
+    customer = result["customer"]
+
+    promises = {}
+    for column in ORDER_PROMISE_COLUMNS:
+        promises[column] = yield ctx.rfi(DurablePromise(id=None))
+
+    result = yield ctx.rfc(
+        "update_order_by_id",
+        {
+            "order_id": order_id,
+            "order_status": "payment_required",
+            "customer_name": customer["customer_name"],
+            "customer_delivery_address": customer["customer_delivery_address"],
+            **{column: promise.id for column, promise in promises.items()},
+        },
+    ).options(send_to=order_shard_group)
+    logger.info(result["message"])
+    return promises
+
+
+@register
 def order_workflow(ctx, data):
     try:
         order_id = data["order_id"]
+        order_shard_group = orders_group(data["customer_email"])
         logger.info("---------------------------------------------")
         logger.info(f"order workflow started for order: {order_id}")
         logger.info("---------------------------------------------")
 
-        result = yield ctx.rfc("get_order_by_id", order_id).options(
-            send_to=poll("orders-service-nodes")
-        )
-        logger.info(result["message"])
-        order = result["order"]
-
-        result = yield ctx.rfc("get_customer", order["customer_email"]).options(
-            send_to=poll("customers-service-nodes")
-        )
-        logger.info(result["message"])
-        customer = result["customer"]
-
-        order["order_status"] = "payment_required"
-        order["customer_name"] = customer["customer_name"]
-        order["customer_delivery_address"] = customer["customer_delivery_address"]
-        payment_confirmation_promise = yield ctx.rfi(
-            DurablePromise(id=None)
-        )
-        order["payment_confirmation_promise_id"] = payment_confirmation_promise.id
-        restaurant_confirmation_promise = yield ctx.rfi(
-            DurablePromise(id=None)
-        )
-        order["restaurant_confirmation_promise_id"] = restaurant_confirmation_promise.id
-        ready_for_pickup_promise = yield ctx.rfi(
-            DurablePromise(id=None)
-        )
-        order["ready_for_pickup_promise_id"] = ready_for_pickup_promise.id
-        driver_confirmation_promise = yield ctx.rfi(
-            DurablePromise(id=None)
-        )
-        order["driver_confirmation_promise_id"] = driver_confirmation_promise.id
-        out_for_delivery_promise = yield ctx.rfi(
-            DurablePromise(id=None)
-        )
-        order["out_for_delivery_promise_id"] = out_for_delivery_promise.id
-        delivery_confirmation_promise = yield ctx.rfi(
-            DurablePromise(id=None)
-        )
-        order["delivery_confirmation_promise_id"] = delivery_confirmation_promise.id
-        result = yield ctx.rfc("update_order_by_id", order).options(
-            send_to=poll("orders-service-nodes")
-        )
-        logger.info(result["message"])
+        # While suspended the workflow only holds the order id, its shard
+        # group and the promises it has not waited on yet.
+        promises = yield from start_order(ctx, order_id, order_shard_group)
 
-        logger.info(f"waiting on payment for order {order_id}")
-        yield payment_confirmation_promise
-        logger.info(f"Payment confirmed for order {order_id}")
+        # The steps run in this frame: a sub-generator would add its own frame
+        # and arguments to every waiting order.
+        for column, status in ORDER_STEPS:
+            logger.info(f"order {order_id} waiting on {column}")
+            recovery.waiting(data["customer_email"], order_id)
+            yield promises.pop(column)
+            logger.info(f"order {order_id} is {status}")
 
-        order["order_status"] = "payment_complete"
+            result = yield ctx.rfc(
+                "update_order_by_id", {"order_id": order_id, "order_status": status}
+            ).options(send_to=order_shard_group)
+            logger.info(result["message"])
 
-        result = yield ctx.rfc("update_order_by_id", order).options(
-            send_to=poll("orders-service-nodes")
-        )
-        logger.info(result["message"])
+        logger.info(f"Order workflow complete for order {order_id}")
+        return
 
-        logger.info(f"waiting on restaurant confirmation for order {order_id}")
-        yield restaurant_confirmation_promise
-        logger.info(f"Restaurant confirmed for order {order_id}")
+    except Exception as e:
+        logger.error(e)
+        raise Exception(f"Error in Order Workflow: {str(e)}")
 
-        order["order_status"] = "restaurant_confirmed"
 
-        result = yield ctx.rfc("update_order_by_id", order).options(
-            send_to=poll("orders-service-nodes")
+@register
+def resume_order_workflow(ctx, data):
+    """
+    Continues an order from its current status when its order_workflow is
+    gone from the store or ended without finishing it. Waits on the promises
+    the order already has, so resolving them works as before.
+    """
+    try:
+        order_id = data["order_id"]
+        order_shard_group = orders_group(data["customer_email"])
+        result = yield ctx.rfc("get_order_by_id", order_id).options(
+            send_to=order_shard_group
         )
+        if not result["success"]:
+            raise Exception(result["message"])
+        order = result["order"]
+        steps = remaining_order_steps(order["order_status"])
+        logger.info(f"resuming order {order_id} from {order['order_status']}")
+
+        promises = {}
+        for column, _ in steps:
+            if order[column] is None:
+                raise Exception(f"order {order_id} has no {column}")
+            promises[column] = yield ctx.rfi(DurablePromise(id=order[column]))
+
+        # The same steps as order_workflow, from the current status.
+        for column, status in steps:
+            logger.info(f"order {order_id} waiting on {column}")
+            recovery.waiting(data["customer_email"], order_id)
+            yield promises.pop(column)
+            logger.info(f"order {order_id} is {status}")
+
+            result = yield ctx.rfc(
+                "update_order_by_id", {"order_id": order_id, "order_status": status}
+            ).options(send_to=order_shard_group)
+            logger.info(result["message"])
+
+        logger.info(f"resumed order workflow complete for order {order_id}")
+        return
 
-        logger.info(f"waiting on driver confirmation for order {order_id}")
-        yield driver_confirmation_promise
-        logger.info(f"driver confirmed for order {order_id}")
+    except Exception as e:
+        logger.error(e)
+        raise Exception(f"Error in Resume Order Workflow: {str(e)}")
 
-        order["order_status"] = "driver_confirmed"
 
-        result = yield ctx.rfc("update_order_by_id", order).options(
-            send_to=poll("orders-service-nodes")
-        )
+########################
+# DISPATCHERS
+########################
 
-        logger.info(f"waiting for order to be ready for pickup")
-        yield ready_for_pickup_promise
-        logger.info(f"order ready for pickup")
 
-        order["order_status"] = "ready_for_pickup"
+@register
+def dispatch_add_product(ctx, data):
+    success = yield ctx.rfc("add_product", data).options(
+        send_to=products_group()
+    )
+    return success
 
-        result = yield ctx.rfc("update_order_by_id", order).options(
-            send_to=poll("orders-service-nodes")
-        )
 
-        logger.info(f"waiting for order to be out for delivery")
-        yield out_for_delivery_promise
-        logger.info(f"order out for delivery")
+@register
+def dispatch_remove_product(ctx, product_name):
+    success = yield ctx.rfc("remove_product", product_name).options(
+        send_to=products_group()
+    )
+    return success
 
-        order["order_status"] = "out_for_delivery"
 
-        result = yield ctx.rfc("update_order_by_id", order).options(
-            send_to=poll("orders-service-nodes")
-        )
+########################
+# READS
+########################
 
-        logger.info(f"waiting for delivery confirmation")
-        yield delivery_confirmation_promise
-        logger.info(f"order delivered")
+# Read-only calls take the ephemeral RPC path: each call is one short-lived
+# promise handled by the service node, with no durable workflow around it.
 
-        order["order_status"] = "delivered"
 
-        result = yield ctx.rfc("update_order_by_id", order).options(
-            send_to=poll("orders-service-nodes")
-        )
+def send_to_orders_shards(func, *args, groups=orders_read_groups):
+    """
+    Scatters a cross-shard orders query to every orders shard in parallel.
+    :param groups: Returns the group of each shard, the interactive groups
+        by default.
+    :return: One Read per shard.
+    """
+    return [rpc.send(func, group, *args) for group in groups()]
 
-        logger.info(f"Order workflow complete for order {order_id}")
-        return
 
-    except Exception as e:
-        logger.error(e)
-        raise Exception(f"Error in Order Workflow: {str(e)}")
+def gather_orders(calls):
+    """
+    Waits for every shard of a scattered orders query and merges the orders.
+    """
+    orders = []
+    message = None
+    for call in calls:
+        result = call.result()
+        orders.extend(result["orders"])
+        message = result["message"]
+    return {"success": True, "message": message, "orders": orders}
 
 
-@resonate.register
-def get_customer_view_workflow(ctx, customer_email):
+def get_customer_view(customer_email):
     customer_view = {}
-    try:
-        get_customer_result = yield ctx.rfc('get_customer', customer_email).options(
-            send_to=poll('customers-service-nodes')
+    get_customer_call = rpc.send(
+        "get_customer", customers_read_group(), customer_email
+    )
+    get_cart_and_orders_call = rpc.send(
+        "get_customer_cart_and_orders", orders_read_group(customer_email), customer_email
+    )
+    get_products_call = rpc.send("get_products", products_read_group())
+    get_customer_result = get_customer_call.result()
+    if not get_customer_result["success"]:
+        return get_customer_result
+    logger.info(get_customer_result["message"])
+    customer_view["customer"] = get_customer_result["customer"]
+    get_cart_and_orders_result = get_cart_and_orders_call.result()
+    logger.info(get_cart_and_orders_result["message"])
+    customer_view["cart"] = get_cart_and_orders_result["cart"]
+    customer_view["orders"] = get_cart_and_orders_result["orders"]
+    get_products_result = get_products_call.result()
+    logger.info(get_products_result["message"])
+    customer_view["products"] = get_products_result["products"]
+    return {
+        "success": True,
+        "customer_view": customer_view,
+        "message": "customer view retrieved successfully",
+    }
+
+
+def get_restaurant_view():
+    restaurant_view = {}
+    logger.info("getting restaurant view")
+    get_in_progress_orders_calls = send_to_orders_shards("get_in_progress_orders")
+    get_products_call = rpc.send("get_products", products_read_group())
+    in_progress_orders_result = gather_orders(get_in_progress_orders_calls)
+    logger.info(in_progress_orders_result["message"])
+    restaurant_view["in_progress_orders"] = in_progress_orders_result["orders"]
+    # Only the customers with an order in progress, so the view grows with
+    # active orders rather than with the customer base.
+    emails = sorted(
+        {order["customer_email"] for order in restaurant_view["in_progress_orders"]}
+    )
+    if emails:
+        get_customers_call = rpc.send(
+            "get_customers_by_emails", customers_read_group(), emails
         )
-        if get_customer_result['success']:
-            logger.info(get_customer_result['message'])
-            customer_view['customer'] = get_customer_result['customer']
-            get_cart_promise = yield ctx.rfi(
-                'get_or_create_cart', customer_email
-            ).options(send_to=poll('orders-service-nodes'))
-            get_orders_promise = yield ctx.rfi(
-                'get_customer_orders', customer_email
-            ).options(send_to=poll('orders-service-nodes'))
-            get_products_promise = yield ctx.rfi('get_products').options(
-                send_to=poll('products-service-nodes')
-            )
-            get_cart_result = yield get_cart_promise
-            logger.info(get_cart_result['message'])
-            customer_view['cart'] = get_cart_result['cart']
-            get_orders_result = yield get_orders_promise
-            logger.info(get_orders_result['message'])
-            customer_view['orders'] = get_orders_result['orders']
-            get_products_result = yield get_products_promise
-            logger.info(get_products_result['message'])
-            customer_view['products'] = get_products_result['products']
-            return {
-                'success': True,
-                'customer_view': customer_view,
-                'message': "customer view retrieved successfully",
-            }
-        else:
-            return get_customer_result
-    except Exception as e:
-        logger.error(e)
+        get_customers_result = get_customers_call.result()
+        logger.info(get_customers_result["message"])
+        restaurant_view["customers"] = get_customers_result["customers"]
+    else:
+        restaurant_view["customers"] = []
+    get_products_result = get_products_call.result()
+    logger.info(get_products_result["message"])
+    restaurant_view["products"] = get_products_result["products"]
+    return {
+        "success": True,
+        "restaurant_view": restaurant_view,
+        "message": "restaurant view retrieved successfully",
+    }
+
+
+def get_driver_view(zones=None):
+    logger.info(f"getting driver view for zones {zones or 'all'}")
+    result = gather_orders(send_to_orders_shards("get_deliverable_orders", zones))
+    return {
+        "success": True,
+        "driver_view": {"deliveries": result["orders"]},
+        "message": "driver view retrieved successfully",
+    }
+
+
+def get_customer_cart(customer_email):
+    call = rpc.send("get_or_create_cart", orders_read_group(customer_email), customer_email)
+    return call.result()
+
+
+def get_in_progress_orders():
+    return gather_orders(send_to_orders_shards("get_in_progress_orders"))
+
+
+def search_products(query, limit):
+    call = rpc.send("search_products", products_read_group(), query, limit)
+    return call.result()
+
+
+def get_report(kind, options, limit):
+    # Each shard computes its report from its own snapshot; only the
+    # aggregated rows cross the wire. Reports are not interactive, so they
+    # queue behind order steps rather than ahead of views.
+    reports = []
+    for call in send_to_orders_shards("get_report", kind, options, groups=orders_groups):
+        result = call.result()
+        if not result["success"]:
+            return result
+        reports.append(result["report"])
+    return {
+        "success": True,
+        "message": f"{kind} report retrieved successfully",
+        "report": merge_reports(kind, reports, limit),
+    }
 
 
-@resonate.register
-def get_restaurant_view_workflow(ctx):
-    restaurant_view = {}
+########################
+# RECOVERY
+########################
+
+# Orders listed per call when looking for unfinished orders.
+RECOVERY_PAGE_SIZE = 500
+
+
+def list_unfinished_orders():
+    """
+    Pages through the unfinished orders of every orders shard.
+    """
+    for group in orders_groups():
+        after_order_id = 0
+        while True:
+            result = rpc.send(
+                "get_unfinished_orders", group, after_order_id, RECOVERY_PAGE_SIZE
+            ).result()
+            yield from result["orders"]
+            if len(result["orders"]) < RECOVERY_PAGE_SIZE:
+                break
+            after_order_id = result["orders"][-1]["order_id"]
+
+
+def recover_order(order):
+    """
+    Reattaches to the order's workflow if its promise is still pending, which
+    lets this process claim it if no other process holds it. Otherwise starts
+    resume_order_workflow from the order's current status; its promise id
+    includes the status, so repeated recoveries of an order that has not moved
+    share one workflow.
+    :return: "reattached" or "resumed", and the workflow's handle.
+    """
+    customer_email = order["customer_email"]
+    order_id = order["order_id"]
+    breakers.check(orders_group(customer_email), probe=False)
+    data = {"customer_email": customer_email, "order_id": order_id}
+    promise_id = order_promise_id(customer_email, order_id)
     try:
-        logger.info("getting restaurant view")
-        get_in_progress_orders_promise = yield ctx.rfi(
-            "get_in_progress_orders"
-        ).options(send_to=poll("orders-service-nodes"))
-        get_restaurant_customers_promise = yield ctx.rfi("get_customers").options(
-            send_to=poll("customers-service-nodes")
-        )
-        get_restaurant_products_promise = yield ctx.rfi("get_products").options(
-            send_to=poll("products-service-nodes")
-        )
-        in_progress_orders_result = yield get_in_progress_orders_promise
-        logger.info(in_progress_orders_result["message"])
-        restaurant_view["in_progress_orders"] = in_progress_orders_result["orders"]
-        get_restaurant_customers_result = yield get_restaurant_customers_promise
-        logger.info(get_restaurant_customers_result["message"])
-        restaurant_view["customers"] = get_restaurant_customers_result["customers"]
-        get_restaurant_products_result = yield get_restaurant_products_promise
-        logger.info(get_restaurant_products_result["message"])
-        restaurant_view["products"] = get_restaurant_products_result["products"]
-        return {
-            "success": True,
-            "restaurant_view": restaurant_view,
-            "message": "restaurant view retrieved successfully",
-        }
-    except Exception as e:
-        error_message = f"error in Get Restaurant View Workflow: {str(e)}"
-        logger.error(error_message)
-        raise Exception(error_message)
+        pending = store.promises.get(id=promise_id).is_pending()
+    except ResonateError as e:
+        if e.code != "STORE_NOT_FOUND":
+            raise
+        pending = False
+    if pending:
+        return "reattached", run_workflow(promise_id, order_workflow, data)
+    handle = run_workflow(
+        f"resume-order-workflow-{customer_email}-order-{order_id}-{order['order_status']}",
+        resume_order_workflow,
+        data,
+    )
+    return "resumed", handle
 
 
-@resonate.register
-def get_driver_view_workflow(ctx):
-    driver_view = {}
-    try:
-        logger.info("getting driver view")
-        result = yield ctx.rfc("get_deliverable_orders").options(
-            send_to=poll("orders-service-nodes")
-        )
-        driver_view["deliveries"] = result["orders"]
-        return {
-            "success": True,
-            "driver_view": driver_view,
-            "message": "driver view retrieved successfully",
-        }
-    except Exception as e:
-        logger.error(e)
-        raise Exception(f"error in Get Driver View Workflow: {str(e)}")
+recovery = RecoveryScheduler(list_unfinished_orders, recover_order)
 
 
 ########################
-# DISPATCHERS
+# ADMISSION CONTROL
 ########################
 
 
-@resonate.register
-def dispatch_add_product(ctx, data):
-    success = yield ctx.rfc("add_product", data).options(
-        send_to=poll("products-service-nodes")
-    )
-    return success
+admission = AdmissionController()
 
 
-@resonate.register
-def dispatch_remove_product(ctx, product_name):
-    success = yield ctx.rfc("remove_product", product_name).options(
-        send_to=poll("products-service-nodes")
-    )
-    return success
+@api.before_app_request
+def admit_request():
+    if request.method == "OPTIONS":
+        return None
+    data = request.get_json(silent=True)
+    customer_email = data.get("customer_email") if isinstance(data, dict) else None
+    rejection = admission.admit(request.path, customer_email)
+    if rejection is not None:
+        status, message, retry_after = rejection
+        logger.warning(f"shedding {request.path} with {status}: {message}")
+        response = jsonify({"error": message})
+        response.headers["Retry-After"] = str(math.ceil(retry_after))
+        return response, status
+    g.admitted = True
 
 
-@resonate.register
-def dispatch_get_customer_cart(ctx, customer_email):
-    result = yield ctx.rfc("get_or_create_cart", customer_email).options(
-        send_to=poll("orders-service-nodes")
-    )
-    return result
+@api.teardown_app_request
+def release_request(exc):
+    if g.pop("admitted", False):
+        admission.release()
 
 
-@resonate.register
-def dispatch_get_in_progress_orders(ctx):
-    result = yield ctx.rfc("get_in_progress_orders").options(
-        send_to=poll("orders-service-nodes")
-    )
-    return result
+def circuit_open_response(e):
+    logger.warning(f"{request.path}: {e}")
+    response = jsonify({"error": str(e)})
+    response.headers["Retry-After"] = str(max(1, math.ceil(e.retry_after)))
+    return response, 503
 
 
 ########################
@@ -298,17 +531,23 @@ def dispatch_get_in_progress_orders(ctx):
 ########################
 
 
-@app.route("/customer/create", methods=["POST"])
+@api.route("/customer/create", methods=["POST"])
+@validate_json(
+    RequestSchema("customer_email", "customer_name", "customer_delivery_address")
+)
+@idempotent(responses)
 def create_customer_route_handler():
     logger.info("create customer route handler called")
     try:
         data = request.get_json()
-        if "customer_email" not in data:
-            return jsonify({"error": "'customer_email' required"}), 400
         timestamp = int(time.time())
-        promise_id = f"create-customer-{data["customer_email"]}-{timestamp}"
-        handle = create_customer_workflow.run(promise_id, data)
-        return jsonify(handle.result()), 200
+        promise_id = f"create-customer-{data["customer_email"]}-{promise_suffix(timestamp)}"
+        with breakers.call(customers_group()):
+            handle = run_workflow(promise_id, create_customer_workflow, data)
+            result = handle.result()
+        return jsonify(result), 200
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
     except Exception as e:
         logger.error(e)
         return jsonify({"error": str(e)}), 500
@@ -319,32 +558,72 @@ def create_customer_route_handler():
 ########################
 
 
-@app.route("/products/add", methods=["POST"])
+@api.route("/products/add", methods=["POST"])
+@validate_json(
+    RequestSchema("product_name", "product_display", "product_price", "product_image")
+)
+@idempotent(responses)
 def add_product_route_handler():
     logger.info("Add product route handler called")
     try:
         data = request.get_json()
         timestamp = int(time.time())
-        handle = dispatch_add_product.run(f"add-product-{timestamp}", data)
-        return jsonify(handle.result()), 200
+        with breakers.call(products_group()):
+            handle = run_workflow(
+                f"add-product-{promise_suffix(timestamp)}", dispatch_add_product, data
+            )
+            result = handle.result()
+        return jsonify(result), 200
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
     except Exception as e:
         logger.error(e)
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/products/remove", methods=["POST"])
+@api.route("/products/remove", methods=["POST"])
+@validate_json(RequestSchema("product_name", message="product_name required"))
+@idempotent(responses)
 def remove_product_route_handler():
     logger.info("Remove product route handler called")
     try:
         data = request.get_json()
-        if "product_name" not in data:
-            return jsonify({"error": "product_name required"}), 400
         product_name = data["product_name"]
         timestamp = int(time.time())
-        handle = dispatch_remove_product.run(
-            f"remove-product-{timestamp}", product_name
-        )
-        return jsonify(handle.result()), 200
+        with breakers.call(products_group()):
+            handle = run_workflow(
+                f"remove-product-{promise_suffix(timestamp)}",
+                dispatch_remove_product,
+                product_name,
+            )
+            result = handle.result()
+        return jsonify(result), 200
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
+    except Exception as e:
+        logger.error(e)
+        return jsonify({"error": str(e)}), 500
+
+
+# Upper bound on the number of results of one search.
+MAX_SEARCH_RESULTS = 100
+
+
+@api.route("/products/search", methods=["GET"])
+def search_products_route_handler():
+    logger.info("Search products route handler called")
+    try:
+        query = request.args.get("q", "")
+        limit = request.args.get("limit", 20, type=int)
+        if not 1 <= limit <= MAX_SEARCH_RESULTS:
+            error_message = f"limit must be between 1 and {MAX_SEARCH_RESULTS}"
+            return jsonify({"error": error_message}), 400
+        return jsonify(search_products(query, limit)), 200
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
+    except TimeoutError as e:
+        logger.error(e)
+        return jsonify({"error": str(e)}), 504
     except Exception as e:
         logger.error(e)
         return jsonify({"error": str(e)}), 500
@@ -355,56 +634,50 @@ def remove_product_route_handler():
 ########################
 
 
-@app.route("/cart/get", methods=["POST"])
+@api.route("/cart/get", methods=["POST"])
+@validate_json(RequestSchema("customer_email", message="customer_email required"))
 def get_cart_route_handler():
     logger.info("Get cart route handler called")
     try:
         data = request.get_json()
-        if "customer_email" not in data:
-            return jsonify({"error": "customer_email required"}), 400
-        timestamp = int(time.time())
-        promise_id = f"get-customer-cart-{data['customer_email']}-{timestamp}"
-        handle = dispatch_get_customer_cart.run(promise_id, data["customer_email"])
-        return jsonify(handle.result()), 200
+        return jsonify(get_customer_cart(data["customer_email"])), 200
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
+    except TimeoutError as e:
+        logger.error(e)
+        return jsonify({"error": str(e)}), 504
     except Exception as e:
         logger.error(e)
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/cart/add", methods=["POST"])
+@api.route("/cart/add", methods=["POST"])
+@validate_json(RequestSchema("customer_email", "order_id", "product"))
+@idempotent(responses)
 def add_to_cart_route_handler():
     logger.info("Add to cart route handler called")
     try:
         data = request.get_json()
-        if (
-            "customer_email" not in data
-            and "product_name" not in data
-            and "order_id" not in data
-        ):
-            return (
-                jsonify(
-                    {
-                        "error": "'customer_email', 'product_name', and 'order_id' required"
-                    }
-                ),
-                400,
-            )
         timestamp = int(time.time())
         data["timestamp"] = timestamp
-        promise_id = f"add-to-cart-{data['customer_email']}-{timestamp}"
-        handle = dispatch_add_to_cart.run(promise_id, data)
-        return jsonify(handle.result()), 200
+        promise_id = f"add-to-cart-{data['customer_email']}-{promise_suffix(timestamp)}"
+        with breakers.call(orders_group(data["customer_email"])):
+            handle = run_workflow(promise_id, dispatch_add_to_cart, data)
+            result = handle.result()
+        return jsonify(result), 200
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
     except Exception as e:
         error_message = f"error in add_to_cart_route_handler(): {str(e)}"
         logger.error(error_message)
         return jsonify({"error": error_message}), 500
 
 
-@resonate.register
+@register
 def dispatch_add_to_cart(ctx, data):
     try:
         result = yield ctx.rfc("add_to_cart_workflow", data).options(
-            send_to=poll("orders-service-nodes")
+            send_to=orders_group(data["customer_email"])
         )
         return result
     except Exception as e:
@@ -412,29 +685,35 @@ def dispatch_add_to_cart(ctx, data):
         raise Exception(f"error in dispatch_add_to_cart: {str(e)}")
 
 
-@app.route("/cart/remove", methods=["POST"])
+@api.route("/cart/remove", methods=["POST"])
+@validate_json(RequestSchema("customer_email", "order_id", "item"))
+@idempotent(responses)
 def remove_from_cart_route_handler():
     logger.info("Remove from cart route handler called")
     try:
         data = request.get_json()
-        if "customer_email" not in data:
-            return jsonify({"error": "'customer_email' required"}), 400
         timestamp = int(time.time())
         data["timestamp"] = timestamp
-        promise_id = f"remove-from-cart-{data['customer_email']}-{timestamp}"
-        handle = dispatch_remove_from_cart.run(promise_id, data)
-        return jsonify(handle.result()), 200
+        promise_id = (
+            f"remove-from-cart-{data['customer_email']}-{promise_suffix(timestamp)}"
+        )
+        with breakers.call(orders_group(data["customer_email"])):
+            handle = run_workflow(promise_id, dispatch_remove_from_cart, data)
+            result = handle.result()
+        return jsonify(result), 200
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
     except Exception as e:
         error_message = f"error in remove_from_cart_route_handler(): {str(e)}"
         logger.error(error_message)
         return jsonify({"error": error_message}), 500
 
 
-@resonate.register
+@register
 def dispatch_remove_from_cart(ctx, data):
     try:
         result = yield ctx.rfc("remove_from_cart_workflow", data).options(
-            send_to=poll("orders-service-nodes")
+            send_to=orders_group(data["customer_email"])
         )
         return result
     except Exception as e:
@@ -447,22 +726,30 @@ def dispatch_remove_from_cart(ctx, data):
 ########################
 
 
-@app.route("/order/start", methods=["POST"])
+@api.route("/order/start", methods=["POST"])
+@validate_json(
+    RequestSchema(
+        "customer_email",
+        "order_id",
+        message="missing 'customer_email' or 'order_id' in request data",
+    )
+)
 def checkout_route_handler():
     logger.info("start order route handler called")
     try:
         data = request.get_json()
         print(data)
-        if "customer_email" not in data or "order_id" not in data:
-            error_message = "missing 'customer_email' or 'order_id' in request data"
-            logger.error(error_message)
-            return jsonify({"error": error_message}), 400
 
         customer_email = data["customer_email"]
         order_id = data["order_id"]
 
-        _ = order_workflow.run(
-            f"start-order-workflow-{customer_email}-order-{order_id}", data
+        # The workflow runs in the background, so only refuse to start it.
+        breakers.check(customers_group(), probe=False)
+        breakers.check(orders_group(customer_email), probe=False)
+        _ = run_workflow(
+            order_promise_id(customer_email, order_id),
+            order_workflow,
+            data,
         )
         return (
             jsonify(
@@ -472,20 +759,21 @@ def checkout_route_handler():
             ),
             200,
         )
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
     except Exception as e:
         logger.error(e)
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/order/resolve-promise", methods=["POST"])
+@api.route("/order/resolve-promise", methods=["POST"])
+@validate_json(RequestSchema("promise_id", message="promise_id required"))
 def resolve_promise_route_handler():
     logger.info("Payment route handler called.")
     global store
     try:
         data = request.get_json()
         print(data)
-        if "promise_id" not in data:
-            return jsonify({"error": "promise_id required"}), 400
 
         promise_id = data["promise_id"]
         logger.info(f"Resolving promise with ID: {promise_id}")
@@ -502,15 +790,16 @@ def resolve_promise_route_handler():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/orders/get-in-progress-orders", methods=["GET"])
+@api.route("/orders/get-in-progress-orders", methods=["GET"])
 def get_orders_in_progress_route_handler():
     logger.info("Get in progress orders route handler called")
     try:
-        timestamp = int(time.time())
-        handle = dispatch_get_in_progress_orders.run(
-            f"get-in-progress-orders-{timestamp}"
-        )
-        return jsonify(handle.result()), 200
+        return jsonify(get_in_progress_orders()), 200
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
+    except TimeoutError as e:
+        logger.error(e)
+        return jsonify({"error": str(e)}), 504
     except Exception as e:
         logger.error(e)
         return jsonify({"error": str(e)}), 500
@@ -521,51 +810,149 @@ def get_orders_in_progress_route_handler():
 ########################
 
 
-@app.route("/views/customer", methods=["POST"])
+@api.route("/views/customer", methods=["POST"])
+@validate_json(
+    RequestSchema(
+        "customer_email", message="Missing 'customer_email' in request data"
+    )
+)
 def customer_view_handler():
     try:
         logger.info("Get customer view route handler called")
         data = request.get_json()
-        if "customer_email" not in data:
-            error_message = "Missing 'customer_email' in request data"
-            logger.error(error_message)
-            return jsonify({"error": error_message}), 400
-        customer_email = data["customer_email"]
-        timestamp = int(time.time())
-        promise_id = f"get-customer-view-{customer_email}-{timestamp}"
-        handle = get_customer_view_workflow.run(promise_id, customer_email)
-        print(handle.result())
-        return jsonify(handle.result()), 200
+        return jsonify(get_customer_view(data["customer_email"])), 200
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
+    except TimeoutError as e:
+        logger.error(e)
+        return jsonify({"error": str(e)}), 504
     except Exception as e:
         logger.error(e)
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/views/restaurant", methods=["GET"])
+@api.route("/views/restaurant", methods=["GET"])
 def restaurant_view_handler():
     try:
         logger.info("get restaurant view route handler called")
-        timestamp = int(time.time())
-        handle = get_restaurant_view_workflow.run(f"get-restaurant-view-{timestamp}")
-        return jsonify(handle.result()), 200
+        return jsonify(get_restaurant_view()), 200
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
+    except TimeoutError as e:
+        logger.error(e)
+        return jsonify({"error": str(e)}), 504
     except Exception as e:
         logger.error(e)
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/views/driver", methods=["POST"])
+@api.route("/views/driver", methods=["POST"])
 def driver_view_handler():
     try:
-        timestamp = int(time.time())
-        handle = get_driver_view_workflow.run(f"get-driver-view-{timestamp}")
-        return jsonify(handle.result()), 200
+        data = request.get_json(silent=True) or {}
+        zones = data.get("zones")
+        if isinstance(zones, str):
+            zones = [zones]
+        if zones is not None and not (
+            isinstance(zones, list) and all(isinstance(zone, str) for zone in zones)
+        ):
+            error_message = "'zones' must be a zone or a list of zones"
+            return jsonify({"error": error_message}), 400
+        return jsonify(get_driver_view(sorted(set(zones)) if zones else None)), 200
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
+    except TimeoutError as e:
+        logger.error(e)
+        return jsonify({"error": str(e)}), 504
+    except Exception as e:
+        logger.error(e)
+        return jsonify({"error": str(e)}), 500
+
+
+########################
+# REPORT ENDPOINTS
+########################
+
+# Upper bound on the number of products in the top products report.
+MAX_REPORT_PRODUCTS = 100
+
+
+@api.route("/reports/<kind>", methods=["GET"])
+def report_route_handler(kind):
+    logger.info(f"{kind} report route handler called")
+    try:
+        if kind not in REPORT_KINDS:
+            return jsonify({"error": f"unknown report {kind}"}), 404
+        period = request.args.get("period", "day")
+        if period not in REPORT_PERIODS:
+            error_message = f"period must be one of {', '.join(REPORT_PERIODS)}"
+            return jsonify({"error": error_message}), 400
+        limit = request.args.get("limit", 10, type=int)
+        if not 1 <= limit <= MAX_REPORT_PRODUCTS:
+            error_message = f"limit must be between 1 and {MAX_REPORT_PRODUCTS}"
+            return jsonify({"error": error_message}), 400
+        result = get_report(kind, {"period": period}, limit)
+        if not result["success"]:
+            return jsonify({"error": result["message"]}), 503
+        return jsonify(result), 200
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
+    except TimeoutError as e:
+        logger.error(e)
+        return jsonify({"error": str(e)}), 504
     except Exception as e:
         logger.error(e)
         return jsonify({"error": str(e)}), 500
 
 
-# Define a main function to start the Flask app
+########################
+# ADMIN ENDPOINTS
+########################
+
+
+@api.route("/admin/rpc", methods=["GET"])
+def rpc_state_handler():
+    return jsonify(rpc.state()), 200
+
+
+@api.route("/admin/breakers", methods=["GET"])
+def breakers_state_handler():
+    return jsonify(breakers.state()), 200
+
+
+@api.route("/admin/idempotency", methods=["GET"])
+def idempotency_state_handler():
+    return jsonify(responses.state()), 200
+
+
+@api.route("/admin/recovery", methods=["GET", "POST"])
+@admin_only()
+def recovery_handler():
+    # POST starts re-driving every unfinished order, unless a run is already
+    # in progress; GET reports the progress of the current or last run.
+    if request.method == "GET":
+        return jsonify(recovery.state()), 200
+    return jsonify(recovery.start()), 202
+
+
+@api.route("/admin/profile", methods=["GET", "POST"])
+@admin_only()
+def profile_handler():
+    # POST {"enabled": true} starts profiling this worker process;
+    # {"enabled": false} stops it and writes the results.
+    if request.method == "GET":
+        return jsonify(profiler.state()), 200
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get("enabled"), bool):
+        return jsonify({"error": "'enabled' must be true or false"}), 400
+    if data["enabled"]:
+        return jsonify(profiler.start()), 200
+    return jsonify(profiler.stop()), 200
+
+
+# Define a main function to start the Flask development server
 def main():
+    startup()
     logger.info("API Gateway service running on port 5000")
     app.run(host="127.0.0.1", port=5000)
 
@@ -0,0 +1,45 @@
+from flask import request, jsonify
+from functools import wraps
+from .log_config import setup_logger
+import hmac
+import os
+
+logger = setup_logger(__name__)
+
+# Token admin requests must send as "Authorization: Bearer <token>". Without
+# one, admin requests are only accepted from this host.
+GATEWAY_ADMIN_TOKEN = os.getenv("GATEWAY_ADMIN_TOKEN", "")
+LOOPBACK_ADDRESSES = ("127.0.0.1", "::1")
+
+
+def is_admin_request():
+    """
+    :return: Whether the request carries the admin token, or, with no token
+        configured, comes straight from this host rather than through a proxy.
+    """
+    if GATEWAY_ADMIN_TOKEN:
+        header = request.headers.get("Authorization", "")
+        return hmac.compare_digest(header, f"Bearer {GATEWAY_ADMIN_TOKEN}")
+    return (
+        request.remote_addr in LOOPBACK_ADDRESSES
+        and "X-Forwarded-For" not in request.headers
+    )
+
+
+def admin_only(methods=("POST",)):
+    """
+    Answers requests with one of methods that are not admin requests with a
+    403, so the public gateway cannot start recovery or profiling.
+    """
+
+    def decorator(handler):
+        @wraps(handler)
+        def checked(*args, **kwargs):
+            if request.method in methods and not is_admin_request():
+                logger.warning(f"{request.path}: refused admin request from {request.remote_addr}")
+                return jsonify({"error": "admin requests need the admin token"}), 403
+            return handler(*args, **kwargs)
+
+        return checked
+
+    return decorator
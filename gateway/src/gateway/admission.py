@@ -0,0 +1,121 @@
+from collections import OrderedDict
+from threading import Lock
+import time
+import os
+
+# Routes that move an order forward. They are never rate limited and may use
+# the concurrency reserved for them, so views and cart calls are shed first.
+PRIORITY_ROUTES = {"/order/resolve-promise", "/order/start"}
+
+# Request threads per gateway process. Requests beyond them wait in the
+# server's queue without being admitted, so the concurrency limits below are
+# derived from them.
+GATEWAY_THREADS = int(os.getenv("GATEWAY_THREADS", "8"))
+# Limits apply per gateway process.
+MAX_CONCURRENT = int(os.getenv("GATEWAY_MAX_CONCURRENT", str(GATEWAY_THREADS)))
+PRIORITY_RESERVE = int(
+    os.getenv("GATEWAY_PRIORITY_RESERVE", str(max(1, GATEWAY_THREADS // 4)))
+)
+ROUTE_RATE = float(os.getenv("GATEWAY_ROUTE_RATE", "200"))
+ROUTE_BURST = float(os.getenv("GATEWAY_ROUTE_BURST", "400"))
+CUSTOMER_RATE = float(os.getenv("GATEWAY_CUSTOMER_RATE", "5"))
+CUSTOMER_BURST = float(os.getenv("GATEWAY_CUSTOMER_BURST", "20"))
+MAX_TRACKED_CUSTOMERS = 10_000
+
+
+def check_limits(threads):
+    """
+    :param threads: Request threads of each server process.
+    :raise Exception: If the concurrency limits cannot be reached with
+        threads, in which case the gateway would never shed with 503.
+    """
+    if MAX_CONCURRENT > threads:
+        raise Exception(
+            f"GATEWAY_MAX_CONCURRENT ({MAX_CONCURRENT}) is above the {threads} request threads per process"
+        )
+    if not 0 <= PRIORITY_RESERVE < MAX_CONCURRENT:
+        raise Exception(
+            f"GATEWAY_PRIORITY_RESERVE ({PRIORITY_RESERVE}) must be below GATEWAY_MAX_CONCURRENT ({MAX_CONCURRENT})"
+        )
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """
+        Takes one token if available.
+        :return: 0 if admitted, otherwise seconds until a token is available.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """
+    Admits or sheds gateway requests before any workflow is started.
+
+    Requests are rejected with 429 when the route or the customer is over its
+    token bucket rate, and with 503 when too many requests are in flight.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._inflight = 0
+        self._route_buckets = {}
+        self._customer_buckets = OrderedDict()
+
+    def admit(self, route, customer_email=None):
+        """
+        :return: None if admitted (call release() when done), otherwise a
+            (status, message, retry_after) tuple.
+        """
+        priority = route in PRIORITY_ROUTES
+        limit = MAX_CONCURRENT if priority else MAX_CONCURRENT - PRIORITY_RESERVE
+        with self._lock:
+            if self._inflight >= limit:
+                return 503, "gateway is overloaded, try again later", 1
+            if not priority:
+                retry_after = self._take(route, customer_email)
+                if retry_after:
+                    return 429, "too many requests", retry_after
+            self._inflight += 1
+        return None
+
+    def release(self):
+        with self._lock:
+            self._inflight -= 1
+
+    def _take(self, route, customer_email):
+        bucket = self._route_buckets.get(route)
+        if bucket is None:
+            bucket = self._route_buckets[route] = TokenBucket(ROUTE_RATE, ROUTE_BURST)
+        retry_after = bucket.take()
+        if retry_after or customer_email is None:
+            return retry_after
+
+        bucket = self._customer_buckets.pop(customer_email, None)
+        if bucket is None:
+            bucket = TokenBucket(CUSTOMER_RATE, CUSTOMER_BURST)
+            if len(self._customer_buckets) >= MAX_TRACKED_CUSTOMERS:
+                self._customer_buckets.popitem(last=False)
+        self._customer_buckets[customer_email] = bucket
+        return bucket.take()
+
+    def state(self):
+        with self._lock:
+            return {
+                "inflight": self._inflight,
+                "max_concurrent": MAX_CONCURRENT,
+                "priority_reserve": PRIORITY_RESERVE,
+                "tracked_customers": len(self._customer_buckets),
+            }
@@ -0,0 +1,221 @@
+from resonate.errors import ResonateError
+from .log_config import setup_logger
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+import requests
+import time
+import os
+
+logger = setup_logger(__name__)
+
+# Breakers apply per gateway process and per target poll group.
+BREAKERS = os.getenv("GATEWAY_BREAKERS", "1") == "1"
+# A closed breaker opens when, over the calls completed in the window, at
+# least MIN_CALLS completed and FAILURE_RATIO of them failed or timed out.
+WINDOW_SECONDS = float(os.getenv("GATEWAY_BREAKER_WINDOW_SECONDS", "30"))
+MIN_CALLS = int(os.getenv("GATEWAY_BREAKER_MIN_CALLS", "5"))
+FAILURE_RATIO = float(os.getenv("GATEWAY_BREAKER_FAILURE_RATIO", "0.5"))
+# An open breaker fails fast for OPEN_SECONDS, then lets PROBES calls through.
+OPEN_SECONDS = float(os.getenv("GATEWAY_BREAKER_OPEN_SECONDS", "10"))
+PROBES = int(os.getenv("GATEWAY_BREAKER_PROBES", "1"))
+# Reads to an open group are answered from results at most this old.
+STALE_SECONDS = float(os.getenv("GATEWAY_BREAKER_STALE_SECONDS", "300"))
+MAX_OUTCOMES = 1000
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def is_group_failure(e):
+    """
+    Whether an error means the group or the store could not be reached or did
+    not answer in time. Errors raised by the function itself, which arrive as
+    rejected promises, show the group is serving and do not count.
+    """
+    if isinstance(e, ResonateError):
+        return e.retriable
+    return isinstance(e, (TimeoutError, ConnectionError, requests.RequestException))
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, group, retry_after):
+        super().__init__(f"{group} is unavailable, retry in {retry_after:.0f}s")
+        self.group = group
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Health of one poll group, from the outcome and latency of calls to it.
+
+    closed: calls pass and outcomes are counted over WINDOW_SECONDS.
+    open: calls fail fast until OPEN_SECONDS have passed.
+    half_open: up to PROBES calls pass; the first success closes the breaker
+    and a failure opens it again.
+    """
+
+    def __init__(self, group):
+        self.group = group
+        self.state = CLOSED
+        self.opened_at = None
+        self.probes = 0
+        self.probing_since = None
+        self.rejected = 0
+        self.stale_reads = 0
+        self._outcomes = deque(maxlen=MAX_OUTCOMES)
+        self._lock = Lock()
+
+    def allow(self):
+        """
+        :return: Whether a call may be sent to the group now.
+        """
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < OPEN_SECONDS:
+                    self.rejected += 1
+                    return False
+                self.state = HALF_OPEN
+                self.probes = 0
+                self.probing_since = time.monotonic()
+                logger.info(f"circuit for {self.group} is half open, probing")
+            if self.state == HALF_OPEN:
+                # Probes whose outcome never arrived are replaced.
+                if time.monotonic() - self.probing_since >= OPEN_SECONDS:
+                    self.probes = 0
+                    self.probing_since = time.monotonic()
+                if self.probes >= PROBES:
+                    self.rejected += 1
+                    return False
+                self.probes += 1
+            return True
+
+    def is_open(self):
+        with self._lock:
+            return self.state == OPEN and time.monotonic() - self.opened_at < OPEN_SECONDS
+
+    def retry_after(self):
+        if self.opened_at is None:
+            return 0
+        return max(0, OPEN_SECONDS - (time.monotonic() - self.opened_at))
+
+    def record(self, ok, seconds):
+        """
+        :param ok: Whether the call completed successfully.
+        :param seconds: Latency of the call, or how long it was waited for.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._outcomes.append((now, ok, seconds))
+            if self.state == HALF_OPEN:
+                if ok:
+                    logger.info(f"circuit for {self.group} closed")
+                    self.state = CLOSED
+                    self.opened_at = None
+                    self._outcomes.clear()
+                else:
+                    self._open(now)
+                return
+            if self.state == CLOSED and not ok:
+                outcomes = self._recent(now)
+                failures = sum(1 for _, ok, _ in outcomes if not ok)
+                if len(outcomes) >= MIN_CALLS and failures >= FAILURE_RATIO * len(outcomes):
+                    self._open(now)
+
+    def _open(self, now):
+        logger.warning(f"circuit for {self.group} opened for {OPEN_SECONDS}s")
+        self.state = OPEN
+        self.opened_at = now
+
+    def _recent(self, now):
+        while self._outcomes and now - self._outcomes[0][0] > WINDOW_SECONDS:
+            self._outcomes.popleft()
+        return list(self._outcomes)
+
+    def summary(self):
+        with self._lock:
+            outcomes = self._recent(time.monotonic())
+            latencies = sorted(seconds for _, _, seconds in outcomes)
+            return {
+                "state": self.state,
+                "calls": len(outcomes),
+                "failures": sum(1 for _, ok, _ in outcomes if not ok),
+                "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2)
+                if latencies
+                else None,
+                "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 2)
+                if latencies
+                else None,
+                "retry_after_seconds": round(self.retry_after(), 1)
+                if self.state == OPEN
+                else None,
+                "rejected": self.rejected,
+                "stale_reads": self.stale_reads,
+            }
+
+
+class CircuitBreakers:
+    """
+    One CircuitBreaker per poll group, created on first use.
+    """
+
+    def __init__(self, enabled=BREAKERS, key=None):
+        """
+        :param key: Maps a poll group to the group whose breaker it shares,
+            for groups served by the same nodes.
+        """
+        self.enabled = enabled
+        self._key = key or (lambda group: group)
+        self._lock = Lock()
+        self._breakers = {}
+
+    def get(self, group):
+        group = self._key(group)
+        with self._lock:
+            breaker = self._breakers.get(group)
+            if breaker is None:
+                breaker = self._breakers[group] = CircuitBreaker(group)
+            return breaker
+
+    def allow(self, group):
+        return not self.enabled or self.get(group).allow()
+
+    def check(self, group, probe=True):
+        """
+        :param probe: Whether the caller records the outcome of its call, and
+            so may be let through as a probe while the circuit is half open.
+        :raise CircuitOpenError: If the group's circuit is open.
+        """
+        if not self.enabled:
+            return
+        breaker = self.get(group)
+        if not (breaker.allow() if probe else not breaker.is_open()):
+            raise CircuitOpenError(group, breaker.retry_after())
+
+    def record(self, group, ok, seconds):
+        if self.enabled:
+            self.get(group).record(ok, seconds)
+
+    @contextmanager
+    def call(self, group):
+        """
+        Fails fast if the group's circuit is open; otherwise records whether
+        the enclosed call failed to reach the group and how long it took.
+        """
+        self.check(group)
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.record(group, not is_group_failure(e), time.monotonic() - started)
+            raise
+        self.record(group, True, time.monotonic() - started)
+
+    def state(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {
+            "enabled": self.enabled,
+            "groups": {breaker.group: breaker.summary() for breaker in breakers},
+        }
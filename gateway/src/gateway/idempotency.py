@@ -0,0 +1,130 @@
+from flask import request, jsonify, make_response, g
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+from .log_config import setup_logger
+import hashlib
+import json
+import time
+import os
+
+logger = setup_logger(__name__)
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+# Completed responses are replayed for this long, per gateway process. After
+# that, or in another process, a retry still maps to the same promise id.
+TTL_SECONDS = float(os.getenv("GATEWAY_IDEMPOTENCY_TTL_SECONDS", "86400"))
+MAX_ENTRIES = int(os.getenv("GATEWAY_IDEMPOTENCY_MAX_ENTRIES", "10000"))
+
+
+class ResponseCache:
+    """
+    Completed responses by (route, idempotency key), least recently stored
+    first, bounded in size and age.
+    """
+
+    def __init__(self, ttl_seconds=TTL_SECONDS, max_entries=MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry
+
+    def put(self, key, fingerprint, response):
+        with self._lock:
+            self._entries.pop(key, None)
+            while len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+            self._entries[key] = {
+                "fingerprint": fingerprint,
+                "body": response.get_data(),
+                "status": response.status_code,
+                "mimetype": response.mimetype,
+                "expires_at": time.monotonic() + self.ttl_seconds,
+            }
+
+    def state(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def idempotent(cache):
+    """
+    Honors the Idempotency-Key header of a mutating route. A retry with the
+    same key and body gets the stored response of the first successful
+    request; a retry with a different body is rejected with 422. Handlers
+    build their promise id with promise_suffix(), so a retry that misses the
+    cache joins the original workflow instead of starting another.
+    """
+
+    def decorator(handler):
+        @wraps(handler)
+        def deduplicated(*args, **kwargs):
+            key = request.headers.get(HEADER)
+            if key is None:
+                return handler(*args, **kwargs)
+            if not key or len(key) > MAX_KEY_LENGTH:
+                error = f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters"
+                return jsonify({"error": error}), 400
+
+            cache_key = (request.path, key)
+            # Computed before the handler, which may add fields to the body.
+            body = json.dumps(request.get_json(silent=True), sort_keys=True)
+            fingerprint = hashlib.sha256(body.encode("utf-8")).hexdigest()
+            entry = cache.get(cache_key)
+            if entry is not None:
+                if entry["fingerprint"] != fingerprint:
+                    error = f"{HEADER} was already used with a different request"
+                    logger.warning(f"{request.path}: {error}")
+                    return jsonify({"error": error}), 422
+                logger.info(f"{request.path}: replaying response for {HEADER} {key}")
+                response = make_response(entry["body"], entry["status"])
+                response.mimetype = entry["mimetype"]
+                response.headers["Idempotent-Replayed"] = "true"
+                return response
+
+            g.idempotency_key = key
+            g.idempotency_fingerprint = fingerprint
+            response = make_response(handler(*args, **kwargs))
+            if 200 <= response.status_code < 300:
+                cache.put(cache_key, fingerprint, response)
+            return response
+
+        return deduplicated
+
+    return decorator
+
+
+def promise_suffix(timestamp):
+    """
+    :return: A suffix for the request's workflow promise id: derived from its
+        Idempotency-Key, route and body if it has a key, so retries share one
+        promise but a key reused for another request does not, and the
+        timestamp otherwise.
+    """
+    key = g.get("idempotency_key")
+    if key is None:
+        return str(timestamp)
+    identity = "\n".join([request.path, key, g.idempotency_fingerprint])
+    return f"key-{hashlib.sha256(identity.encode('utf-8')).hexdigest()[:32]}"
@@ -0,0 +1,45 @@
+from flask.json.provider import DefaultJSONProvider
+from .log_config import setup_logger
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = setup_logger(__name__)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Parses request bodies and serializes responses with orjson. Types orjson
+    does not handle fall back to Flask's default conversions.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(
+            obj, default=self.default, option=orjson.OPT_NON_STR_KEYS
+        ).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Skips the str round trip of DefaultJSONProvider.response, which
+        # matters for multi-megabyte views.
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(
+            obj,
+            default=self.default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE,
+        )
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def install_json_provider(app):
+    """
+    Uses orjson for request parsing and jsonify when it is installed.
+    """
+    if orjson is None:
+        logger.info("orjson is not installed, using the standard library json provider")
+        return
+    app.json = OrjsonProvider(app)
@@ -0,0 +1,191 @@
+from .log_config import setup_logger
+from .admission import TokenBucket
+from collections import Counter, deque
+from threading import BoundedSemaphore, Event, Lock, Thread
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import fcntl
+import time
+import os
+
+logger = setup_logger(__name__)
+
+# Orders re-driven at once, and at most this many per second, so that a
+# backlog of stuck orders does not hit the nodes all at the same time.
+RECOVERY_CONCURRENCY = int(os.getenv("GATEWAY_RECOVERY_CONCURRENCY", "4"))
+RECOVERY_RATE = float(os.getenv("GATEWAY_RECOVERY_RATE", "10"))
+# An order holds its slot until its workflow finishes or waits on a promise
+# again, or for at most this long, e.g. when another process runs it.
+RECOVERY_SETTLE_SECONDS = float(os.getenv("GATEWAY_RECOVERY_SETTLE_SECONDS", "30"))
+# Recovery runs in one worker process after startup, once the node is polling.
+RECOVER_AT_STARTUP = os.getenv("GATEWAY_RECOVER_AT_STARTUP", "1") == "1"
+RECOVERY_DELAY_SECONDS = float(os.getenv("GATEWAY_RECOVERY_DELAY_SECONDS", "5"))
+RECOVERY_LOCK_FILE = os.getenv("GATEWAY_RECOVERY_LOCK_FILE") or os.path.join(
+    tempfile.gettempdir(), "nomnomnow-gateway-recovery.lock"
+)
+MAX_RECOVERY_ERRORS = 20
+
+
+class RecoveryScheduler:
+    """
+    Re-drives unfinished orders in the background, with bounded concurrency
+    and a rate limit, and keeps count of how far it got.
+    """
+
+    def __init__(
+        self,
+        list_orders,
+        recover_order,
+        concurrency=RECOVERY_CONCURRENCY,
+        rate=RECOVERY_RATE,
+    ):
+        """
+        :param list_orders: Returns an iterable of the orders to recover.
+        :param recover_order: Recovers one order and returns what it did,
+            e.g. "reattached", and the handle of the workflow driving it;
+            raises if the order could not be recovered.
+        """
+        self._list_orders = list_orders
+        self._recover_order = recover_order
+        self.concurrency = concurrency
+        self.rate = rate
+        self._lock = Lock()
+        self._thread = None
+        self._settled = {}
+        self._reset()
+
+    def _reset(self):
+        self.status = "idle"
+        self.started_at = None
+        self.finished_at = None
+        self.found = 0
+        self.in_flight = 0
+        self.outcomes = Counter()
+        self.errors = deque(maxlen=MAX_RECOVERY_ERRORS)
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def join(self):
+        if self._thread is not None:
+            self._thread.join()
+
+    def start(self, delay=0):
+        """
+        Starts a recovery run unless one is already running.
+        :param delay: Seconds to wait before listing the orders.
+        :return: The scheduler state.
+        """
+        with self._lock:
+            if not self.running():
+                self._reset()
+                self.status = "starting"
+                self._thread = Thread(target=self._run, args=(delay,), daemon=True)
+                self._thread.start()
+        return self.state()
+
+    def _run(self, delay):
+        time.sleep(delay)
+        self.started_at = time.time()
+        self.status = "running"
+        bucket = TokenBucket(self.rate, 1)
+        slots = BoundedSemaphore(self.concurrency)
+        try:
+            with ThreadPoolExecutor(
+                self.concurrency, thread_name_prefix="recovery"
+            ) as pool:
+                for order in self._list_orders():
+                    with self._lock:
+                        self.found += 1
+                    wait = bucket.take()
+                    while wait:
+                        time.sleep(wait)
+                        wait = bucket.take()
+                    slots.acquire()
+                    with self._lock:
+                        self.in_flight += 1
+                    pool.submit(self._recover, order, slots)
+            self.status = "finished"
+        except Exception as e:
+            logger.error(f"order recovery stopped: {e}")
+            self.errors.append(f"listing orders: {e}")
+            self.status = "failed"
+        self.finished_at = time.time()
+        logger.info(f"order recovery {self.status}: {self.summary()}")
+
+    def _recover(self, order, slots):
+        key = (order["customer_email"], order["order_id"])
+        settled = self._settled[key] = Event()
+        try:
+            outcome, handle = self._recover_order(order)
+            handle.f.add_done_callback(lambda _: settled.set())
+            if not settled.wait(RECOVERY_SETTLE_SECONDS):
+                logger.warning(
+                    f"order {order['order_id']} did not settle in {RECOVERY_SETTLE_SECONDS}s"
+                )
+            elif handle.f.done():
+                # Raises if the workflow failed.
+                handle.result()
+        except Exception as e:
+            logger.error(f"could not recover order {order['order_id']}: {e}")
+            outcome = "failed"
+            self.errors.append(f"order {order['order_id']}: {e}")
+        finally:
+            self._settled.pop(key, None)
+            slots.release()
+        with self._lock:
+            self.in_flight -= 1
+            self.outcomes[outcome] += 1
+
+    def waiting(self, customer_email, order_id):
+        """
+        Called by the order workflows when they wait on a promise; frees the
+        slot of the order if it is being recovered.
+        """
+        settled = self._settled.get((customer_email, order_id))
+        if settled is not None:
+            settled.set()
+
+    def summary(self):
+        with self._lock:
+            done = sum(self.outcomes.values())
+            return {
+                "found": self.found,
+                "done": done,
+                "in_flight": self.in_flight,
+                **dict(self.outcomes),
+            }
+
+    def state(self):
+        return {
+            "status": self.status,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "concurrency": self.concurrency,
+            "rate": self.rate,
+            "progress": self.summary(),
+            "errors": list(self.errors),
+        }
+
+
+def start_recovery_at_startup(scheduler):
+    """
+    Starts recovery when GATEWAY_RECOVER_AT_STARTUP=1, in the first gateway
+    process to take the recovery lock; the others skip it.
+    """
+    if not RECOVER_AT_STARTUP:
+        return
+    lock_file = open(RECOVERY_LOCK_FILE, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        logger.info("order recovery is run by another gateway process")
+        return
+
+    def release():
+        scheduler.join()
+        lock_file.close()
+
+    scheduler.start(RECOVERY_DELAY_SECONDS)
+    Thread(target=release, daemon=True).start()
@@ -0,0 +1,58 @@
+# Must match REPORT_KINDS of the orders service.
+REPORT_KINDS = ("summary", "revenue", "top-products", "status-durations")
+REPORT_PERIODS = ("day", "hour")
+
+# Rows with the same key are summed across shards; the other fields of a row
+# are copied from the first shard that reports it.
+REPORT_KEYS = {
+    "summary": (),
+    "revenue": ("period",),
+    "top-products": ("product_name",),
+    "status-durations": ("from_status", "to_status"),
+}
+REPORT_SUMS = {
+    "summary": ("orders", "revenue", "delivery_fees", "items", "items_revenue"),
+    "revenue": ("orders", "revenue", "delivery_fees"),
+    "top-products": ("quantity", "revenue"),
+    "status-durations": ("transitions", "total_seconds"),
+}
+
+
+def merge_reports(kind, reports, limit=None):
+    """
+    Combines the reports of every orders shard into one.
+    :param kind: One of REPORT_KINDS.
+    :param reports: The "report" of each shard's get_report result.
+    :param limit: Number of top products to keep.
+    :return: The merged report; snapshot_at is that of the oldest shard.
+    """
+    merged = {}
+    for report in reports:
+        for row in report["rows"]:
+            key = tuple(row[field] for field in REPORT_KEYS[kind])
+            if key not in merged:
+                merged[key] = dict(row)
+                continue
+            for field in REPORT_SUMS[kind]:
+                merged[key][field] += row[field]
+    rows = list(merged.values())
+
+    if kind == "summary":
+        rows = rows or [dict.fromkeys(REPORT_SUMS[kind], 0)]
+        for row in rows:
+            row["avg_order_value"] = row["revenue"] / row["orders"] if row["orders"] else 0
+    elif kind == "revenue":
+        rows.sort(key=lambda row: row["period"])
+    elif kind == "top-products":
+        rows.sort(key=lambda row: (-row["quantity"], row["product_name"]))
+        rows = rows[:limit]
+    elif kind == "status-durations":
+        for row in rows:
+            row["avg_seconds"] = row["total_seconds"] / row["transitions"]
+        rows.sort(key=lambda row: (row["from_status"], row["to_status"]))
+
+    return {
+        "kind": kind,
+        "snapshot_at": min((report["snapshot_at"] for report in reports), default=None),
+        "rows": rows,
+    }
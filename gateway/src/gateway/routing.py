@@ -0,0 +1,84 @@
+from resonate.targets import poll
+import zlib
+import os
+
+# Must match the ORDERS_SHARDS setting of the orders service nodes.
+ORDERS_SHARDS = int(os.getenv("ORDERS_SHARDS", "1"))
+# Send lookups to read-only replica nodes instead of the primary group.
+CUSTOMERS_READ_REPLICAS = os.getenv("CUSTOMERS_READ_REPLICAS", "0") == "1"
+PRODUCTS_READ_REPLICAS = os.getenv("PRODUCTS_READ_REPLICAS", "0") == "1"
+# Send the reads behind views to the services' interactive groups, which
+# primary nodes serve ahead of order steps. Requires nodes that poll them.
+GATEWAY_INTERACTIVE_GROUPS = os.getenv("GATEWAY_INTERACTIVE_GROUPS", "1") == "1"
+
+
+def breaker_group(group):
+    """
+    Returns the group whose circuit breaker covers group. An interactive group
+    is served by the nodes of its default group, so reads and mutations share
+    one breaker and a failure of either opens it for both.
+    """
+    return group.replace("-interactive-nodes", "-nodes")
+
+
+def customers_group():
+    return poll("customers-service-nodes")
+
+
+def customers_read_group():
+    if CUSTOMERS_READ_REPLICAS:
+        return poll("customers-service-read-nodes")
+    if GATEWAY_INTERACTIVE_GROUPS:
+        return poll("customers-service-interactive-nodes")
+    return customers_group()
+
+
+def products_group():
+    return poll("products-service-nodes")
+
+
+def products_read_group():
+    if PRODUCTS_READ_REPLICAS:
+        return poll("products-service-read-nodes")
+    if GATEWAY_INTERACTIVE_GROUPS:
+        return poll("products-service-interactive-nodes")
+    return products_group()
+
+
+def orders_shard(customer_email):
+    """
+    Returns the orders shard that owns the carts and orders of a customer.
+    :param customer_email: Email of the customer.
+    :return: Shard index between 0 and ORDERS_SHARDS - 1.
+    """
+    return zlib.crc32(customer_email.encode("utf-8")) % ORDERS_SHARDS
+
+
+def orders_shard_group(shard):
+    if ORDERS_SHARDS == 1:
+        return poll("orders-service-nodes")
+    return poll(f"orders-service-nodes-{shard}")
+
+
+def orders_group(customer_email):
+    return orders_shard_group(orders_shard(customer_email))
+
+
+def orders_groups():
+    return [orders_shard_group(shard) for shard in range(ORDERS_SHARDS)]
+
+
+def orders_shard_read_group(shard):
+    if not GATEWAY_INTERACTIVE_GROUPS:
+        return orders_shard_group(shard)
+    if ORDERS_SHARDS == 1:
+        return poll("orders-service-interactive-nodes")
+    return poll(f"orders-service-interactive-nodes-{shard}")
+
+
+def orders_read_group(customer_email):
+    return orders_shard_read_group(orders_shard(customer_email))
+
+
+def orders_read_groups():
+    return [orders_shard_read_group(shard) for shard in range(ORDERS_SHARDS)]
@@ -0,0 +1,316 @@
+from resonate.result import Err
+from .log_config import setup_logger
+from .codec import PayloadEncoder
+from .breaker import STALE_SECONDS, CircuitBreakers, CircuitOpenError
+from collections import defaultdict, deque
+from threading import Event, Lock
+from uuid import uuid4
+import time
+import json
+import os
+
+logger = setup_logger(__name__)
+
+# How long a dispatched read may stay pending before the store times it out.
+RPC_TIMEOUT_SECONDS = float(os.getenv("GATEWAY_RPC_TIMEOUT_SECONDS", "30"))
+# Identical reads within this window share one dispatch and its result.
+READ_CACHE_SECONDS = float(os.getenv("GATEWAY_READ_CACHE_SECONDS", "1"))
+# How long a caller waits for a read before giving up.
+READ_DEADLINE_SECONDS = float(os.getenv("GATEWAY_READ_DEADLINE_SECONDS", "5"))
+# Send a duplicate of a slow read to the group after the p95 latency.
+HEDGE_READS = os.getenv("GATEWAY_HEDGE_READS", "0") == "1"
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv("GATEWAY_HEDGE_MIN_DELAY_MS", "20")) / 1000
+HEDGE_MIN_SAMPLES = 20
+# Reads whose last result is kept for serving while a circuit is open.
+MAX_REMEMBERED_RESULTS = 10_000
+
+encoder = PayloadEncoder()
+
+
+class LatencyTracker:
+    def __init__(self, size=1000):
+        self._lock = Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=size))
+
+    def record(self, func, seconds):
+        with self._lock:
+            self._samples[func].append(seconds)
+
+    def percentile(self, func, p):
+        """
+        :return: The p-th percentile latency of func in seconds, or None while
+            there are fewer than HEDGE_MIN_SAMPLES samples.
+        """
+        with self._lock:
+            samples = sorted(self._samples[func])
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+    def summary(self):
+        with self._lock:
+            snapshot = {func: sorted(samples) for func, samples in self._samples.items()}
+        return {
+            func: {
+                "count": len(samples),
+                "p50_ms": round(samples[len(samples) // 2] * 1000, 2),
+                "p95_ms": round(samples[int(len(samples) * 0.95)] * 1000, 2),
+                "p99_ms": round(samples[int(len(samples) * 0.99)] * 1000, 2),
+            }
+            for func, samples in snapshot.items()
+            if samples
+        }
+
+
+class RpcCall:
+    """
+    A registered function dispatched straight to a poll group. The service
+    node runs it as a root task and resolves its promise; no gateway workflow,
+    child promises or callbacks are involved.
+    """
+
+    def __init__(self, func, group, args, on_complete=None):
+        self.id = f"rpc-{func}-{uuid4().hex}"
+        self.func = func
+        self.group = group
+        self.args = args
+        self.on_complete = on_complete
+        self.created_at = time.monotonic()
+        self.completed_at = None
+        self._dispatched = Event()
+        self._dispatch_error = None
+        self._lock = Lock()
+        self._record = None
+        self.outcome_recorded = False
+
+    def dispatch(self, store):
+        self._store = store
+        try:
+            store.promises.create(
+                id=self.id,
+                ikey=None,
+                strict=False,
+                headers=None,
+                data=encoder.encode(
+                    {"func": self.func, "args": list(self.args), "kwargs": {}}
+                ),
+                timeout=int((time.time() + RPC_TIMEOUT_SECONDS) * 1000),
+                tags={"resonate:invoke": self.group, "nomnomnow:ephemeral": "true"},
+            )
+        except Exception as e:
+            self._dispatch_error = e
+            self.completed_at = time.monotonic()
+            raise
+        finally:
+            self._dispatched.set()
+
+    def done(self):
+        return self.completed_at is not None
+
+    def poll(self):
+        """
+        Checks the store once, unless another thread is already doing so.
+        :return: True once the call has completed.
+        """
+        if self.done():
+            return True
+        if not self._dispatched.is_set() or not self._lock.acquire(blocking=False):
+            return False
+        try:
+            if self._record is None:
+                record = self._store.promises.get(id=self.id)
+                if record.is_completed():
+                    self._record = record
+                    self.completed_at = time.monotonic()
+                    if self.on_complete is not None:
+                        self.on_complete(self)
+        finally:
+            self._lock.release()
+        return self.done()
+
+    def value(self):
+        if self._dispatch_error is not None:
+            raise self._dispatch_error
+        if self._record.is_timeout() or self._record.is_canceled():
+            raise TimeoutError(f"{self.func} was not completed by any node")
+        value = self._record.get_value(encoder)
+        if isinstance(value, Err):
+            raise value.err()
+        return value.unwrap()
+
+
+def wait_first(calls, deadline):
+    """
+    Polls the store until one of the calls completes.
+    :param deadline: time.monotonic() value to give up at, or None.
+    :return: The first completed call.
+    """
+    delay = 0.002
+    while True:
+        for call in calls:
+            if call.poll():
+                return call
+        if deadline is None:
+            time.sleep(delay)
+        else:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(
+                    f"{calls[0].func} did not complete before its deadline"
+                )
+            time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.05)
+
+
+class Read:
+    """
+    A pending read with its own deadline, optionally hedged with a duplicate
+    dispatch when the first one is slower than the function's p95 latency.
+    """
+
+    def __init__(self, client, key, call, deadline, hedge):
+        self._client = client
+        self._key = key
+        self._call = call
+        self._deadline = None if deadline is None else time.monotonic() + deadline
+        self._hedge = hedge
+        self._started_at = time.monotonic()
+
+    def result(self):
+        call = self._call
+        calls = [call]
+        if self._hedge and not call.done():
+            delay = self._client.latency.percentile(call.func, 95)
+            hedge_at = time.monotonic() + max(delay or 0, HEDGE_MIN_DELAY_SECONDS)
+            if self._deadline is not None:
+                hedge_at = min(hedge_at, self._deadline)
+            try:
+                call = wait_first(calls, hedge_at)
+            except TimeoutError:
+                if self._deadline is not None and time.monotonic() >= self._deadline:
+                    raise
+                logger.info(f"hedging slow read {call.func} on {call.group}")
+                calls.append(self._client.dispatch(call.func, call.group, call.args))
+        if not call.done():
+            try:
+                call = wait_first(calls, self._deadline)
+            except TimeoutError:
+                for pending in calls:
+                    self._client._record_outcome(pending, False)
+                raise
+        self._client.read_latency.record(
+            call.func, time.monotonic() - self._started_at
+        )
+        value = call.value()
+        self._client._remember(self._key, value)
+        return value
+
+
+class StaleRead:
+    """
+    The last result of a read, served while its group's circuit is open.
+    """
+
+    def __init__(self, value):
+        self._value = value
+
+    def result(self):
+        return self._value
+
+
+class RpcClient:
+    """
+    Ephemeral invocation mode for read-only gateway calls. Each read is a
+    single short-lived promise instead of a durable workflow, and identical
+    reads within READ_CACHE_SECONDS share one dispatch.
+    """
+
+    def __init__(self, store, breakers=None):
+        self._store = store
+        self._lock = Lock()
+        self._calls = {}
+        # last successful result of each read, for groups with an open circuit
+        self._results = {}
+        self.breakers = breakers or CircuitBreakers()
+        # latency of individual dispatches, as served by the nodes
+        self.latency = LatencyTracker()
+        # latency seen by callers, after hedging
+        self.read_latency = LatencyTracker()
+
+    def send(self, func, group, *args, deadline=READ_DEADLINE_SECONDS, hedge=HEDGE_READS):
+        """
+        Dispatches a read-only function to a poll group.
+        :param deadline: Seconds from now the caller will wait for the result.
+        :param hedge: Whether to send a duplicate when the read is slow.
+        :return: A Read; call result() to wait for the value.
+        :raise CircuitOpenError: If the group's circuit is open and there is
+            no result of the same read from the last STALE_SECONDS.
+        """
+        key = (func, group, json.dumps(args, sort_keys=True))
+        now = time.monotonic()
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None or not self._fresh(call, now):
+                call = None
+                self._evict(now)
+        if call is None:
+            if not self.breakers.allow(group):
+                return self._stale(key, group, now)
+            call = self.dispatch(func, group, args)
+            with self._lock:
+                self._calls[key] = call
+        return Read(self, key, call, deadline, hedge)
+
+    def _stale(self, key, group, now):
+        breaker = self.breakers.get(group)
+        with self._lock:
+            result = self._results.get(key)
+        if result is None or now - result[1] > STALE_SECONDS:
+            raise CircuitOpenError(group, breaker.retry_after())
+        breaker.stale_reads += 1
+        logger.info(f"circuit for {group} is open, serving {key[0]} from cache")
+        return StaleRead(result[0])
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._results[key] = (value, time.monotonic())
+            if len(self._results) > MAX_REMEMBERED_RESULTS:
+                del self._results[next(iter(self._results))]
+
+    def dispatch(self, func, group, args):
+        call = RpcCall(func, group, args, on_complete=self._record_latency)
+        call.dispatch(self._store)
+        return call
+
+    def _record_latency(self, call):
+        self.latency.record(call.func, call.completed_at - call.created_at)
+        # A rejected read was run by a node; only unanswered ones count.
+        self._record_outcome(
+            call, not (call._record.is_timeout() or call._record.is_canceled())
+        )
+
+    def _record_outcome(self, call, ok):
+        # A call shared by several readers counts once.
+        if call.outcome_recorded:
+            return
+        call.outcome_recorded = True
+        elapsed = (call.completed_at or time.monotonic()) - call.created_at
+        self.breakers.record(call.group, ok, elapsed)
+
+    def _fresh(self, call, now):
+        if not call.done():
+            # A call a reader already gave up on is not shared with new readers.
+            return not call.outcome_recorded and now - call.created_at < RPC_TIMEOUT_SECONDS
+        return now - call.completed_at < READ_CACHE_SECONDS
+
+    def _evict(self, now):
+        expired = [key for key, call in self._calls.items() if not self._fresh(call, now)]
+        for key in expired:
+            del self._calls[key]
+
+    def state(self):
+        return {
+            "dispatch_latency": self.latency.summary(),
+            "read_latency": self.read_latency.summary(),
+            "breakers": self.breakers.state(),
+        }
@@ -0,0 +1,60 @@
+from gunicorn.app.base import BaseApplication
+from .log_config import setup_logger
+from .admission import GATEWAY_THREADS, check_limits
+from . import startup
+import multiprocessing
+import os
+
+logger = setup_logger(__name__)
+
+
+def server_options():
+    """
+    Reads the production server settings from the environment.
+    :return: Gunicorn settings for the gateway.
+    """
+    return {
+        "bind": os.getenv("GATEWAY_BIND", "127.0.0.1:5000"),
+        "workers": int(os.getenv("GATEWAY_WORKERS", multiprocessing.cpu_count())),
+        # Route handlers block on workflow results, so each worker serves
+        # requests from a pool of threads.
+        "worker_class": "gthread",
+        "threads": GATEWAY_THREADS,
+        "timeout": int(os.getenv("GATEWAY_TIMEOUT", "120")),
+        "graceful_timeout": int(os.getenv("GATEWAY_GRACEFUL_TIMEOUT", "30")),
+        # Never import the app in the master: the Resonate scheduler, store
+        # session and poller threads must be created after the fork.
+        "preload_app": False,
+    }
+
+
+class GatewayServer(BaseApplication):
+    """
+    Runs the gateway under gunicorn with one Resonate node per worker process.
+    Send SIGHUP to the master for a graceful reload of all workers.
+    """
+
+    def __init__(self, options=None):
+        self.options = options or server_options()
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Called in each worker after the fork.
+        return startup()
+
+
+def main():
+    options = server_options()
+    check_limits(options["threads"])
+    logger.info(
+        f"API Gateway production server starting on {options['bind']} with {options['workers']} workers"
+    )
+    GatewayServer(options).run()
+
+
+if __name__ == "__main__":
+    main()
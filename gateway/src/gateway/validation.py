@@ -0,0 +1,48 @@
+from flask import request, jsonify
+from functools import wraps
+from .log_config import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class RequestSchema:
+    """
+    Required fields of a route's JSON body, built once at import time.
+    """
+
+    def __init__(self, *fields, message=None):
+        self.fields = tuple(fields)
+        self.message = message or (
+            ", ".join(f"'{field}'" for field in self.fields) + " required"
+        )
+
+    def validate(self, data):
+        """
+        :return: None if the body is valid, otherwise an error message.
+        """
+        if not isinstance(data, dict):
+            return "request body must be a JSON object"
+        for field in self.fields:
+            if field not in data:
+                return self.message
+        return None
+
+
+def validate_json(schema):
+    """
+    Rejects requests whose JSON body does not match schema with a 400. The
+    parsed body is cached by Flask, so handlers read it again for free.
+    """
+
+    def decorator(handler):
+        @wraps(handler)
+        def validated(*args, **kwargs):
+            error = schema.validate(request.get_json(silent=True))
+            if error is not None:
+                logger.error(f"{request.path}: {error}")
+                return jsonify({"error": error}), 400
+            return handler(*args, **kwargs)
+
+        return validated
+
+    return decorator
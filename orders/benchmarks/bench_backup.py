@@ -0,0 +1,136 @@
+"""
+Measures how online backups affect task latency. Tasks read and update
+orders at a fixed rate on one connection, as a node's workers do, while
+backups of the database run back to back on the same connection: stepped a
+few pages at a time as the node does, or in one step for comparison. Task
+latency counts from when the task was due, so time spent waiting behind a
+backup step is included.
+
+    python benchmarks/bench_backup.py --orders 200000 --rate 200
+"""
+
+from orders import get_order_by_id, start_orders_db, update_order_by_id
+from orders.backup import OnlineBackup, backup_settings
+from threading import Event, Thread
+import tempfile
+import argparse
+import logging
+import random
+import time
+import os
+
+
+class Ctx:
+    def __init__(self, db):
+        self.dependencies = {"orders-db": db, "orders-carts": None}
+
+    def get_dependency(self, key):
+        # As resonate's Dependencies.get, which raises KeyError for unknown keys.
+        return self.dependencies[key]
+
+
+def populate(db, orders):
+    stmt = db.cursor()
+    stmt.executemany(
+        "INSERT INTO orders (order_id, order_status, order_total, customer_email, customer_delivery_address) VALUES (?, ?, ?, ?, ?)",
+        (
+            (order_id, "payment_complete", 25, f"customer_{order_id % 5000}@example.com", "1 Main St, Oakland 94607")
+            for order_id in range(1, orders + 1)
+        ),
+    )
+    stmt.executemany(
+        "INSERT INTO order_items (order_id, product_name, product_display, product_price, product_image) VALUES (?, ?, ?, ?, ?)",
+        (
+            (order_id, f"product_{item}", f"Product {item}", 10, "")
+            for order_id in range(1, orders + 1)
+            for item in range(2)
+        ),
+    )
+    db.commit()
+
+
+def run_tasks(ctx, orders, rate, duration):
+    """
+    Runs a read and an update of a random order every 1/rate seconds.
+    :return: Sorted task latencies in seconds.
+    """
+    latencies = []
+    interval = 1 / rate
+    due = time.perf_counter()
+    deadline = due + duration
+    while due < deadline:
+        now = time.perf_counter()
+        if now < due:
+            time.sleep(due - now)
+        order_id = random.randint(1, orders)
+        get_order_by_id(ctx, order_id)
+        update_order_by_id(ctx, {"order_id": order_id, "order_status": "driver_confirmed"})
+        latencies.append(time.perf_counter() - due)
+        due += interval
+    return sorted(latencies)
+
+
+def run_backups(backup, stop, results):
+    while not stop.is_set():
+        results.append(backup.backup())
+
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=200_000)
+    parser.add_argument("--rate", type=float, default=200, help="tasks per second")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--pages", type=int, default=64)
+    parser.add_argument("--pause-ms", type=float, default=20)
+    parser.add_argument("--dir", default=None)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    modes = [
+        ("no backup", None),
+        (f"{args.pages} pages/step", args.pages),
+        ("one step", -1),
+    ]
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        db = start_orders_db(os.path.join(directory, "orders.db"))
+        populate(db, args.orders)
+        size = os.path.getsize(os.path.join(directory, "orders.db")) / 2**20
+        print(f"{args.orders} orders, {size:.0f} MiB, {args.rate:.0f} tasks/s")
+        print(
+            f"{'backup':>16} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+            f"{'backups':>8} {'backup s':>9} {'step ms':>8}"
+        )
+        for name, pages in modes:
+            results = []
+            stop = Event()
+            if pages is not None:
+                settings = {
+                    **backup_settings("ORDERS"),
+                    "directory": os.path.join(directory, "backups"),
+                    "keep": 1,
+                    "pages": pages,
+                    "pause": args.pause_ms / 1000,
+                }
+                thread = Thread(
+                    target=run_backups,
+                    args=(OnlineBackup(db, "orders", settings), stop, results),
+                )
+                thread.start()
+            latencies = run_tasks(Ctx(db), args.orders, args.rate, args.duration)
+            stop.set()
+            if pages is not None:
+                thread.join()
+            seconds = sum(r["seconds"] for r in results) / len(results) if results else 0
+            step = max((r["max_step_ms"] for r in results), default=0)
+            print(
+                f"{name:>16} {percentile(latencies, 50):>8.2f} {percentile(latencies, 99):>8.2f} "
+                f"{latencies[-1] * 1000:>8.2f} {len(results):>8} {seconds:>9.2f} {step:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
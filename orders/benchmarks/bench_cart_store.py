@@ -0,0 +1,148 @@
+"""
+Measures cart operations with carts in SQLite and with the in-memory cart
+store. Each operation does what add_to_cart_workflow and
+remove_from_cart_workflow do: change the cart, read it back and update its
+totals. Customers then check out the way order_workflow starts, which flushes
+their cart, and the script checks that the database holds every cart as the
+operations left it.
+
+    python benchmarks/bench_cart_store.py --customers 1000 --ops 20
+"""
+
+from orders import (
+    CartStore,
+    add_to_cart,
+    get_or_create_cart,
+    get_order_by_id,
+    insert_cart,
+    query_cart,
+    remove_from_cart,
+    start_orders_db,
+    update_order_by_id,
+)
+import tempfile
+import argparse
+import logging
+import random
+import time
+import os
+
+
+class Ctx:
+    def __init__(self, db, carts):
+        self.dependencies = {"orders-db": db, "orders-carts": carts}
+
+    def get_dependency(self, key):
+        # As resonate's Dependencies.get, which raises KeyError for unknown keys.
+        return self.dependencies[key]
+
+
+PRODUCTS = [
+    {
+        "product_name": f"product_{n}",
+        "product_display": f"Product {n}",
+        "product_price": 5 + n,
+        "product_image": f"product_{n}.png",
+    }
+    for n in range(10)
+]
+
+
+def update_totals(ctx, cart):
+    """
+    The body of update_cart_totals, which runs as a workflow step.
+    """
+    items_total = sum(item["product_price"] for item in cart["items"])
+    cart["cart_item_count"] = len(cart["items"])
+    cart["order_items_total"] = items_total
+    cart["order_total"] = items_total + cart["order_delivery_fee"]
+    update_order_by_id(ctx, cart)
+
+
+def cart_op(ctx, customer_email):
+    cart = get_or_create_cart(ctx, customer_email)["cart"]
+    data = {"order_id": cart["order_id"], "customer_email": customer_email}
+    if cart["items"] and random.random() < 0.3:
+        remove_from_cart(ctx, {**data, "item": random.choice(cart["items"])})
+    else:
+        add_to_cart(ctx, {**data, "product": random.choice(PRODUCTS)})
+    update_totals(ctx, get_or_create_cart(ctx, customer_email)["cart"])
+
+
+def run(directory, use_store, customers, ops, flush_ms):
+    db = start_orders_db(os.path.join(directory, f"orders-{use_store}.db"))
+    carts = None
+    if use_store:
+        carts = CartStore(db, query_cart, insert_cart, flush_ms / 1000, 256, 100_000)
+        carts.start()
+    ctx = Ctx(db, carts)
+    emails = [f"customer_{n}@example.com" for n in range(customers)]
+    for email in emails:
+        get_or_create_cart(ctx, email)
+
+    random.seed(1)
+    latencies = []
+    for _ in range(ops):
+        for email in emails:
+            started = time.perf_counter()
+            cart_op(ctx, email)
+            latencies.append(time.perf_counter() - started)
+    latencies.sort()
+
+    expected = {email: get_or_create_cart(ctx, email)["cart"] for email in emails}
+    checkout = []
+    for email in emails:
+        order_id = expected[email]["order_id"]
+        started = time.perf_counter()
+        get_order_by_id(ctx, order_id)
+        update_order_by_id(ctx, {"order_id": order_id, "order_status": "payment_required"})
+        checkout.append(time.perf_counter() - started)
+    checkout.sort()
+    if carts is not None:
+        carts.close()
+
+    for email in emails:
+        order = get_order_by_id(ctx, expected[email]["order_id"])["order"]
+        items = sorted(item["item_id"] for item in order["items"])
+        if items != sorted(item["item_id"] for item in expected[email]["items"]):
+            raise Exception(f"items of {email} were not written")
+        if order["order_total"] != expected[email]["order_total"]:
+            raise Exception(f"totals of {email} were not written")
+    gauges = carts.gauges() if carts is not None else {}
+    db.close()
+    return latencies, checkout, gauges
+
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--ops", type=int, default=20, help="cart operations per customer")
+    parser.add_argument("--flush-ms", type=float, default=200)
+    parser.add_argument("--dir", default=None)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    print(f"{args.customers} customers, {args.ops} cart operations each")
+    print(
+        f"{'carts':>8} {'op p50 us':>10} {'op p99 us':>10} {'ops/s':>9} "
+        f"{'checkout p50 us':>16} {'flushes':>8} {'carts written':>14}"
+    )
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        for name, use_store in (("sqlite", False), ("memory", True)):
+            latencies, checkout, gauges = run(
+                directory, use_store, args.customers, args.ops, args.flush_ms
+            )
+            print(
+                f"{name:>8} {percentile(latencies, 50):>10.1f} {percentile(latencies, 99):>10.1f} "
+                f"{len(latencies) / sum(latencies):>9.0f} {percentile(checkout, 50):>16.1f} "
+                f"{gauges.get('cart_store_flushes', '-'):>8} "
+                f"{gauges.get('cart_store_carts_written', '-'):>14}"
+            )
+
+
+if __name__ == "__main__":
+    main()
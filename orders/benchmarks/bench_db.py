@@ -0,0 +1,257 @@
+"""
+Measures the orders read functions against synthetic databases of growing
+size. Each database has a cart per customer, ten orders per customer, mostly
+delivered, with a few percent at each in-progress status, and one to four
+items per order. The functions are called directly with a stub context, as a
+node's workers call them.
+
+Results are written as tab separated values sorted by function and size, so
+runs on two commits can be diffed, or compared with --baseline.
+
+    python benchmarks/bench_db.py --sizes 10000 100000 1000000 --output orders.tsv
+    python benchmarks/bench_db.py --data-dir /tmp/bench-data --baseline orders.tsv
+"""
+
+from orders import (
+    get_customer_orders,
+    get_deliverable_orders,
+    get_in_progress_orders,
+    get_or_create_cart,
+    start_orders_db,
+)
+import tempfile
+import argparse
+import logging
+import random
+import time
+import csv
+import os
+
+# Share of the orders that are not carts in each status.
+STATUS_WEIGHTS = {
+    "delivered": 90,
+    "payment_required": 2,
+    "payment_complete": 1,
+    "restaurant_confirmed": 2,
+    "driver_confirmed": 1.5,
+    "ready_for_pickup": 1.5,
+    "out_for_delivery": 2,
+}
+ZONED_STATUSES = (
+    "restaurant_confirmed",
+    "driver_confirmed",
+    "ready_for_pickup",
+    "out_for_delivery",
+    "delivered",
+)
+ADDRESSES = [
+    ("100 Market St, San Francisco 94105", "san-francisco"),
+    ("200 El Camino Real, Palo Alto 94301", "peninsula"),
+    ("300 Broadway, Oakland 94607", "east-bay"),
+    ("400 First St, San Jose 95113", "south-bay"),
+    ("500 Main St, Sacramento 95814", "unzoned"),
+]
+ORDERS_PER_CUSTOMER = 10
+MIN_CALLS = 3
+FIELDS = ["function", "size", "calls", "p50_ms", "p95_ms", "mean_ms", "rows_per_call", "rows_per_s"]
+
+
+class Ctx:
+    def __init__(self, db):
+        self.dependencies = {"orders-db": db, "orders-carts": None}
+
+    def get_dependency(self, key):
+        # As resonate's Dependencies.get, which raises KeyError for unknown keys.
+        return self.dependencies[key]
+
+
+def customer_email(n):
+    return f"customer_{n}@example.com"
+
+
+def generate(path, size, seed=1):
+    """
+    Writes an orders database with size orders, carts included.
+    """
+    rng = random.Random(seed)
+    customers = max(1, size // (ORDERS_PER_CUSTOMER + 1))
+    statuses = list(STATUS_WEIGHTS)
+    weights = list(STATUS_WEIGHTS.values())
+    started = time.time() - 365 * 86400
+
+    def orders():
+        for order_id in range(1, size + 1):
+            if order_id <= customers:
+                status, customer = "cart", order_id - 1
+            else:
+                status, customer = rng.choices(statuses, weights)[0], rng.randrange(customers)
+            address, zone = ADDRESSES[customer % len(ADDRESSES)]
+            date = started + 365 * 86400 * order_id / size
+            yield (
+                order_id,
+                status,
+                customer_email(customer),
+                f"Customer {customer}",
+                address,
+                time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(date)),
+                zone if status in ZONED_STATUSES else None,
+            )
+
+    def items():
+        for order_id in range(1, size + 1):
+            for _ in range(rng.randint(0 if order_id <= customers else 1, 4)):
+                product = rng.randrange(200)
+                yield (order_id, f"product_{product}", f"Product {product}", 5 + product % 20, f"product_{product}.png")
+
+    partial = f"{path}.partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+    db = start_orders_db(partial)
+    stmt = db.cursor()
+    stmt.executemany(
+        """
+        INSERT INTO orders (order_id, order_status, customer_email, customer_name, customer_delivery_address, order_date, delivery_zone)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        orders(),
+    )
+    stmt.executemany(
+        "INSERT INTO order_items (order_id, product_name, product_display, product_price, product_image) VALUES (?, ?, ?, ?, ?)",
+        items(),
+    )
+    stmt.execute(
+        """
+        UPDATE orders SET
+            order_items_total = (SELECT COALESCE(SUM(product_price), 0) FROM order_items WHERE order_items.order_id = orders.order_id),
+            order_total = order_delivery_fee + (SELECT COALESCE(SUM(product_price), 0) FROM order_items WHERE order_items.order_id = orders.order_id)
+        """
+    )
+    db.commit()
+    db.close()
+    os.replace(partial, path)
+
+
+def calls(db, customers, rng):
+    """
+    :return: Dictionary of function name to a call returning the rows it read.
+    """
+    ctx = Ctx(db)
+    return {
+        "get_customer_orders": lambda: len(
+            get_customer_orders(ctx, customer_email(rng.randrange(customers)))["orders"]
+        ),
+        "get_in_progress_orders": lambda: len(get_in_progress_orders(ctx)["orders"]),
+        "get_deliverable_orders": lambda: len(get_deliverable_orders(ctx)["orders"]),
+        "get_deliverable_orders[zone]": lambda: len(
+            get_deliverable_orders(ctx, ["east-bay"])["orders"]
+        ),
+        "get_or_create_cart": lambda: len(
+            [get_or_create_cart(ctx, customer_email(rng.randrange(customers)))["cart"]]
+        ),
+    }
+
+
+def measure(call, seconds, max_calls):
+    """
+    Calls call until seconds have passed or it was called max_calls times,
+    after one warm-up call.
+    """
+    call()
+    latencies = []
+    rows = 0
+    started = time.perf_counter()
+    while len(latencies) < max_calls and (
+        len(latencies) < MIN_CALLS or time.perf_counter() - started < seconds
+    ):
+        call_started = time.perf_counter()
+        rows += call()
+        latencies.append(time.perf_counter() - call_started)
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        "calls": len(latencies),
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+        "mean_ms": total / len(latencies) * 1000,
+        "rows_per_call": rows / len(latencies),
+        "rows_per_s": rows / total if total else 0,
+    }
+
+
+def rounded(value):
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    return str(value)
+
+
+def write_results(results, path):
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, FIELDS, delimiter="\t", lineterminator="\n")
+        writer.writeheader()
+        for result in results:
+            writer.writerow({key: rounded(value) for key, value in result.items()})
+
+
+def read_baseline(path):
+    with open(path, newline="") as file:
+        return {
+            (row["function"], row["size"]): float(row["p50_ms"])
+            for row in csv.DictReader(file, delimiter="\t")
+        }
+
+
+def print_results(results, baseline):
+    print(
+        f"{'function':<30} {'size':>8} {'calls':>6} {'p50 ms':>9} {'p95 ms':>9} "
+        f"{'rows/call':>10} {'rows/s':>10}" + (f" {'p50 vs base':>12}" if baseline else "")
+    )
+    for result in results:
+        line = (
+            f"{result['function']:<30} {result['size']:>8} {result['calls']:>6} "
+            f"{result['p50_ms']:>9.3f} {result['p95_ms']:>9.3f} "
+            f"{result['rows_per_call']:>10.1f} {result['rows_per_s']:>10.0f}"
+        )
+        before = baseline.get((result["function"], str(result["size"]))) if baseline else None
+        if before:
+            line += f" {(result['p50_ms'] / before - 1) * 100:>+11.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--seconds", type=float, default=2, help="time spent per function and size")
+    parser.add_argument("--calls", type=int, default=200, help="most calls per function and size")
+    parser.add_argument("--data-dir", default=None, help="keep the generated databases here and reuse them")
+    parser.add_argument("--output", default=None, help="write the results as TSV")
+    parser.add_argument("--baseline", default=None, help="TSV of an earlier run to compare p50 with")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    baseline = read_baseline(args.baseline) if args.baseline else None
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        data_dir = args.data_dir or directory
+        os.makedirs(data_dir, exist_ok=True)
+        for size in args.sizes:
+            path = os.path.join(data_dir, f"orders-{size}.db")
+            customers = max(1, size // (ORDERS_PER_CUSTOMER + 1))
+            if not os.path.exists(path):
+                started = time.perf_counter()
+                generate(path, size)
+                print(f"generated {path} in {time.perf_counter() - started:.1f}s")
+            db = start_orders_db(path)
+            rng = random.Random(2)
+            for function, call in calls(db, customers, rng).items():
+                result = measure(call, args.seconds, args.calls)
+                results.append({"function": function, "size": size, **result})
+            db.close()
+
+    results.sort(key=lambda result: (result["function"], result["size"]))
+    print_results(results, baseline)
+    if args.output:
+        write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Measures add_to_cart throughput with a commit per task and with group commit,
+at several numbers of concurrent tasks. Each run uses a fresh database file in
+a temporary directory, so results depend on the fsync cost of that disk; pass
+--dir to place it on the disk the service uses.
+
+Committing per task on one shared connection races between threads, so in
+that mode each task thread writes through its own connection.
+
+    python benchmarks/bench_group_commit.py --concurrency 1 4 16 64
+"""
+
+from orders import GroupCommitDatabase, add_to_cart, start_orders_db
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import tempfile
+import sqlite3
+import argparse
+import logging
+import time
+import os
+
+
+class Ctx:
+    def __init__(self, db):
+        self.dependencies = {"orders-db": db, "orders-carts": None}
+
+    def get_dependency(self, key):
+        # As resonate's Dependencies.get, which raises KeyError for unknown keys.
+        return self.dependencies[key]
+
+
+class ThreadConnections:
+    """
+    One connection per thread, for committing per task without sharing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    def get_dependency(self, key):
+        if key != "orders-db":
+            return {"orders-carts": None}[key]
+        if not hasattr(self.local, "db"):
+            self.local.db = sqlite3.connect(self.path, timeout=60)
+        return self.local.db
+
+
+PRODUCT = {
+    "product_name": "beef_sandwich",
+    "product_display": "Beef Sandwich",
+    "product_price": 7,
+    "product_image": "beef_sandwich.png",
+}
+
+
+def run(ctx, concurrency, duration):
+    deadline = time.monotonic() + duration
+
+    def worker(n):
+        completed = 0
+        data = {"order_id": n, "product": PRODUCT}
+        while time.monotonic() < deadline:
+            add_to_cart(ctx, data)
+            completed += 1
+        return completed
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        completed = sum(pool.map(worker, range(concurrency)))
+    return completed / (time.monotonic() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--duration", type=float, default=3)
+    parser.add_argument("--window-ms", type=float, default=2)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--dir", default=None)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    print(f"{'tasks':>6} {'commit/task':>12} {'group commit':>13} {'avg batch':>10}")
+    for concurrency in args.concurrency:
+        with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+            path = os.path.join(directory, "immediate.db")
+            start_orders_db(path).close()
+            immediate = run(ThreadConnections(path), concurrency, args.duration)
+
+            db = GroupCommitDatabase(
+                start_orders_db(os.path.join(directory, "grouped.db")),
+                args.window_ms / 1000,
+                args.max_batch,
+            )
+            grouped = run(Ctx(db), concurrency, args.duration)
+            avg_batch = db.gauges()["group_commit_avg_batch"]
+        print(f"{concurrency:>6} {immediate:>10.0f}/s {grouped:>11.0f}/s {avg_batch:>10}")
+
+
+if __name__ == "__main__":
+    main()
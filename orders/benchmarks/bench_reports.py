@@ -0,0 +1,144 @@
+"""
+Compares computing reports with SQL over the orders tables against the
+snapshot reports, on a synthetic database. The SQL column is how long each
+report holds a read transaction on the live database; the snapshot column is
+computed from memory-mapped columns without touching it. Writing a snapshot
+only locks the live database while its pages are copied.
+
+    python benchmarks/bench_reports.py --orders 200000
+"""
+
+from orders import REPORT_KINDS, start_orders_db
+from orders.reporting import ReportSnapshots
+import tempfile
+import argparse
+import logging
+import random
+import sqlite3
+import time
+import os
+
+STATUSES = [
+    "payment_required",
+    "payment_complete",
+    "restaurant_confirmed",
+    "driver_confirmed",
+    "ready_for_pickup",
+    "out_for_delivery",
+    "delivered",
+]
+
+SQL_REPORTS = {
+    "summary": """
+        SELECT COUNT(*), SUM(order_total), SUM(order_delivery_fee) FROM orders
+        WHERE order_status NOT IN ('cart', 'payment_required')
+    """,
+    "revenue": """
+        SELECT date(order_date), COUNT(*), SUM(order_total), SUM(order_delivery_fee)
+        FROM orders WHERE order_status NOT IN ('cart', 'payment_required')
+        GROUP BY date(order_date)
+    """,
+    "top-products": """
+        SELECT product_name, COUNT(*), SUM(product_price) FROM order_items
+        JOIN orders ON orders.order_id = order_items.order_id
+        WHERE order_status NOT IN ('cart', 'payment_required')
+        GROUP BY product_name ORDER BY COUNT(*) DESC
+    """,
+    "status-durations": """
+        SELECT order_status, next_status, COUNT(*), AVG(next_time - event_time)
+        FROM (
+            SELECT order_status, event_time,
+                   LEAD(order_status) OVER w AS next_status,
+                   LEAD(event_time) OVER w AS next_time
+            FROM order_events
+            WINDOW w AS (PARTITION BY order_id ORDER BY event_time)
+        )
+        WHERE next_status IS NOT NULL
+        GROUP BY order_status, next_status
+    """,
+}
+
+
+def populate(path, orders, products):
+    db = start_orders_db(path)
+    now = time.time()
+    order_rows = []
+    item_rows = []
+    event_rows = []
+    for order_id in range(1, orders + 1):
+        placed = now - random.uniform(0, 90 * 86400)
+        steps = random.randint(1, len(STATUSES))
+        total = 0
+        for _ in range(random.randint(1, 4)):
+            product = random.randrange(products)
+            price = random.choice([5, 7.5, 12, 15.25])
+            total += price
+            item_rows.append(
+                (order_id, f"product_{product}", f"Product {product}", price, "")
+            )
+        # Totals are stored as a mix of INT and REAL, like the live database.
+        order_rows.append(
+            (
+                order_id,
+                STATUSES[steps - 1],
+                total + 5 if order_id % 2 else int(total + 5),
+                f"customer_{order_id % 5000}@example.com",
+                time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(placed)),
+            )
+        )
+        event_time = placed
+        for status in ["cart"] + STATUSES[:steps]:
+            event_rows.append((order_id, status, event_time))
+            event_time += random.uniform(30, 900)
+    stmt = db.cursor()
+    stmt.executemany(
+        "INSERT INTO orders (order_id, order_status, order_total, customer_email, order_date) VALUES (?, ?, ?, ?, ?)",
+        order_rows,
+    )
+    stmt.executemany(
+        "INSERT INTO order_items (order_id, product_name, product_display, product_price, product_image) VALUES (?, ?, ?, ?, ?)",
+        item_rows,
+    )
+    stmt.executemany(
+        "INSERT INTO order_events (order_id, order_status, event_time) VALUES (?, ?, ?)",
+        event_rows,
+    )
+    db.commit()
+    db.close()
+
+
+def timed(fn):
+    started = time.perf_counter()
+    fn()
+    return (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=200_000)
+    parser.add_argument("--products", type=int, default=200)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "orders.db")
+        populate(path, args.orders, args.products)
+        db = sqlite3.connect(path)
+        snapshots = ReportSnapshots(path, os.path.join(directory, "reports"))
+        write_ms = timed(snapshots.write)
+        snapshot = snapshots.current()
+
+        print(
+            f"{args.orders} orders, snapshot written in {write_ms:.0f} ms, "
+            f"live database locked for {snapshots.last_copy_duration * 1000:.0f} ms"
+        )
+        print(f"{'report':<18} {'sql ms':>8} {'snapshot ms':>12}")
+        for kind in REPORT_KINDS:
+            sql_ms = timed(lambda: db.execute(SQL_REPORTS[kind]).fetchall())
+            snapshot_ms = timed(lambda: snapshot.report(kind, {"period": "day"}))
+            print(f"{kind:<18} {sql_ms:>8.1f} {snapshot_ms:>12.1f}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,106 @@
-from resonate.task_sources.poller import Poller
 from resonate.stores.remote import RemoteStore
 from resonate.resonate import Resonate
 from .log_config import setup_logger
+from .codec import install_payload_encoder, install_wire_encoder
+from .profiling import Profiler, start_profiling
+from .backup import backup_settings, restore_command, start_backups
+from .cart_store import CartStore
+from .group_commit import GroupCommitDatabase
+from .reporting import REPORT_KINDS, ReportSnapshots
+from .zones import ZoneMap, default_zones_path
+from .node import (
+    node_gauges,
+    node_settings,
+    resize_worker_pool,
+    start_admin_server,
+    start_pollers,
+)
 from datetime import datetime
 from threading import Event
 import sqlite3
+import signal
+import atexit
+import sys
+import time
 import os
 
 logger = setup_logger(__name__)
 
-resonate = Resonate(
-    store=RemoteStore(url="http://localhost:8001"),
-    task_source=Poller(url="http://localhost:8002", group="orders-service-nodes"),
+# Orders and carts are partitioned across shards by a hash of customer_email.
+# Every shard owns its own SQLite file and poll group; the gateway routes each
+# call to the owning shard. A single shard keeps the unsharded names.
+ORDERS_SHARDS = int(os.getenv("ORDERS_SHARDS", "1"))
+ORDERS_SHARD = int(os.getenv("ORDERS_SHARD", "0"))
+# Each shard allocates order ids from its own range so ids stay globally unique.
+ORDER_ID_SHARD_SPAN = 1_000_000_000_000
+# Concurrent writes share one commit, waiting at most the window for others.
+ORDERS_GROUP_COMMIT = os.getenv("ORDERS_GROUP_COMMIT", "0") == "1"
+ORDERS_GROUP_COMMIT_WINDOW_MS = float(os.getenv("ORDERS_GROUP_COMMIT_WINDOW_MS", "2"))
+ORDERS_GROUP_COMMIT_MAX_BATCH = int(os.getenv("ORDERS_GROUP_COMMIT_MAX_BATCH", "64"))
+# Carts are served from memory and written back in batches. Only for shards
+# served by a single node, since carts held by one node are invisible to others.
+ORDERS_CART_STORE = os.getenv("ORDERS_CART_STORE", "0") == "1"
+ORDERS_CART_FLUSH_MS = float(os.getenv("ORDERS_CART_FLUSH_MS", "200"))
+ORDERS_CART_FLUSH_BATCH = int(os.getenv("ORDERS_CART_FLUSH_BATCH", "256"))
+ORDERS_CART_STORE_MAX_CARTS = int(os.getenv("ORDERS_CART_STORE_MAX_CARTS", "100000"))
+# Reports are computed from columnar snapshots of the database, never from the
+# live tables. 0 disables snapshotting on this node; it still serves reports
+# from snapshots other nodes of the shard write to the same directory.
+ORDERS_REPORT_INTERVAL_SECONDS = float(os.getenv("ORDERS_REPORT_INTERVAL_SECONDS", "300"))
+ORDERS_REPORTS_DIR = os.getenv("ORDERS_REPORTS_DIR")
+# Table mapping postcode prefixes and place names to delivery zones.
+ORDERS_ZONES_FILE = os.getenv("ORDERS_ZONES_FILE") or default_zones_path()
+# Orders a driver can pick up or is delivering; they have a delivery zone.
+DELIVERABLE_STATUSES = (
+    "restaurant_confirmed",
+    "driver_confirmed",
+    "ready_for_pickup",
+    "out_for_delivery",
+)
+# Orders whose order_workflow has started but not finished.
+UNFINISHED_STATUSES = (
+    "payment_required",
+    "payment_complete",
+    *DELIVERABLE_STATUSES,
 )
+# Ids bound per IN query, well below SQLite's host parameter limit.
+ORDERS_PER_QUERY = 500
+
+
+def shard_suffix(shard):
+    return "" if ORDERS_SHARDS == 1 else f"-{shard}"
+
+
+if not 0 <= ORDERS_SHARD < ORDERS_SHARDS:
+    raise Exception(f"ORDERS_SHARD must be between 0 and {ORDERS_SHARDS - 1}")
+
+node = node_settings("ORDERS")
+backup_config = backup_settings("ORDERS")
+store = None
+poller = None
+resonate = None
+orders_db = None
+reports = None
+backups = None
+cart_store = None
+registered_functions = []
+profiler = Profiler("orders")
+
+
+def register(func):
+    registered_functions.append(func)
+    return func
+
+
+def orders_db_path():
+    return os.path.join(
+        os.path.dirname(__file__), f"orders{shard_suffix(ORDERS_SHARD)}.db"
+    )
 
 
-def start_orders_db():
-    db_path = os.path.join(os.path.dirname(__file__), "orders.db")
+def start_orders_db(db_path=None):
+    if db_path is None:
+        db_path = orders_db_path()
     db = sqlite3.connect(db_path, check_same_thread=False)
     stmt = db.cursor()
     stmt.execute(
@@ -36,10 +120,17 @@ def start_orders_db():
             ready_for_pickup_promise_id TEXT DEFAULT NULL,
             driver_confirmation_promise_id TEXT DEFAULT NULL,
             out_for_delivery_promise_id TEXT DEFAULT NULL,
-            delivery_confirmation_promise_id TEXT DEFAULT NULL
+            delivery_confirmation_promise_id TEXT DEFAULT NULL,
+            delivery_zone TEXT DEFAULT NULL
         );
     """
     )
+    columns = [row[1] for row in stmt.execute("PRAGMA table_info(orders)").fetchall()]
+    if "delivery_zone" not in columns:
+        stmt.execute("ALTER TABLE orders ADD COLUMN delivery_zone TEXT DEFAULT NULL")
+    stmt.execute(
+        "CREATE INDEX IF NOT EXISTS orders_delivery_zone ON orders (delivery_zone, order_status)"
+    )
     stmt.execute(
         """
         CREATE TABLE IF NOT EXISTS order_items (
@@ -53,12 +144,36 @@ def start_orders_db():
         );
     """
     )
+    stmt.execute(
+        "CREATE INDEX IF NOT EXISTS order_items_order_id ON order_items (order_id)"
+    )
+    # Every status an order enters, with when, for the status duration report.
+    stmt.execute(
+        """
+        CREATE TABLE IF NOT EXISTS order_events (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            order_status TEXT NOT NULL,
+            event_time REAL NOT NULL,
+            FOREIGN KEY (order_id) REFERENCES orders(order_id)
+        );
+    """
+    )
+    stmt.execute(
+        """
+        INSERT INTO sqlite_sequence (name, seq)
+        SELECT 'orders', ? WHERE NOT EXISTS (
+            SELECT 1 FROM sqlite_sequence WHERE name = 'orders'
+        )
+        """,
+        (ORDERS_SHARD * ORDER_ID_SHARD_SPAN,),
+    )
     db.commit()
-    logger.info("order database initialized")
+    logger.info(f"order database initialized for shard {ORDERS_SHARD}")
     return db
 
 
-@resonate.register
+@register
 def add_to_cart_workflow(ctx, data):
     try:
         logger.info(f"add_to_cart_workflow started for order: {data['order_id']}")
@@ -86,14 +201,23 @@ def add_to_cart(ctx, data):
         logger.info(
             f"adding {data['product']['product_name']} to cart {data['order_id']}"
         )
+        carts = ctx.get_dependency("orders-carts")
+        if carts is not None:
+            if carts.add_item(data["customer_email"], data["order_id"], data["product"]):
+                return {
+                    "success": True,
+                    "message": "product added to cart successfully",
+                }
         db = ctx.get_dependency("orders-db")
         stmt = db.cursor()
         stmt.execute(
             """
-            INSERT INTO order_items (order_id, product_name, product_display, product_price, product_image)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT INTO order_items (item_id, order_id, product_name, product_display, product_price, product_image)
+            VALUES (?, ?, ?, ?, ?, ?)
             """,
             (
+                # Ids of items not yet written are taken by the cart store.
+                carts.next_item_id() if carts is not None else None,
                 data["order_id"],
                 data["product"]["product_name"],
                 data["product"]["product_display"],
@@ -111,7 +235,7 @@ def add_to_cart(ctx, data):
         raise Exception(f"error adding product to cart: {str(e)}")
 
 
-@resonate.register
+@register
 def remove_from_cart_workflow(ctx, data):
     try:
         logger.info(f"remove_from_cart_workflow started for order: {data['order_id']}")
@@ -131,7 +255,7 @@ def remove_from_cart_workflow(ctx, data):
         raise Exception(f"Error in Remove from Cart Workflow: {str(e)}")
 
 
-@resonate.register
+@register
 def update_cart_totals(ctx, cart):
     print(cart)
     try:
@@ -149,7 +273,34 @@ def update_cart_totals(ctx, cart):
         raise Exception(f"error updating cart totals: {str(e)}")
 
 
-@resonate.register
+def query_customer_orders(stmt, customer_email):
+    # Fetch orders for the given customer, excluding 'cart' status
+    stmt.execute(
+        "SELECT * FROM orders WHERE customer_email = ? AND order_status != 'cart' ORDER BY order_date DESC",
+        (customer_email,),
+    )
+    orders = stmt.fetchall()
+
+    # Convert orders into dictionaries dynamically
+    orders_with_items = []
+    for order in orders:
+        order_dict = dict(order)  # Convert SQLite Row object to a dictionary
+        order_id = order["order_id"]
+
+        # Fetch order items for the current order_id
+        stmt.execute("SELECT * FROM order_items WHERE order_id = ?", (order_id,))
+        items = stmt.fetchall()
+
+        # Convert items into dictionaries dynamically
+        order_dict["order_items"] = [dict(item) for item in items]
+
+        # Append to the list
+        orders_with_items.append(order_dict)
+
+    return orders_with_items
+
+
+@register
 def get_customer_orders(ctx, customer_email):
     logger.info(f"Getting order history for customer: {customer_email}")
     try:
@@ -159,33 +310,10 @@ def get_customer_orders(ctx, customer_email):
         db.row_factory = sqlite3.Row
         stmt = db.cursor()
 
-        # Fetch orders for the given customer, excluding 'cart' status
-        stmt.execute(
-            "SELECT * FROM orders WHERE customer_email = ? AND order_status != 'cart' ORDER BY order_date DESC",
-            (customer_email,),
-        )
-        orders = stmt.fetchall()
-
-        # Convert orders into dictionaries dynamically
-        orders_with_items = []
-        for order in orders:
-            order_dict = dict(order)  # Convert SQLite Row object to a dictionary
-            order_id = order["order_id"]
-
-            # Fetch order items for the current order_id
-            stmt.execute("SELECT * FROM order_items WHERE order_id = ?", (order_id,))
-            items = stmt.fetchall()
-
-            # Convert items into dictionaries dynamically
-            order_dict["order_items"] = [dict(item) for item in items]
-
-            # Append to the list
-            orders_with_items.append(order_dict)
-
         return {
             "success": True,
             "message": "Order history retrieved successfully.",
-            "orders": orders_with_items,
+            "orders": query_customer_orders(stmt, customer_email),
         }
     except Exception as e:
         error_message = f"Error retrieving order history for {customer_email}: {str(e)}"
@@ -193,7 +321,7 @@ def get_customer_orders(ctx, customer_email):
         raise Exception(error_message)
 
 
-@resonate.register
+@register
 def get_in_progress_orders(ctx):
     logger.info("getting all in-progress orders")
     try:
@@ -244,35 +372,59 @@ def get_in_progress_orders(ctx):
         raise Exception(error_message)
 
 
-@resonate.register
-def get_deliverable_orders(ctx):
-    logger.info(f"getting all deliverable orders")
+def query_order_items(stmt, order_ids):
+    """
+    Fetches the items of many orders with a few IN queries.
+    :return: Dictionary of order_id to its list of items.
+    """
+    items = {order_id: [] for order_id in order_ids}
+    for start in range(0, len(order_ids), ORDERS_PER_QUERY):
+        batch = order_ids[start : start + ORDERS_PER_QUERY]
+        placeholders = ", ".join("?" * len(batch))
+        stmt.execute(
+            f"SELECT * FROM order_items WHERE order_id IN ({placeholders})", batch
+        )
+        for item in stmt.fetchall():
+            items[item["order_id"]].append(dict(item))
+    return items
+
+
+@register
+def get_deliverable_orders(ctx, zones=None):
+    """
+    :param zones: A delivery zone or list of zones; None returns every zone.
+    """
+    if isinstance(zones, str):
+        zones = [zones]
+    logger.info(f"getting deliverable orders in zones {zones or 'all'}")
     try:
-        db = ctx.get_dependency("orders-db")  # Assuming this is your dependency getter
+        db = ctx.get_dependency("orders-db")
         db.row_factory = sqlite3.Row
         stmt = db.cursor()
-        stmt.execute(
-            """
-            SELECT * FROM orders 
-            WHERE order_status IN ('restaurant_confirmed', 'driver_confirmed', 'ready_for_pickup', 'out_for_delivery')
-            """
-        )
-        orders = stmt.fetchall()
-        orders_with_items = []
-        for order_row in orders:
-            order = dict(order_row)
+        statuses = ", ".join("?" * len(DELIVERABLE_STATUSES))
+        if zones is None:
             stmt.execute(
-                "SELECT * FROM order_items WHERE order_id = ?", (order["order_id"],)
+                f"SELECT * FROM orders WHERE order_status IN ({statuses})",
+                DELIVERABLE_STATUSES,
             )
-            items = stmt.fetchall()
-            order["items"] = [
-                dict(item) for item in items
-            ]  # Convert each item to a dictionary
-            orders_with_items.append(order)
+        else:
+            # Served by the (delivery_zone, order_status) index.
+            stmt.execute(
+                f"""
+                SELECT * FROM orders
+                WHERE delivery_zone IN ({", ".join("?" * len(zones))})
+                AND order_status IN ({statuses})
+                """,
+                [*zones, *DELIVERABLE_STATUSES],
+            )
+        orders = [dict(order) for order in stmt.fetchall()]
+        items = query_order_items(stmt, [order["order_id"] for order in orders])
+        for order in orders:
+            order["items"] = items[order["order_id"]]
 
         return {
             "success": True,
-            "orders": orders_with_items,
+            "orders": orders,
             "message": "Deliverable orders retrieved successfully",
         }
     except Exception as e:
@@ -281,60 +433,123 @@ def get_deliverable_orders(ctx):
         raise Exception(error_message)
 
 
-@resonate.register
+@register
+def get_unfinished_orders(ctx, after_order_id=0, limit=ORDERS_PER_QUERY):
+    """
+    Lists orders whose workflow has not finished, one page at a time, for the
+    gateway to re-drive after an outage.
+    :param after_order_id: Last order_id of the previous page.
+    :return: Up to limit orders with their id, customer and status.
+    """
+    logger.info(f"getting unfinished orders after order {after_order_id}")
+    try:
+        db = ctx.get_dependency("orders-db")
+        db.row_factory = sqlite3.Row
+        stmt = db.cursor()
+        statuses = ", ".join("?" * len(UNFINISHED_STATUSES))
+        stmt.execute(
+            f"""
+            SELECT order_id, customer_email, order_status FROM orders
+            WHERE order_id > ? AND order_status IN ({statuses})
+            ORDER BY order_id LIMIT ?
+            """,
+            [after_order_id, *UNFINISHED_STATUSES, min(limit, ORDERS_PER_QUERY)],
+        )
+        return {
+            "success": True,
+            "orders": [dict(order) for order in stmt.fetchall()],
+            "message": "Unfinished orders retrieved successfully",
+        }
+    except Exception as e:
+        error_message = f"error fetching unfinished orders: {str(e)}"
+        logger.error(error_message)
+        raise Exception(error_message)
+
+
+def query_cart(stmt, customer_email):
+    """
+    Fetches the open cart of a customer with its items.
+    :return: The cart dictionary, or None if the customer has no cart.
+    """
+    stmt.execute(
+        "SELECT * FROM orders WHERE customer_email = ? AND order_status = 'cart'",
+        (customer_email,),
+    )
+    cart = stmt.fetchone()
+    if not cart:
+        return None
+
+    # Fetch associated order items
+    stmt.execute("SELECT * FROM order_items WHERE order_id = ?", (cart["order_id"],))
+    items = stmt.fetchall()
+    return {
+        **dict(cart),  # Convert the cart row to a dictionary
+        "items": [dict(item) for item in items],  # Convert items to dictionaries
+    }
+
+
+def record_order_event(stmt, order_id, order_status):
+    stmt.execute(
+        "INSERT INTO order_events (order_id, order_status, event_time) VALUES (?, ?, ?)",
+        (order_id, order_status, time.time()),
+    )
+
+
+def insert_cart(stmt, customer_email):
+    date = datetime.now()
+    stmt.execute(
+        "INSERT INTO orders (order_status, customer_email, order_date) VALUES ('cart', ?, ?)",
+        (customer_email, date),
+    )
+    order_id = stmt.lastrowid
+    record_order_event(stmt, order_id, "cart")
+    return {
+        "order_id": order_id,
+        "order_status": "cart",
+        "customer_email": customer_email,
+        "order_date": date.isoformat(),
+        "items": [],  # Newly created cart has no items
+    }
+
+
+@register
 def get_or_create_cart(ctx, customer_email):
     logger.info(f"getting or creating cart for customer: {customer_email}")
     try:
+        carts = ctx.get_dependency("orders-carts")
+        if carts is not None:
+            cart, created = carts.get_or_create(customer_email)
+            return {
+                "success": True,
+                "message": "Cart created successfully."
+                if created
+                else "cart retrieved successfully",
+                "cart": cart,
+            }
+
         db = ctx.get_dependency("orders-db")
         db.row_factory = sqlite3.Row  # Ensure rows are dictionary-like
         stmt = db.cursor()
 
         # Check if a cart already exists for the customer
-        stmt.execute(
-            "SELECT * FROM orders WHERE customer_email = ? AND order_status = 'cart'",
-            (customer_email,),
-        )
-        cart = stmt.fetchone()
-
+        cart = query_cart(stmt, customer_email)
         if cart:
             logger.info(f"cart found for {customer_email}.")
-            order_id = cart["order_id"]
-
-            # Fetch associated order items
-            stmt.execute("SELECT * FROM order_items WHERE order_id = ?", (order_id,))
-            items = stmt.fetchall()
-
             return {
                 "success": True,
                 "message": "cart retrieved successfully",
-                "cart": {
-                    **dict(cart),  # Convert the cart row to a dictionary
-                    "items": [
-                        dict(item) for item in items
-                    ],  # Convert items to dictionaries
-                },
+                "cart": cart,
             }
 
         # If no cart is found, create a new cart
         logger.info(f"cart not found for {customer_email}, creating a new cart")
-        date = datetime.now()
-        stmt.execute(
-            "INSERT INTO orders (order_status, customer_email, order_date) VALUES ('cart', ?, ?)",
-            (customer_email, date),
-        )
+        cart = insert_cart(stmt, customer_email)
         db.commit()
-        new_order_id = stmt.lastrowid
 
         return {
             "success": True,
             "message": "Cart created successfully.",
-            "cart": {
-                "order_id": new_order_id,
-                "order_status": "cart",
-                "customer_email": customer_email,
-                "order_date": date.isoformat(),
-                "items": [],  # Newly created cart has no items
-            },
+            "cart": cart,
         }
     except Exception as e:
         error_message = f"error retrieving or creating cart: {str(e)}"
@@ -342,10 +557,61 @@ def get_or_create_cart(ctx, customer_email):
         raise Exception(error_message)
 
 
-@resonate.register
+@register
+def get_customer_cart_and_orders(ctx, customer_email):
+    """
+    Returns the cart (created if missing) and the order history of a customer
+    in one call.
+    """
+    logger.info(f"getting cart and order history for customer: {customer_email}")
+    try:
+        carts = ctx.get_dependency("orders-carts")
+        db = ctx.get_dependency("orders-db")
+        if carts is not None:
+            cart, _ = carts.get_or_create(customer_email)
+            db.row_factory = sqlite3.Row
+            return {
+                "success": True,
+                "message": "cart and order history retrieved successfully",
+                "cart": cart,
+                "orders": query_customer_orders(db.cursor(), customer_email),
+            }
+
+        # The connection is shared by the node's workers, so reads run without
+        # a transaction of their own and only a new cart is committed.
+        db.row_factory = sqlite3.Row
+        stmt = db.cursor()
+        cart = query_cart(stmt, customer_email)
+        if not cart:
+            logger.info(f"cart not found for {customer_email}, creating a new cart")
+            cart = insert_cart(stmt, customer_email)
+            db.commit()
+        orders = query_customer_orders(stmt, customer_email)
+
+        return {
+            "success": True,
+            "message": "cart and order history retrieved successfully",
+            "cart": cart,
+            "orders": orders,
+        }
+    except Exception as e:
+        error_message = f"error retrieving cart and orders for {customer_email}: {str(e)}"
+        logger.error(error_message)
+        raise Exception(error_message)
+
+
+@register
 def remove_from_cart(ctx, data):
     try:
         logger.info(f"removing {data['item']['item_id']} from cart {data['order_id']}")
+        carts = ctx.get_dependency("orders-carts")
+        if carts is not None and carts.remove_item(
+            data["customer_email"], data["order_id"], data["item"]["item_id"]
+        ):
+            return {
+                "success": True,
+                "message": "product removed from cart successfully",
+            }
         db = ctx.get_dependency("orders-db")
         stmt = db.cursor()
         stmt.execute(
@@ -360,10 +626,15 @@ def remove_from_cart(ctx, data):
         raise Exception(f"error removing product from cart: {str(e)}")
 
 
-@resonate.register
+@register
 def get_order_by_id(ctx, order_id):
     try:
         logger.info(f"fetching order {order_id}")
+        carts = ctx.get_dependency("orders-carts")
+        if carts is not None:
+            # order_workflow starts by reading the order, so a cart being
+            # checked out is written first.
+            carts.flush_order(order_id)
         db = ctx.get_dependency("orders-db")
         db.row_factory = sqlite3.Row
         stmt = db.cursor()
@@ -389,7 +660,41 @@ def get_order_by_id(ctx, order_id):
         raise Exception(error_message)
 
 
-@resonate.register
+def assign_zone(stmt, zones, order_id):
+    """
+    Sets the delivery zone of an order from its delivery address.
+    """
+    stmt.execute(
+        "SELECT customer_delivery_address FROM orders WHERE order_id = ?", (order_id,)
+    )
+    row = stmt.fetchone()
+    zone = zones.zone_for(row[0] if row else None)
+    stmt.execute(
+        "UPDATE orders SET delivery_zone = ? WHERE order_id = ?", (zone, order_id)
+    )
+    logger.info(f"order {order_id} assigned to delivery zone {zone}")
+
+
+def assign_missing_zones(db, zones):
+    """
+    Assigns zones to deliverable orders that reached restaurant_confirmed
+    before zones existed.
+    """
+    stmt = db.cursor()
+    statuses = ", ".join("?" * len(DELIVERABLE_STATUSES))
+    stmt.execute(
+        f"SELECT order_id FROM orders WHERE delivery_zone IS NULL AND order_status IN ({statuses})",
+        DELIVERABLE_STATUSES,
+    )
+    order_ids = [row[0] for row in stmt.fetchall()]
+    for order_id in order_ids:
+        assign_zone(stmt, zones, order_id)
+    db.commit()
+    if order_ids:
+        logger.info(f"assigned delivery zones to {len(order_ids)} orders")
+
+
+@register
 def update_order_by_id(ctx, order):
     logger.info(f"updating order with order_id {order.get('order_id')}")
 
@@ -397,6 +702,17 @@ def update_order_by_id(ctx, order):
         raise Exception("order_id is required to update an order")
 
     try:
+        carts = ctx.get_dependency("orders-carts")
+        checking_out = order.get("order_status", "cart") != "cart"
+        if carts is not None:
+            if not checking_out and carts.update(order):
+                return {
+                    "success": True,
+                    "message": f"Order with order_id {order['order_id']} updated successfully",
+                }
+            if checking_out:
+                carts.flush_order(order["order_id"])
+
         db = ctx.get_dependency("orders-db")
         stmt = db.cursor()
 
@@ -409,9 +725,25 @@ def update_order_by_id(ctx, order):
         ]
         sql_query = f"UPDATE orders SET {', '.join(fields)} WHERE order_id = ?"
 
+        # Cart totals are updated with the whole cart, status included, so an
+        # event is only recorded when the status actually changes.
+        status_changed = False
+        if "order_status" in order:
+            stmt.execute(
+                "UPDATE orders SET order_status = ? WHERE order_id = ? AND order_status IS NOT ?",
+                (order["order_status"], order["order_id"], order["order_status"]),
+            )
+            status_changed = stmt.rowcount > 0
+
         # Execute the query
         stmt.execute(sql_query, values + [order["order_id"]])
+        if status_changed:
+            record_order_event(stmt, order["order_id"], order["order_status"])
+        if order.get("order_status") == "restaurant_confirmed":
+            assign_zone(stmt, ctx.get_dependency("orders-zones"), order["order_id"])
         db.commit()
+        if carts is not None and checking_out:
+            carts.drop_order(order["order_id"])
 
         logger.info(f"order with order_id {order['order_id']} updated successfully")
         return {
@@ -424,13 +756,150 @@ def update_order_by_id(ctx, order):
         raise Exception(error_message)
 
 
-resonate.set_dependency("orders-db", start_orders_db())
+@register
+def get_report(ctx, kind, options):
+    """
+    Computes a report of this shard from the latest snapshot.
+    :param kind: One of REPORT_KINDS.
+    :param options: Report options, e.g. {"period": "hour"} for revenue.
+    :return: Rows that the gateway can sum across shards.
+    """
+    try:
+        logger.info(f"computing {kind} report")
+        if kind not in REPORT_KINDS:
+            return {"success": False, "message": f"unknown report {kind}"}
+        snapshot = ctx.get_dependency("orders-reports").current()
+        if snapshot is None:
+            return {"success": False, "message": "no report snapshot has been written yet"}
+        return {
+            "success": True,
+            "message": f"{kind} report computed successfully",
+            "report": {
+                "kind": kind,
+                "snapshot_at": snapshot.snapshot_at,
+                "rows": snapshot.report(kind, options),
+            },
+        }
+    except Exception as e:
+        error_message = f"error computing {kind} report: {str(e)}"
+        logger.error(error_message)
+        raise Exception(error_message)
+
+
+def start_reports():
+    directory = ORDERS_REPORTS_DIR or os.path.join(
+        os.path.dirname(__file__), f"reports{shard_suffix(ORDERS_SHARD)}"
+    )
+    snapshots = ReportSnapshots(orders_db_path(), directory)
+    if ORDERS_REPORT_INTERVAL_SECONDS > 0:
+        snapshots.start(ORDERS_REPORT_INTERVAL_SECONDS)
+    return snapshots
+
+
+def start_cart_store(db):
+    """
+    :return: The node's CartStore, flushing in the background, or None when
+        ORDERS_CART_STORE is off.
+    """
+    if not ORDERS_CART_STORE:
+        return None
+    carts = CartStore(
+        db,
+        query_cart,
+        insert_cart,
+        ORDERS_CART_FLUSH_MS / 1000,
+        ORDERS_CART_FLUSH_BATCH,
+        ORDERS_CART_STORE_MAX_CARTS,
+    )
+    carts.start()
+    return carts
+
+
+def startup():
+    """
+    Opens the database and connects the node to the Resonate server. Importing
+    the module has no side effects; main() calls this before serving.
+    :return: The Resonate instance.
+    """
+    global store, poller, resonate, orders_db, reports, backups, cart_store
+    orders_db = start_orders_db()
+    # Backups step on the connection itself, below any group commit.
+    backups = start_backups(
+        orders_db, f"orders{shard_suffix(ORDERS_SHARD)}", backup_config
+    )
+    zones = ZoneMap.load(ORDERS_ZONES_FILE)
+    assign_missing_zones(orders_db, zones)
+    if ORDERS_GROUP_COMMIT:
+        orders_db = GroupCommitDatabase(
+            orders_db, ORDERS_GROUP_COMMIT_WINDOW_MS / 1000, ORDERS_GROUP_COMMIT_MAX_BATCH
+        )
+    cart_store = start_cart_store(orders_db)
+    store = RemoteStore(url="http://localhost:8001")
+    install_wire_encoder(store)
+    # The gateway sends the reads behind its views to the interactive group,
+    # whose tasks run ahead of order steps.
+    interactive_group = None
+    if node["interactive"]:
+        interactive_group = f"orders-service-interactive-nodes{shard_suffix(ORDERS_SHARD)}"
+    poller = start_pollers(
+        "http://localhost:8002",
+        f"orders-service-nodes{shard_suffix(ORDERS_SHARD)}",
+        interactive_group,
+        node,
+        store,
+    )
+    resonate = Resonate(store=store, task_source=poller)
+    install_payload_encoder(resonate)
+    resize_worker_pool(resonate, node["workers"])
+    if interactive_group is not None:
+        poller.prioritize(resonate, node["interactive_workers"])
+    for func in registered_functions:
+        profiler.register(resonate, func)
+    resonate.set_dependency("orders-db", orders_db)
+    resonate.set_dependency("orders-zones", zones)
+    # Registered even when disabled, since functions look it up by name.
+    resonate.set_dependency("orders-carts", cart_store)
+    reports = start_reports()
+    resonate.set_dependency("orders-reports", reports)
+    start_profiling(profiler)
+    return resonate
+
+
+def gauges():
+    result = node_gauges(resonate, poller)
+    if isinstance(orders_db, GroupCommitDatabase):
+        result.update(orders_db.gauges())
+    if reports is not None:
+        result.update(reports.gauges())
+    if cart_store is not None:
+        result.update(cart_store.gauges())
+    return result
 
 
 def main():
+    startup()
+    if cart_store is not None:
+        # Carts not yet written are flushed when the node is stopped.
+        atexit.register(cart_store.close)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     logger.info("orders service application node running")
+    if node["admin_port"]:
+        start_admin_server(
+            node["admin_port"],
+            {"/gauges": gauges, **profiler.admin_routes(), **backups.admin_routes()},
+            {**profiler.admin_actions(), **backups.admin_actions()},
+        )
     Event().wait()
 
 
+def restore():
+    """
+    Restores this shard's database from a backup; the node must be stopped.
+    """
+    restore_command(
+        f"orders{shard_suffix(ORDERS_SHARD)}", orders_db_path(), backup_config
+    )
+
+
 if __name__ == "__main__":
     main()
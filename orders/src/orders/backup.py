@@ -0,0 +1,291 @@
+from .log_config import setup_logger
+from datetime import datetime, timezone
+from threading import Lock, Thread
+import argparse
+import sqlite3
+import glob
+import time
+import sys
+import os
+
+logger = setup_logger(__name__)
+
+# The copy is synced to disk every this many steps, so that no single sync
+# holds up the node's own commits for long.
+SYNC_STEPS = 16
+
+
+def backup_settings(prefix):
+    """
+    Reads the backup settings of a service from the environment.
+    :param prefix: Environment variable prefix of the service, e.g. "ORDERS".
+    :return: Dictionary of settings.
+    """
+    return {
+        # seconds between background backups; 0 only backs up on request
+        "interval": float(os.getenv(f"{prefix}_BACKUP_INTERVAL_SECONDS", "0")),
+        "directory": os.getenv(f"{prefix}_BACKUP_DIR", "backups"),
+        # backups kept per database, newest first
+        "keep": int(os.getenv(f"{prefix}_BACKUP_KEEP", "7")),
+        # pages copied per step, and the pause after each step in which the
+        # node's writers run
+        "pages": int(os.getenv(f"{prefix}_BACKUP_PAGES", "64")),
+        "pause": float(os.getenv(f"{prefix}_BACKUP_PAUSE_MS", "20")) / 1000,
+    }
+
+
+class OnlineBackup:
+    """
+    Copies a live SQLite database to timestamped files with the online backup
+    API, a few pages per step. The copy runs on the node's own connection:
+    SQLite applies the node's writes to a backup in progress, whereas a write
+    through any other connection would restart it. Between steps the node's
+    tasks have the connection to themselves.
+    """
+
+    def __init__(self, db, name, settings):
+        """
+        :param db: The node's sqlite3 connection to the database.
+        :param name: Prefix of the backup file names.
+        """
+        self.db = db
+        self.name = name
+        self.directory = settings["directory"]
+        self.keep = settings["keep"]
+        self.pages = settings["pages"]
+        self.pause = settings["pause"]
+        self.running = False
+        self.last = None
+        self.backups = 0
+        self.failures = 0
+        self._lock = Lock()
+
+    def backup(self):
+        """
+        Writes a new backup, checks it and removes the oldest beyond keep.
+        :return: Statistics of the backup.
+        """
+        with self._lock:
+            if self.running:
+                raise Exception(f"a backup of {self.name} is already running")
+            self.running = True
+        try:
+            stats = self._backup()
+            self.backups += 1
+            self.last = stats
+            logger.info(
+                f"backed up {self.name} to {stats['path']} in {stats['seconds']}s, "
+                f"{stats['steps']} steps, longest {stats['max_step_ms']}ms"
+            )
+            self.rotate()
+            return stats
+        except Exception as e:
+            self.failures += 1
+            self.last = {"error": str(e), "finished_at": time.time()}
+            logger.error(f"backup of {self.name} failed: {e}")
+            raise Exception(f"backup of {self.name} failed: {e}")
+        finally:
+            self.running = False
+
+    def _backup(self):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        path = os.path.join(self.directory, f"{self.name}-{stamp}.db")
+        partial = f"{path}.partial"
+        stats = {"path": path, "steps": 0, "busy_steps": 0, "max_step_ms": 0.0}
+        started = time.perf_counter()
+        target = sqlite3.connect(partial)
+        # Syncing is left to the steps' pauses rather than to the last step,
+        # which runs while holding the node's connection.
+        target.execute("PRAGMA journal_mode = OFF")
+        target.execute("PRAGMA synchronous = OFF")
+        fd = os.open(partial, os.O_RDONLY | os.O_CREAT, 0o644)
+        try:
+            step_started = [time.perf_counter()]
+
+            def progress(status, remaining, total):
+                step = (time.perf_counter() - step_started[0]) * 1000
+                stats["steps"] += 1
+                stats["max_step_ms"] = max(stats["max_step_ms"], round(step, 2))
+                stats["pages"] = total
+                # A step waits while a task's transaction is open.
+                if status in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED):
+                    stats["busy_steps"] += 1
+                else:
+                    if stats["steps"] % SYNC_STEPS == 0:
+                        os.fsync(fd)
+                    time.sleep(self.pause)
+                step_started[0] = time.perf_counter()
+
+            self.db.backup(target, pages=self.pages, progress=progress, sleep=self.pause)
+            result = target.execute("PRAGMA quick_check").fetchone()[0]
+            if result != "ok":
+                raise Exception(f"backup failed its check: {result}")
+            target.close()
+            os.fsync(fd)
+        except Exception:
+            target.close()
+            os.remove(partial)
+            raise
+        finally:
+            os.close(fd)
+        os.replace(partial, path)
+        stats["seconds"] = round(time.perf_counter() - started, 3)
+        stats["bytes"] = os.path.getsize(path)
+        stats["finished_at"] = time.time()
+        return stats
+
+    def list(self):
+        """
+        :return: Paths of this database's backups, newest first.
+        """
+        return list_backups(self.directory, self.name)
+
+    def rotate(self):
+        for path in self.list()[self.keep :]:
+            os.remove(path)
+            logger.info(f"removed old backup {path}")
+
+    def start(self, interval):
+        """
+        Backs up every interval seconds on a background thread.
+        """
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.backup()
+                except Exception:
+                    pass
+
+        Thread(target=run, daemon=True).start()
+        logger.info(f"backing up {self.name} every {interval}s to {self.directory}")
+
+    def backup_in_background(self):
+        """
+        Starts a backup on a background thread unless one is running.
+        :return: The backup state.
+        """
+        if not self.running:
+            Thread(target=self._backup_quietly, daemon=True).start()
+        return self.state()
+
+    def _backup_quietly(self):
+        try:
+            self.backup()
+        except Exception:
+            pass
+
+    def state(self):
+        return {
+            "running": self.running,
+            "directory": self.directory,
+            "backups": self.backups,
+            "failures": self.failures,
+            "last": self.last,
+            "kept": self.list(),
+        }
+
+    def admin_routes(self):
+        """
+        :return: Routes for start_admin_server.
+        """
+        return {"/backup": self.state}
+
+    def admin_actions(self):
+        """
+        :return: Actions for start_admin_server.
+        """
+        return {"/backup/start": self.backup_in_background}
+
+
+def list_backups(directory, name):
+    """
+    :return: Paths of the backups of a database, newest first.
+    """
+    pattern = os.path.join(glob.escape(directory), f"{name}-*.db")
+    return sorted(glob.glob(pattern), reverse=True)
+
+
+def check_database(path):
+    """
+    :raise Exception: If the database at path fails SQLite's integrity check.
+    """
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        problems = [row[0] for row in db.execute("PRAGMA integrity_check")]
+        if problems != ["ok"]:
+            problems = "; ".join(problems[:10])
+            raise Exception(f"{path} failed its integrity check: {problems}")
+    finally:
+        db.close()
+
+
+def restore_backup(backup_path, db_path):
+    """
+    Replaces the database with a backup once the backup passes an integrity
+    check. The node using the database must be stopped first.
+    """
+    # SQLite would apply a leftover journal to the restored file.
+    for suffix in ("-journal", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            raise Exception(f"{db_path}{suffix} exists; stop the node before restoring")
+    check_database(backup_path)
+    partial = f"{db_path}.restore"
+    source = sqlite3.connect(f"file:{backup_path}?mode=ro", uri=True)
+    target = sqlite3.connect(partial)
+    try:
+        source.backup(target)
+        target.close()
+        check_database(partial)
+    except Exception:
+        target.close()
+        os.remove(partial)
+        raise
+    finally:
+        source.close()
+    os.replace(partial, db_path)
+    logger.info(f"restored {db_path} from {backup_path}")
+
+
+def restore_command(name, db_path, settings):
+    """
+    Command line entry point restoring a service database from a backup.
+    """
+    parser = argparse.ArgumentParser(
+        description=f"Restore {name} from a backup. Stop the node first."
+    )
+    parser.add_argument("backup", nargs="?", help="backup file, the newest by default")
+    parser.add_argument("--list", action="store_true", help="list backups and exit")
+    parser.add_argument("--check", action="store_true", help="only check the backup")
+    args = parser.parse_args()
+
+    backups = list_backups(settings["directory"], name)
+    if args.list:
+        for path in backups:
+            print(path)
+        return
+    backup_path = args.backup or (backups[0] if backups else None)
+    if backup_path is None:
+        sys.exit(f"no backups of {name} in {settings['directory']}")
+    try:
+        if args.check:
+            check_database(backup_path)
+            print(f"{backup_path} passed its integrity check")
+        else:
+            restore_backup(backup_path, db_path)
+            print(f"restored {db_path} from {backup_path}")
+    except Exception as e:
+        sys.exit(str(e))
+
+
+def start_backups(db, name, settings):
+    """
+    :return: The node's OnlineBackup, already backing up on an interval if
+        settings has one.
+    """
+    backups = OnlineBackup(db, name, settings)
+    if settings["interval"] > 0:
+        backups.start(settings["interval"])
+    return backups
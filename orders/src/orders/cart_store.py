@@ -0,0 +1,349 @@
+from .log_config import setup_logger
+from collections import OrderedDict
+from threading import Event, Lock, Thread
+import sqlite3
+import time
+
+logger = setup_logger(__name__)
+
+# Keys of a cart that are not columns of the orders table.
+CART_ONLY_KEYS = ("order_id", "items", "cart_item_count")
+# Columns set when a cart is created, which flushes leave as they are.
+FIXED_COLUMNS = ("customer_email", "order_date")
+
+
+class CartStore:
+    """
+    Keeps open carts in memory, by customer, and writes the changed ones back
+    to the orders database in batches on a background thread. While a cart is
+    held its copy in memory is the current one, so every cart read and write
+    of the node goes through the store, and a cart is flushed before checkout
+    reads it from the database.
+    """
+
+    def __init__(self, db, load_cart, create_cart, flush_interval, flush_batch, max_carts):
+        """
+        :param db: The node's orders connection.
+        :param load_cart: Reads a customer's cart with a cursor, None if there
+            is none.
+        :param create_cart: Inserts a new cart for a customer with a cursor and
+            returns it.
+        :param flush_interval: Seconds between background flushes.
+        :param flush_batch: Carts written per transaction.
+        :param max_carts: Carts held before the least recently used clean ones
+            are dropped.
+        """
+        self._db = db
+        self._load_cart = load_cart
+        self._create_cart = create_cart
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.max_carts = max_carts
+        self._lock = Lock()
+        # Loads and creations are serialized so a customer never gets two carts.
+        self._load_lock = Lock()
+        # Flushes are serialized so an older copy of a cart never overwrites a
+        # newer one.
+        self._flush_lock = Lock()
+        self._stop = Event()
+        self._thread = None
+        # customer_email -> cart, least recently used first
+        self._carts = OrderedDict()
+        self._emails = {}
+        # customer_email -> change number of the cart's latest unwritten change
+        self._dirty = {}
+        self._changes = 0
+        self._next_item_id = self._last_item_id() + 1
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.carts_written = 0
+        self.flush_failures = 0
+
+    def _last_item_id(self):
+        stmt = self._db.cursor()
+        stmt.execute(
+            """
+            SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'order_items'), 0),
+                       COALESCE((SELECT MAX(item_id) FROM order_items), 0))
+            """
+        )
+        return stmt.fetchone()[0]
+
+    def next_item_id(self):
+        """
+        Item ids are allocated here rather than by SQLite, since items exist
+        in memory before they are written.
+        """
+        with self._lock:
+            item_id = self._next_item_id
+            self._next_item_id += 1
+            return item_id
+
+    def get_or_create(self, customer_email):
+        """
+        :return: A copy of the customer's cart, and whether it was created.
+        """
+        with self._lock:
+            cart = self._held(customer_email)
+            if cart is not None:
+                self.hits += 1
+                return copy_cart(cart), False
+        with self._load_lock:
+            cart = self._load(customer_email)
+            created = cart is None
+            if created:
+                self._db.row_factory = sqlite3.Row
+                stmt = self._db.cursor()
+                self._create_cart(stmt, customer_email)
+                self._db.commit()
+                # Read back with the columns' defaults, as a loaded cart has.
+                cart = self._load_cart(stmt, customer_email)
+            with self._lock:
+                self._hold(customer_email, cart)
+                return copy_cart(cart), created
+
+    def _held(self, customer_email):
+        cart = self._carts.get(customer_email)
+        if cart is not None:
+            self._carts.move_to_end(customer_email)
+        return cart
+
+    def _load(self, customer_email):
+        """
+        Returns the customer's held cart, reading it from the database on a
+        miss. Must be called with the load lock.
+        """
+        with self._lock:
+            cart = self._held(customer_email)
+            if cart is not None:
+                return cart
+            self.misses += 1
+        self._db.row_factory = sqlite3.Row
+        cart = self._load_cart(self._db.cursor(), customer_email)
+        if cart is not None:
+            with self._lock:
+                self._hold(customer_email, cart)
+        return cart
+
+    def _hold(self, customer_email, cart):
+        previous = self._carts.get(customer_email)
+        if previous is not None:
+            self._emails.pop(previous["order_id"], None)
+        self._carts[customer_email] = cart
+        self._emails[cart["order_id"]] = customer_email
+        # Dirty carts are kept until written, so the limit may be exceeded.
+        if len(self._carts) > self.max_carts:
+            for email in list(self._carts):
+                if len(self._carts) <= self.max_carts:
+                    break
+                if email not in self._dirty:
+                    self._forget(email)
+
+    def _forget(self, customer_email):
+        cart = self._carts.pop(customer_email)
+        self._emails.pop(cart["order_id"], None)
+        self._dirty.pop(customer_email, None)
+
+    def _changed(self, customer_email):
+        self._changes += 1
+        self._dirty[customer_email] = self._changes
+
+    def _cart_for_order(self, customer_email, order_id):
+        """
+        :return: The held cart of the customer if it is order_id, loading it
+            first if needed; None otherwise.
+        """
+        with self._lock:
+            cart = self._held(customer_email)
+        if cart is None:
+            with self._load_lock:
+                cart = self._load(customer_email)
+        if cart is None or cart["order_id"] != order_id:
+            return None
+        return cart
+
+    def add_item(self, customer_email, order_id, product):
+        """
+        :return: False if order_id is not the customer's open cart.
+        """
+        cart = self._cart_for_order(customer_email, order_id)
+        if cart is None:
+            return False
+        item = {
+            "item_id": self.next_item_id(),
+            "order_id": order_id,
+            "product_name": product["product_name"],
+            "product_display": product["product_display"],
+            "product_price": product["product_price"],
+            "product_image": product["product_image"],
+        }
+        with self._lock:
+            # The cart may have been checked out since it was looked up.
+            if self._carts.get(customer_email) is not cart:
+                return False
+            cart["items"].append(item)
+            self._changed(customer_email)
+        return True
+
+    def remove_item(self, customer_email, order_id, item_id):
+        """
+        :return: False if order_id is not the customer's open cart.
+        """
+        cart = self._cart_for_order(customer_email, order_id)
+        if cart is None:
+            return False
+        with self._lock:
+            if self._carts.get(customer_email) is not cart:
+                return False
+            cart["items"] = [item for item in cart["items"] if item["item_id"] != item_id]
+            self._changed(customer_email)
+        return True
+
+    def update(self, order):
+        """
+        Applies an update of a held cart's columns.
+        :return: False if the order is not a held cart.
+        """
+        with self._lock:
+            customer_email = self._emails.get(order["order_id"])
+            if customer_email is None:
+                return False
+            cart = self._carts[customer_email]
+            for key, value in order.items():
+                if key not in CART_ONLY_KEYS:
+                    cart[key] = value
+            self._changed(customer_email)
+            return True
+
+    def flush_order(self, order_id):
+        """
+        Writes the cart order_id now if it is held and has unwritten changes.
+        """
+        with self._lock:
+            customer_email = self._emails.get(order_id)
+        if customer_email is not None:
+            self._flush([customer_email])
+
+    def drop_order(self, order_id):
+        """
+        Stops holding the cart order_id, once it is no longer a cart. Changes
+        made since it was last flushed are discarded.
+        """
+        with self._lock:
+            customer_email = self._emails.get(order_id)
+            if customer_email is not None:
+                self._forget(customer_email)
+
+    def flush(self):
+        """
+        Writes every cart with unwritten changes, flush_batch carts per
+        transaction.
+        """
+        while True:
+            with self._lock:
+                emails = list(self._dirty)[: self.flush_batch]
+            if not emails:
+                return
+            self._flush(emails)
+
+    def _flush(self, emails):
+        with self._flush_lock:
+            with self._lock:
+                carts = [
+                    (email, self._dirty[email], copy_cart(self._carts[email]))
+                    for email in emails
+                    if email in self._dirty
+                ]
+            if not carts:
+                return
+            try:
+                self._write([cart for _, _, cart in carts])
+            except Exception as e:
+                self.flush_failures += 1
+                raise Exception(f"error writing {len(carts)} carts: {str(e)}")
+            with self._lock:
+                for email, change, _ in carts:
+                    # A cart changed while it was written stays dirty.
+                    if self._dirty.get(email) == change:
+                        del self._dirty[email]
+                self.flushes += 1
+                self.carts_written += len(carts)
+
+    def _write(self, carts):
+        stmt = self._db.cursor()
+        try:
+            for cart in carts:
+                row = {
+                    key: value
+                    for key, value in cart.items()
+                    if key not in CART_ONLY_KEYS and key not in FIXED_COLUMNS
+                }
+                fields = ", ".join(f"{key} = ?" for key in row)
+                # A cart checked out on another path is not overwritten.
+                stmt.execute(
+                    f"UPDATE orders SET {fields} WHERE order_id = ? AND order_status = 'cart'",
+                    [*row.values(), cart["order_id"]],
+                )
+                if stmt.rowcount == 0:
+                    logger.warning(
+                        f"cart {cart['order_id']} is no longer a cart, dropping its unwritten changes"
+                    )
+                    continue
+                stmt.execute(
+                    "DELETE FROM order_items WHERE order_id = ?", (cart["order_id"],)
+                )
+                stmt.executemany(
+                    """
+                    INSERT INTO order_items (item_id, order_id, product_name, product_display, product_price, product_image)
+                    VALUES (:item_id, :order_id, :product_name, :product_display, :product_price, :product_image)
+                    """,
+                    cart["items"],
+                )
+            self._db.commit()
+        except Exception:
+            self._db.rollback()
+            raise
+
+    def start(self):
+        """
+        Flushes every flush_interval seconds on a background thread.
+        """
+
+        def run():
+            while not self._stop.wait(self.flush_interval):
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error(f"cart flush failed, retrying: {e}")
+
+        self._thread = Thread(target=run, daemon=True)
+        self._thread.start()
+        logger.info(f"holding carts in memory, flushing every {self.flush_interval}s")
+
+    def close(self):
+        """
+        Stops the background thread and writes what is left.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        started = time.perf_counter()
+        self.flush()
+        logger.info(f"flushed carts on shutdown in {time.perf_counter() - started:.3f}s")
+
+    def gauges(self):
+        with self._lock:
+            return {
+                "cart_store_carts": len(self._carts),
+                "cart_store_dirty": len(self._dirty),
+                "cart_store_hits": self.hits,
+                "cart_store_misses": self.misses,
+                "cart_store_flushes": self.flushes,
+                "cart_store_carts_written": self.carts_written,
+                "cart_store_flush_failures": self.flush_failures,
+            }
+
+
+def copy_cart(cart):
+    return {**cart, "items": [dict(item) for item in cart["items"]]}
@@ -0,0 +1,204 @@
+from .log_config import setup_logger
+from threading import Condition, RLock, Thread, local
+import time
+
+logger = setup_logger(__name__)
+
+
+class LockedCursor:
+    """
+    Cursor whose calls hold the connection lock, so statements from different
+    threads never interleave with each other or with a batch commit. Statements
+    that change rows are reported to the database, which tracks each task's
+    writes until they are committed.
+    """
+
+    def __init__(self, cursor, database):
+        self._cursor = cursor
+        self._database = database
+        self._lock = database._lock
+
+    def execute(self, *args):
+        with self._lock:
+            changes = self._database._db.total_changes
+            self._cursor.execute(*args)
+            if self._database._db.total_changes != changes:
+                self._database._wrote()
+        return self
+
+    def executemany(self, *args):
+        with self._lock:
+            changes = self._database._db.total_changes
+            self._cursor.executemany(*args)
+            if self._database._db.total_changes != changes:
+                self._database._wrote()
+        return self
+
+    def fetchone(self):
+        with self._lock:
+            return self._cursor.fetchone()
+
+    def fetchall(self):
+        with self._lock:
+            return self._cursor.fetchall()
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+
+class GroupCommitDatabase:
+    """
+    Wraps the orders connection so that concurrent writers share commits.
+
+    commit() joins the open batch and blocks until a background thread has
+    committed it. A batch is committed window_seconds after its first writer
+    arrives, or as soon as max_batch writers are waiting, so each task still
+    returns only after its writes are durable but a burst of tasks pays for
+    one fsync instead of one each.
+
+    Every task writes into the same transaction, so a rollback discards the
+    uncommitted writes of all of them. commit() raises for a task whose writes
+    were discarded that way, so no task reports writes that were lost.
+    """
+
+    def __init__(self, db, window_seconds, max_batch):
+        self._db = db
+        self._window_seconds = window_seconds
+        self._max_batch = max_batch
+        self._lock = RLock()
+        self._cond = Condition()
+        self._open_batch = 0
+        self._committed_batch = -1
+        self._waiting = 0
+        self._errors = {}
+        # Guarded by _lock: durable commits so far, rollbacks so far, and the
+        # latest rollback made after each number of durable commits.
+        self._durable = 0
+        self._rollbacks = 0
+        self._rollback_after = {}
+        # Per task thread: (durable, rollbacks) at its first uncommitted write.
+        self._local = local()
+        self.batches = 0
+        self.commits = 0
+        self.rollbacks = 0
+        Thread(target=self._run, daemon=True).start()
+
+    def cursor(self):
+        return LockedCursor(self._db.cursor(), self)
+
+    def _wrote(self):
+        # Called with _lock. Writes made before the latest durable commit are
+        # safe, so the mark moves to the first write after it.
+        mark = getattr(self._local, "mark", None)
+        if mark is None or mark[0] != self._durable:
+            self._local.mark = (self._durable, self._rollbacks)
+
+    def _rolled_back(self, mark):
+        """
+        :return: Whether a rollback discarded writes made since mark, which is
+            the case if one happened before the next durable commit.
+        """
+        if mark is None:
+            return False
+        with self._lock:
+            return self._rollback_after.get(mark[0], -1) >= mark[1]
+
+    @property
+    def row_factory(self):
+        return self._db.row_factory
+
+    @row_factory.setter
+    def row_factory(self, row_factory):
+        self._db.row_factory = row_factory
+
+    @property
+    def in_transaction(self):
+        return self._db.in_transaction
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+    def rollback(self):
+        with self._lock:
+            self._db.rollback()
+            self._rollback_after[self._durable] = self._rollbacks
+            self._rollbacks += 1
+            self.rollbacks += 1
+            while len(self._rollback_after) > 1024:
+                del self._rollback_after[min(self._rollback_after)]
+            self._local.mark = None
+
+    def commit(self):
+        mark = getattr(self._local, "mark", None)
+        self._local.mark = None
+        with self._cond:
+            batch = self._open_batch
+            self._waiting += 1
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: self._committed_batch >= batch)
+            error = self._errors.get(batch)
+            if error is not None:
+                error[1] -= 1
+                if error[1] == 0:
+                    del self._errors[batch]
+                raise Exception(f"group commit failed: {error[0]}")
+        if self._rolled_back(mark):
+            raise Exception("group commit failed: writes rolled back by another task")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._waiting > 0)
+                deadline = time.monotonic() + self._window_seconds
+                while self._waiting < self._max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._open_batch
+                size = self._waiting
+                self._open_batch += 1
+                self._waiting = 0
+
+            try:
+                with self._lock:
+                    self._db.commit()
+                    self._durable += 1
+                error = None
+            except Exception as e:
+                logger.error(f"error committing batch of {size} writes: {e}")
+                error = e
+
+            with self._cond:
+                if error is not None:
+                    self._errors[batch] = [error, size]
+                self._committed_batch = batch
+                self.batches += 1
+                self.commits += size
+                self._cond.notify_all()
+
+    def gauges(self):
+        return {
+            "group_commit_batches": self.batches,
+            "group_commit_writes": self.commits,
+            "group_commit_avg_batch": round(self.commits / self.batches, 2)
+            if self.batches
+            else 0,
+            "group_commit_rollbacks": self.rollbacks,
+        }
@@ -0,0 +1,350 @@
+from .log_config import setup_logger
+from datetime import datetime, timezone
+from threading import Lock, Thread
+import sqlite3
+import shutil
+import json
+import time
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = setup_logger(__name__)
+
+# Orders still being built or waiting for payment do not count as sales.
+UNPAID_STATUSES = ("cart", "payment_required")
+PERIOD_SECONDS = {"day": 86400, "hour": 3600}
+REPORT_KINDS = ("summary", "revenue", "top-products", "status-durations")
+
+# Each snapshot is a directory of .npy columns plus meta.json; CURRENT names
+# the latest complete one.
+COLUMNS = {
+    "orders": """
+        SELECT order_id,
+               CAST(COALESCE(strftime('%s', order_date), 0) AS INTEGER),
+               order_status,
+               CAST(COALESCE(order_total, 0) AS REAL),
+               CAST(COALESCE(order_delivery_fee, 0) AS REAL)
+        FROM orders WHERE order_status != 'cart'
+    """,
+    "items": """
+        SELECT order_items.order_id, product_name, product_display,
+               CAST(product_price AS REAL)
+        FROM order_items JOIN orders ON orders.order_id = order_items.order_id
+        WHERE orders.order_status != 'cart'
+    """,
+    "events": "SELECT order_id, order_status, event_time FROM order_events",
+}
+
+
+def copy_database(db_path, copy_path):
+    """
+    Copies the database page by page with the SQLite backup API. The live
+    database is only read-locked while pages are copied, which is much
+    shorter than reading and decoding its rows.
+    """
+    source = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    copy = sqlite3.connect(copy_path)
+    try:
+        copy.execute("PRAGMA journal_mode = OFF")
+        copy.execute("PRAGMA synchronous = OFF")
+        source.backup(copy)
+    finally:
+        copy.close()
+        source.close()
+
+
+def read_tables(db_path):
+    """
+    Reads the rows reports need from a copy of the database.
+    """
+    db = sqlite3.connect(db_path)
+    try:
+        stmt = db.cursor()
+        tables = {}
+        for name, query in COLUMNS.items():
+            stmt.execute(query)
+            tables[name] = stmt.fetchall()
+        return tables
+    finally:
+        db.close()
+
+
+def encode(values, labels=None):
+    """
+    Replaces strings with indexes into a sorted label list.
+    :return: (labels, int32 codes)
+    """
+    if labels is None:
+        labels = sorted(set(values))
+    index = {label: code for code, label in enumerate(labels)}
+    return labels, np.fromiter((index[v] for v in values), np.int32, len(values))
+
+
+def build_columns(tables):
+    """
+    Converts the rows read from SQLite into typed column arrays.
+    :return: (columns, meta)
+    """
+    orders = tables["orders"]
+    items = tables["items"]
+    events = tables["events"]
+    statuses = sorted({row[2] for row in orders} | {row[1] for row in events})
+    products = {row[1]: row[2] for row in items}
+    product_names = sorted(products)
+
+    columns = {
+        "orders_id": np.fromiter((row[0] for row in orders), np.int64, len(orders)),
+        "orders_time": np.fromiter((row[1] for row in orders), np.int64, len(orders)),
+        "orders_status": encode([row[2] for row in orders], statuses)[1],
+        "orders_total": np.fromiter((row[3] for row in orders), np.float64, len(orders)),
+        "orders_fee": np.fromiter((row[4] for row in orders), np.float64, len(orders)),
+        "items_order": np.fromiter((row[0] for row in items), np.int64, len(items)),
+        "items_product": encode([row[1] for row in items], product_names)[1],
+        "items_price": np.fromiter((row[3] for row in items), np.float64, len(items)),
+        "events_order": np.fromiter((row[0] for row in events), np.int64, len(events)),
+        "events_status": encode([row[1] for row in events], statuses)[1],
+        "events_time": np.fromiter((row[2] for row in events), np.float64, len(events)),
+    }
+    meta = {
+        "snapshot_at": time.time(),
+        "statuses": statuses,
+        "products": [[name, products[name]] for name in product_names],
+    }
+    return columns, meta
+
+
+class Snapshot:
+    """
+    Columns of one snapshot, memory-mapped read-only.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.snapshot_at = meta["snapshot_at"]
+        self.statuses = meta["statuses"]
+        self.products = meta["products"]
+        self.columns = {
+            name[: -len(".npy")]: np.load(os.path.join(path, name), mmap_mode="r")
+            for name in os.listdir(path)
+            if name.endswith(".npy")
+        }
+
+    def paid_orders(self):
+        unpaid = [self.statuses.index(s) for s in UNPAID_STATUSES if s in self.statuses]
+        return ~np.isin(self.columns["orders_status"], unpaid)
+
+    def summary(self):
+        paid = self.paid_orders()
+        items = np.isin(self.columns["items_order"], self.columns["orders_id"][paid])
+        return [
+            {
+                "orders": int(paid.sum()),
+                "revenue": float(self.columns["orders_total"][paid].sum()),
+                "delivery_fees": float(self.columns["orders_fee"][paid].sum()),
+                "items": int(items.sum()),
+                "items_revenue": float(self.columns["items_price"][items].sum()),
+            }
+        ]
+
+    def revenue(self, period="day"):
+        seconds = PERIOD_SECONDS[period]
+        paid = self.paid_orders()
+        buckets = self.columns["orders_time"][paid] // seconds
+        keys, inverse = np.unique(buckets, return_inverse=True)
+        orders = np.bincount(inverse, minlength=len(keys))
+        revenue = np.bincount(
+            inverse, self.columns["orders_total"][paid], minlength=len(keys)
+        )
+        fees = np.bincount(inverse, self.columns["orders_fee"][paid], minlength=len(keys))
+        label = "%Y-%m-%d" if period == "day" else "%Y-%m-%d %H:00"
+        return [
+            {
+                "period": datetime.fromtimestamp(int(key) * seconds, timezone.utc).strftime(
+                    label
+                ),
+                "orders": int(orders[i]),
+                "revenue": float(revenue[i]),
+                "delivery_fees": float(fees[i]),
+            }
+            for i, key in enumerate(keys)
+        ]
+
+    def top_products(self):
+        paid_ids = self.columns["orders_id"][self.paid_orders()]
+        items = np.isin(self.columns["items_order"], paid_ids)
+        products = self.columns["items_product"][items]
+        quantity = np.bincount(products, minlength=len(self.products))
+        revenue = np.bincount(
+            products, self.columns["items_price"][items], minlength=len(self.products)
+        )
+        ranked = np.argsort(-quantity, kind="stable")
+        return [
+            {
+                "product_name": self.products[i][0],
+                "product_display": self.products[i][1],
+                "quantity": int(quantity[i]),
+                "revenue": float(revenue[i]),
+            }
+            for i in ranked
+            if quantity[i]
+        ]
+
+    def status_durations(self):
+        order = np.lexsort((self.columns["events_time"], self.columns["events_order"]))
+        ids = self.columns["events_order"][order]
+        statuses = self.columns["events_status"][order]
+        times = self.columns["events_time"][order]
+        # Repeated events of one status count from the first, so a status is
+        # timed from when the order entered it.
+        entered = np.ones(len(ids), dtype=bool)
+        entered[1:] = (ids[1:] != ids[:-1]) | (statuses[1:] != statuses[:-1])
+        ids, statuses, times = ids[entered], statuses[entered], times[entered]
+        same_order = ids[1:] == ids[:-1]
+        pairs = (statuses[:-1] * len(self.statuses) + statuses[1:])[same_order]
+        seconds = np.diff(times)[same_order]
+        keys, inverse = np.unique(pairs, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(keys))
+        totals = np.bincount(inverse, seconds, minlength=len(keys))
+        return [
+            {
+                "from_status": self.statuses[int(key) // len(self.statuses)],
+                "to_status": self.statuses[int(key) % len(self.statuses)],
+                "transitions": int(counts[i]),
+                "total_seconds": float(totals[i]),
+                "avg_seconds": float(totals[i] / counts[i]),
+            }
+            for i, key in enumerate(keys)
+        ]
+
+    def report(self, kind, options):
+        """
+        :param kind: One of REPORT_KINDS.
+        :param options: Report options, currently only "period" for revenue.
+        :return: List of rows.
+        """
+        if kind == "summary":
+            return self.summary()
+        if kind == "revenue":
+            return self.revenue(options.get("period", "day"))
+        if kind == "top-products":
+            return self.top_products()
+        if kind == "status-durations":
+            return self.status_durations()
+        raise Exception(f"unknown report {kind}")
+
+
+class ReportSnapshots:
+    """
+    Writes columnar snapshots of the orders database and serves reports from
+    the latest one, so reports never query the live tables.
+    """
+
+    def __init__(self, db_path, directory):
+        self.db_path = db_path
+        self.directory = directory
+        self.snapshots = 0
+        self.last_duration = None
+        self.last_copy_duration = None
+        self._current = None
+        self._lock = Lock()
+
+    def write(self):
+        """
+        Takes a new snapshot and makes it current.
+        :return: Path of the snapshot.
+        """
+        started = time.monotonic()
+        os.makedirs(self.directory, exist_ok=True)
+        copy_path = os.path.join(self.directory, f".copy-{os.getpid()}.db")
+        try:
+            copy_database(self.db_path, copy_path)
+            self.last_copy_duration = time.monotonic() - started
+            columns, meta = build_columns(read_tables(copy_path))
+        finally:
+            if os.path.exists(copy_path):
+                os.remove(copy_path)
+        name = f"snapshot-{int(meta['snapshot_at'] * 1000)}-{os.getpid()}"
+        staging = os.path.join(self.directory, f".{name}")
+        os.makedirs(staging)
+        for column, values in columns.items():
+            np.save(os.path.join(staging, f"{column}.npy"), values)
+        with open(os.path.join(staging, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        os.rename(staging, os.path.join(self.directory, name))
+        pointer = os.path.join(self.directory, f".CURRENT-{os.getpid()}")
+        with open(pointer, "w") as f:
+            f.write(name)
+        os.replace(pointer, os.path.join(self.directory, "CURRENT"))
+        self._remove_older(name)
+        self.snapshots += 1
+        self.last_duration = time.monotonic() - started
+        logger.info(
+            f"report snapshot {name} written in {self.last_duration:.2f}s "
+            f"({self.last_copy_duration:.2f}s copying the database): "
+            f"{len(columns['orders_id'])} orders, {len(columns['items_order'])} items"
+        )
+        return os.path.join(self.directory, name)
+
+    def _remove_older(self, name):
+        # Readers that mapped an older snapshot keep their open files.
+        for entry in os.listdir(self.directory):
+            if entry.startswith("snapshot-") and entry < name:
+                shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
+
+    def current(self):
+        """
+        :return: The latest Snapshot, or None if none has been written.
+        """
+        if np is None:
+            raise Exception("reports need numpy, which is not installed")
+        try:
+            with open(os.path.join(self.directory, "CURRENT")) as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return self._current
+        with self._lock:
+            if self._current is None or os.path.basename(self._current.path) != name:
+                try:
+                    self._current = Snapshot(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    logger.warning(f"report snapshot {name} was removed, keeping the previous one")
+            return self._current
+
+    def start(self, interval_seconds):
+        """
+        Writes a snapshot every interval_seconds on a background thread.
+        """
+        if np is None:
+            logger.warning("numpy is not installed, report snapshots are disabled")
+            return
+
+        def run():
+            while True:
+                try:
+                    self.write()
+                except Exception as e:
+                    logger.error(f"error writing report snapshot: {e}")
+                time.sleep(interval_seconds)
+
+        Thread(target=run, daemon=True).start()
+
+    def gauges(self):
+        current = self._current
+        return {
+            "report_snapshots": self.snapshots,
+            "report_snapshot_seconds": round(self.last_duration, 3)
+            if self.last_duration is not None
+            else None,
+            "report_snapshot_copy_seconds": round(self.last_copy_duration, 3)
+            if self.last_copy_duration is not None
+            else None,
+            "report_snapshot_age_seconds": round(time.time() - current.snapshot_at, 1)
+            if current is not None
+            else None,
+        }
@@ -0,0 +1,64 @@
+from .log_config import setup_logger
+import csv
+import re
+import os
+
+logger = setup_logger(__name__)
+
+# Zone of addresses that match no row of the mapping table.
+UNZONED = "unzoned"
+
+POSTCODE = re.compile(r"\b(\d{5})(?:-\d{4})?\b")
+
+
+class ZoneMap:
+    """
+    Maps delivery addresses to delivery zones with a local table, no geocoder.
+
+    Each row of the table maps a key to a zone. A key of digits is a postcode
+    prefix; the longest prefix of the address's postcode wins. Any other key is
+    a place name, matched against the comma separated parts of the address.
+    """
+
+    def __init__(self, rows):
+        self.prefixes = {}
+        self.places = {}
+        for key, zone in rows:
+            key = key.strip().lower()
+            if key.isdigit():
+                self.prefixes[key] = zone.strip()
+            elif key:
+                self.places[key] = zone.strip()
+        self.prefix_lengths = sorted({len(key) for key in self.prefixes}, reverse=True)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, newline="") as f:
+            rows = [(row["key"], row["zone"]) for row in csv.DictReader(f)]
+        logger.info(f"loaded {len(rows)} delivery zone mappings from {path}")
+        return cls(rows)
+
+    def zone_for(self, address):
+        """
+        :param address: Free form delivery address.
+        :return: The zone of the address, or UNZONED.
+        """
+        if not address:
+            return UNZONED
+        match = POSTCODE.search(address)
+        if match:
+            postcode = match.group(1)
+            for length in self.prefix_lengths:
+                zone = self.prefixes.get(postcode[:length])
+                if zone is not None:
+                    return zone
+        for part in address.lower().split(","):
+            place = re.sub(r"\s+", " ", re.sub(r"[\d-]+", " ", part)).strip()
+            zone = self.places.get(place)
+            if zone is not None:
+                return zone
+        return UNZONED
+
+
+def default_zones_path():
+    return os.path.join(os.path.dirname(__file__), "zones.csv")
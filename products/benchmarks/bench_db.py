@@ -0,0 +1,188 @@
+"""
+Measures the products read functions against synthetic databases of growing
+size. The functions are called directly with a stub context, as a node's
+workers call them. get_products returns every product, so its latency grows
+with the table; search_products reads the full-text index.
+
+Results are written as tab separated values sorted by function and size, so
+runs on two commits can be diffed, or compared with --baseline.
+
+    python benchmarks/bench_db.py --sizes 10000 100000 1000000 --output products.tsv
+    python benchmarks/bench_db.py --data-dir /tmp/bench-data --baseline products.tsv
+"""
+
+from products import get_products, search_products, start_products_db
+from contextlib import redirect_stdout
+import tempfile
+import argparse
+import logging
+import random
+import time
+import csv
+import os
+
+ADJECTIVES = ["spicy", "grilled", "crispy", "vegan", "smoked", "classic", "double", "garlic"]
+DISHES = ["chicken", "beef", "tofu", "salmon", "mushroom", "pork", "shrimp", "falafel"]
+KINDS = ["sandwich", "burger", "bowl", "wrap", "salad", "taco", "pizza", "curry"]
+# Queries as typed into the search box, the last word cut short.
+QUERIES = ["chick", "spicy bur", "vegan bowl", "smoked sal", "garlic shrimp ta", "pizz"]
+MIN_CALLS = 3
+FIELDS = ["function", "size", "calls", "p50_ms", "p95_ms", "mean_ms", "rows_per_call", "rows_per_s"]
+
+
+class Ctx:
+    def __init__(self, db):
+        self.dependencies = {"products-db": db}
+
+    def get_dependency(self, key):
+        # As resonate's Dependencies.get, which raises KeyError for unknown keys.
+        return self.dependencies[key]
+
+
+def generate(path, size, seed=1):
+    """
+    Writes a products database with size products and their search index.
+    """
+    rng = random.Random(seed)
+
+    def products():
+        for n in range(size):
+            words = [rng.choice(ADJECTIVES), rng.choice(DISHES), rng.choice(KINDS)]
+            yield (
+                "_".join(words) + f"_{n}",
+                " ".join(words).title(),
+                rng.randint(5, 30),
+                "_".join(words) + ".png",
+            )
+
+    partial = f"{path}.partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+    db = start_products_db(partial)
+    db.executemany(
+        "INSERT INTO products (product_name, product_display, product_price, product_image) VALUES (?, ?, ?, ?)",
+        products(),
+    )
+    db.commit()
+    db.close()
+    os.replace(partial, path)
+
+
+def calls(db, size, rng):
+    """
+    :return: Dictionary of function name to a call returning the rows it read.
+    """
+    ctx = Ctx(db)
+    return {
+        "get_products": lambda: len(get_products(ctx)["products"]),
+        "search_products": lambda: len(
+            search_products(ctx, rng.choice(QUERIES))["products"]
+        ),
+    }
+
+
+def measure(call, seconds, max_calls):
+    """
+    Calls call until seconds have passed or it was called max_calls times,
+    after one warm-up call.
+    """
+    call()
+    latencies = []
+    rows = 0
+    started = time.perf_counter()
+    while len(latencies) < max_calls and (
+        len(latencies) < MIN_CALLS or time.perf_counter() - started < seconds
+    ):
+        call_started = time.perf_counter()
+        rows += call()
+        latencies.append(time.perf_counter() - call_started)
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        "calls": len(latencies),
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+        "mean_ms": total / len(latencies) * 1000,
+        "rows_per_call": rows / len(latencies),
+        "rows_per_s": rows / total if total else 0,
+    }
+
+
+def rounded(value):
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    return str(value)
+
+
+def write_results(results, path):
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, FIELDS, delimiter="\t", lineterminator="\n")
+        writer.writeheader()
+        for result in results:
+            writer.writerow({key: rounded(value) for key, value in result.items()})
+
+
+def read_baseline(path):
+    with open(path, newline="") as file:
+        return {
+            (row["function"], row["size"]): float(row["p50_ms"])
+            for row in csv.DictReader(file, delimiter="\t")
+        }
+
+
+def print_results(results, baseline):
+    print(
+        f"{'function':<30} {'size':>8} {'calls':>6} {'p50 ms':>9} {'p95 ms':>9} "
+        f"{'rows/call':>10} {'rows/s':>10}" + (f" {'p50 vs base':>12}" if baseline else "")
+    )
+    for result in results:
+        line = (
+            f"{result['function']:<30} {result['size']:>8} {result['calls']:>6} "
+            f"{result['p50_ms']:>9.3f} {result['p95_ms']:>9.3f} "
+            f"{result['rows_per_call']:>10.1f} {result['rows_per_s']:>10.0f}"
+        )
+        before = baseline.get((result["function"], str(result["size"]))) if baseline else None
+        if before:
+            line += f" {(result['p50_ms'] / before - 1) * 100:>+11.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--seconds", type=float, default=2, help="time spent per function and size")
+    parser.add_argument("--calls", type=int, default=200, help="most calls per function and size")
+    parser.add_argument("--data-dir", default=None, help="keep the generated databases here and reuse them")
+    parser.add_argument("--output", default=None, help="write the results as TSV")
+    parser.add_argument("--baseline", default=None, help="TSV of an earlier run to compare p50 with")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    baseline = read_baseline(args.baseline) if args.baseline else None
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        data_dir = args.data_dir or directory
+        os.makedirs(data_dir, exist_ok=True)
+        for size in args.sizes:
+            path = os.path.join(data_dir, f"products-{size}.db")
+            if not os.path.exists(path):
+                started = time.perf_counter()
+                generate(path, size)
+                print(f"generated {path} in {time.perf_counter() - started:.1f}s")
+            db = start_products_db(path)
+            rng = random.Random(2)
+            for function, call in calls(db, size, rng).items():
+                # Some functions print what they read.
+                with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                    result = measure(call, args.seconds, args.calls)
+                results.append({"function": function, "size": size, **result})
+            db.close()
+
+    results.sort(key=lambda result: (result["function"], result["size"]))
+    print_results(results, baseline)
+    if args.output:
+        write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
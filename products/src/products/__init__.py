@@ -1,21 +1,59 @@
-from resonate.task_sources.poller import Poller
 from resonate.stores.remote import RemoteStore
 from resonate.resonate import Resonate
 from .log_config import setup_logger
+from .codec import install_payload_encoder, install_wire_encoder
+from .profiling import Profiler, start_profiling
+from .backup import backup_settings, restore_command, start_backups
+from .node import (
+    node_gauges,
+    node_settings,
+    resize_worker_pool,
+    start_admin_server,
+    start_pollers,
+)
+from .replica import ReplicaDatabase
 from threading import Event
 import sqlite3
+import re
 import os
 
 logger = setup_logger(__name__)
 
-resonate = Resonate(
-    store=RemoteStore(url="http://localhost:8001"),
-    task_source=Poller(url="http://localhost:8002", group="products-service-nodes"),
+# Primary nodes own the database and serve reads and writes. Replica nodes poll
+# a separate read group and serve lookups from a periodically refreshed copy.
+PRODUCTS_ROLE = os.getenv("PRODUCTS_ROLE", "primary")
+PRODUCTS_DB_PATH = os.path.join(os.path.dirname(__file__), "products.db")
+PRODUCTS_REPLICA_SOURCE = os.getenv("PRODUCTS_REPLICA_SOURCE", PRODUCTS_DB_PATH)
+PRODUCTS_REPLICA_REFRESH_SECONDS = float(
+    os.getenv("PRODUCTS_REPLICA_REFRESH_SECONDS", "5")
 )
 
+node = node_settings("PRODUCTS")
+
+# Primary nodes also poll an interactive group, which the gateway sends the
+# reads behind its views to, and run its tasks ahead of the others.
+if PRODUCTS_ROLE == "replica":
+    poll_group = "products-service-read-nodes"
+    interactive_group = None
+else:
+    poll_group = "products-service-nodes"
+    interactive_group = "products-service-interactive-nodes" if node["interactive"] else None
+backup_config = backup_settings("PRODUCTS")
+store = None
+poller = None
+resonate = None
+# Only primary nodes back up the database.
+backups = None
+registered_functions = []
+profiler = Profiler("products")
+
 
-def start_products_db():
-    db_path = os.path.join(os.path.dirname(__file__), "products.db")
+def register(func):
+    registered_functions.append(func)
+    return func
+
+
+def start_products_db(db_path=PRODUCTS_DB_PATH):
     db = sqlite3.connect(db_path, check_same_thread=False)
     stmt = db.cursor()
     stmt.execute(
@@ -29,12 +67,66 @@ def start_products_db():
         );
     """
     )
+    start_products_search(stmt)
     db.commit()
     logger.info("products database initialized")
     return db
 
 
-@resonate.register
+def start_products_search(stmt):
+    """
+    Creates the full-text index over product names and display names. The
+    triggers keep it in sync with every insert, update and delete on products.
+    """
+    stmt.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'"
+    )
+    exists = stmt.fetchone() is not None
+    stmt.executescript(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            product_name,
+            product_display,
+            content = 'products',
+            content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        );
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts (rowid, product_name, product_display)
+            VALUES (new.id, new.product_name, new.product_display);
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, product_name, product_display)
+            VALUES ('delete', old.id, old.product_name, old.product_display);
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, product_name, product_display)
+            VALUES ('delete', old.id, old.product_name, old.product_display);
+            INSERT INTO products_fts (rowid, product_name, product_display)
+            VALUES (new.id, new.product_name, new.product_display);
+        END;
+    """
+    )
+    if not exists:
+        # index the products that were added before search existed
+        stmt.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+        logger.info("products search index built")
+
+
+def search_terms(query):
+    """
+    Turns free text into an FTS5 query matching every word, the last one as a
+    prefix so results update while the user types.
+    :return: The FTS5 query, or None if the text has no words.
+    """
+    words = re.findall(r"[^\W_]+", query.lower())
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words) + "*"
+
+
+@register
 def add_product(ctx, data):
     try:
         db = ctx.get_dependency("products-db")
@@ -58,7 +150,7 @@ def add_product(ctx, data):
         raise Exception(f"Error adding product: {str(e)}")
 
 
-@resonate.register
+@register
 def get_products(ctx):
     print("Getting products from database...")
     try:
@@ -81,7 +173,39 @@ def get_products(ctx):
         raise Exception(f"Error getting products: {str(e)}")
 
 
-@resonate.register
+@register
+def search_products(ctx, query, limit=20):
+    try:
+        terms = search_terms(query)
+        if terms is None:
+            return {"success": True, "message": "no search terms", "products": []}
+        db = ctx.get_dependency("products-db")
+        stmt = db.cursor()
+        # product names weigh twice as much as display names in the ranking
+        stmt.execute(
+            """
+            SELECT products.* FROM products_fts
+            JOIN products ON products.id = products_fts.rowid
+            WHERE products_fts MATCH ?
+            ORDER BY bm25(products_fts, 2.0, 1.0)
+            LIMIT ?
+        """,
+            (terms, limit),
+        )
+        columns = [column[0] for column in stmt.description]
+        products = [dict(zip(columns, row)) for row in stmt.fetchall()]
+
+        return {
+            "success": True,
+            "message": f"{len(products)} products found",
+            "products": products,
+        }
+    except Exception as e:
+        logger.error(f"error searching products: {e}")
+        raise Exception(f"Error searching products: {str(e)}")
+
+
+@register
 def remove_product(ctx, product_name):
     try:
         db = ctx.get_dependency("products-db")
@@ -94,14 +218,61 @@ def remove_product(ctx, product_name):
         raise Exception(f"Error removing product: {str(e)}")
 
 
-resonate.set_dependency("products-db", start_products_db())
+def startup():
+    """
+    Opens the database and connects the node to the Resonate server. Importing
+    the module has no side effects; main() calls this before serving.
+    :return: The Resonate instance.
+    """
+    global store, poller, resonate, backups
+    if PRODUCTS_ROLE == "replica":
+        db = ReplicaDatabase(PRODUCTS_REPLICA_SOURCE, PRODUCTS_REPLICA_REFRESH_SECONDS)
+    else:
+        db = start_products_db()
+        backups = start_backups(db, "products", backup_config)
+    store = RemoteStore(url="http://localhost:8001")
+    install_wire_encoder(store)
+    poller = start_pollers(
+        "http://localhost:8002", poll_group, interactive_group, node, store
+    )
+    resonate = Resonate(store=store, task_source=poller)
+    install_payload_encoder(resonate)
+    resize_worker_pool(resonate, node["workers"])
+    if interactive_group is not None:
+        poller.prioritize(resonate, node["interactive_workers"])
+    for func in registered_functions:
+        profiler.register(resonate, func)
+    resonate.set_dependency("products-db", db)
+    start_profiling(profiler)
+    return resonate
 
 
 def main():
-    logger.info("products service app node running")
+    startup()
+    logger.info(f"products service app node running as {PRODUCTS_ROLE}")
+    if node["admin_port"]:
+        start_admin_server(
+            node["admin_port"],
+            {
+                "/gauges": lambda: node_gauges(resonate, poller),
+                **profiler.admin_routes(),
+                **(backups.admin_routes() if backups else {}),
+            },
+            {
+                **profiler.admin_actions(),
+                **(backups.admin_actions() if backups else {}),
+            },
+        )
     Event().wait()
 
 
+def restore():
+    """
+    Restores the products database from a backup; the node must be stopped.
+    """
+    restore_command("products", PRODUCTS_DB_PATH, backup_config)
+
+
 # Run the main function when the script is executed
 if __name__ == "__main__":
     main()
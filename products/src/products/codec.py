@@ -0,0 +1,141 @@
+from resonate.encoders import IEncoder, JsonEncoder
+from .log_config import setup_logger
+from threading import local
+import importlib
+import base64
+import os
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = setup_logger(__name__)
+
+# Format used for promise data written by this process: "json" or "msgpack".
+# Every process decodes every format, so nodes can be switched one at a time.
+PAYLOAD_CODEC = os.getenv("PAYLOAD_CODEC", "json")
+# MessagePack payloads at least this large are compressed with zstd.
+PAYLOAD_COMPRESS_BYTES = int(os.getenv("PAYLOAD_COMPRESS_BYTES", "4096"))
+
+# Binary payloads start with a byte that never appears in UTF-8 text, so they
+# cannot be mistaken for JSON written by older nodes.
+MAGIC = b"\xc1N"
+MSGPACK = b"m"
+MSGPACK_ZSTD = b"z"
+
+
+class WireEncoder(IEncoder):
+    """
+    Store encoder carrying both JSON text and binary payloads as base64.
+    Replaces the store's Base64Encoder, which only accepts text.
+    """
+
+    def encode(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        return base64.b64encode(data).decode()
+
+    def decode(self, data):
+        data = base64.b64decode(data)
+        if data.startswith(MAGIC):
+            return data
+        return data.decode()
+
+
+def _default(value):
+    if isinstance(value, Exception):
+        cls = type(value)
+        return {
+            "__type": f"{cls.__module__}.{cls.__qualname__}",
+            "attributes": value.__dict__,
+        }
+    raise TypeError(f"cannot encode {type(value).__name__}")
+
+
+def _object_hook(value):
+    if "__type" in value:
+        module_name, class_name = value["__type"].rsplit(".", 1)
+        error_cls = getattr(importlib.import_module(module_name), class_name)
+        return error_cls(**value["attributes"])
+    return value
+
+
+class PayloadEncoder(IEncoder):
+    """
+    Encodes function arguments and results for the promise store, as JSON or
+    as MessagePack compressed with zstd above PAYLOAD_COMPRESS_BYTES.
+    Decoding detects the format from the payload itself.
+    """
+
+    def __init__(self, codec=PAYLOAD_CODEC, compress_bytes=PAYLOAD_COMPRESS_BYTES):
+        if codec == "msgpack" and msgpack is None:
+            logger.warning("msgpack is not installed, encoding payloads as json")
+            codec = "json"
+        if codec not in ("json", "msgpack"):
+            raise Exception(f"unknown payload codec {codec}")
+        self.codec = codec
+        self.compress_bytes = compress_bytes if zstandard is not None else None
+        self._json = JsonEncoder()
+        # zstd contexts must not be shared between threads
+        self._local = local()
+
+    def encode(self, data):
+        if self.codec == "json":
+            return self._json.encode(data)
+        body = msgpack.packb(data, default=_default)
+        if self.compress_bytes is not None and len(body) >= self.compress_bytes:
+            return MAGIC + MSGPACK_ZSTD + self._compressor().compress(body)
+        return MAGIC + MSGPACK + body
+
+    def decode(self, data):
+        if isinstance(data, str):
+            return self._json.decode(data)
+        if msgpack is None:
+            raise Exception("received a msgpack payload but msgpack is not installed")
+        format, body = data[len(MAGIC) : len(MAGIC) + 1], data[len(MAGIC) + 1 :]
+        if format == MSGPACK_ZSTD:
+            if zstandard is None:
+                raise Exception("received a zstd payload but zstandard is not installed")
+            body = self._decompressor().decompress(body)
+        elif format != MSGPACK:
+            raise Exception(f"unknown payload format {format!r}")
+        return msgpack.unpackb(body, object_hook=_object_hook, strict_map_key=False)
+
+    def _compressor(self):
+        if not hasattr(self._local, "compressor"):
+            self._local.compressor = zstandard.ZstdCompressor(level=3)
+        return self._local.compressor
+
+    def _decompressor(self):
+        if not hasattr(self._local, "decompressor"):
+            self._local.decompressor = zstandard.ZstdDecompressor()
+        return self._local.decompressor
+
+
+def install_wire_encoder(store):
+    """
+    Lets the store carry binary payloads. Must be called before the store is
+    handed to Resonate.
+    """
+    wire = WireEncoder()
+    store._encoder = wire
+    store.promises._encoder = wire
+    store.callbacks._encoder = wire
+    store.tasks._encoder = wire
+
+
+def install_payload_encoder(resonate):
+    """
+    Replaces the scheduler's JsonEncoder with a PayloadEncoder.
+    :return: The installed encoder.
+    """
+    encoder = PayloadEncoder()
+    resonate._scheduler._encoder = encoder
+    logger.info(f"encoding payloads as {encoder.codec}")
+    return encoder
@@ -0,0 +1,45 @@
+from .log_config import setup_logger
+from threading import Thread
+import sqlite3
+import time
+
+logger = setup_logger(__name__)
+
+
+class ReplicaDatabase:
+    """
+    Read-only in-memory copy of a SQLite database file, refreshed from the
+    primary with the online backup API on a background thread.
+    """
+
+    def __init__(self, source_path, refresh_seconds):
+        self._source_path = source_path
+        self._refresh_seconds = refresh_seconds
+        self._db = self._snapshot()
+        Thread(target=self._refresh, daemon=True).start()
+
+    def _snapshot(self):
+        source = sqlite3.connect(f"file:{self._source_path}?mode=ro", uri=True)
+        try:
+            db = sqlite3.connect(":memory:", check_same_thread=False)
+            source.backup(db)
+        finally:
+            source.close()
+        db.execute("PRAGMA query_only = ON")
+        return db
+
+    def _refresh(self):
+        while True:
+            time.sleep(self._refresh_seconds)
+            try:
+                # Cursors opened on the previous copy keep it alive until
+                # their reads finish.
+                self._db = self._snapshot()
+            except Exception as e:
+                logger.error(f"error refreshing replica of {self._source_path}: {e}")
+
+    def cursor(self):
+        return self._db.cursor()
+
+    def commit(self):
+        raise Exception("replica database is read-only")